@@ -29,6 +29,8 @@ A quick plotting program for creating fast sketches of data.
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 ##############################
+import time
+START_TIME = time.time()  # for --timing
 # plotting boilerplate / cargo cult
 import matplotlib
 matplotlib.use('Agg')
@@ -36,96 +38,156 @@ matplotlib.use('Agg')
 # the param pdf.fonttype allows for text to be editable in Illustrator.
 # Use either Output Type 3 (Type3) or Type 42 (TrueType)
 matplotlib.rcParams['pdf.fonttype'] = 42
-import matplotlib.backends.backend_pdf as pltBack
+import matplotlib.collections as collections
 import matplotlib.lines as lines
-import matplotlib.patches as patches
 import matplotlib.pyplot as plt
-import matplotlib.pylab as pylab
-from matplotlib.ticker import ScalarFormatter, FormatStrFormatter
+from matplotlib.ticker import NullLocator
 import numpy
+# scipy.stats and matplotlib.backends.backend_pdf are slow to import and
+# only some plots need them, see ImportModule().
 ##############################
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+import bz2
+import copy
+import errno
+import hashlib
+import io
+import json
+import multiprocessing
 import os
-from scipy.stats import scoreatpercentile, linregress, gaussian_kde
+from StringIO import StringIO
 import sys
 import random
+import resource
+import shlex
+import signal
+import socket
+import struct
+import tempfile
+import traceback
+import zlib
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None
+IMPORTED_TIME = time.time()  # for --timing
+IMPORTED_CPU = sum(os.times()[:4])  # for --profile
+IMPORTED_RSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
 
-COLOR_MAPS = [m for m in plt.cm.datad if not m.endswith("_r")]
+# slow modules that only some plots need, loaded by ImportModule(). a
+# quick_plot --serve process loads them up front.
+LAZY_MODULES = ['scipy.stats', 'matplotlib.backends.backend_pdf']
+# (module name, seconds) of every module loaded by ImportModule()
+LAZY_IMPORT_TIMES = []
+# (stage name, time) of every stage of Run() reached so far, for --timing
+STAGE_TIMES = []
+# (cpu seconds, peak rss in ru_maxrss units) at every stage of
+# STAGE_TIMES, for --profile
+STAGE_USAGE = []
+# rows_read, rows_dropped and artists of the current plot, for --profile
+PROFILE_COUNTS = {}
+# inputs parsed up front by --batch, keyed on (absolute path, label
+# column). values are the arguments of ColumnReader.replay().
+PARSED_INPUTS = {}
+# leading bytes of a --watch input compared to notice it being rewritten
+WATCH_HEAD_BYTES = 256
+# approximate number of bytes of text handed to the column parser at a time
+PARSE_CHUNK_BYTES = 1 << 22
+# largest number of rows offered to a reservoir sample at a time
+RESERVOIR_BLOCK_ROWS = 1 << 20
+# number of points binned at a time by --aggregate
+AGGREGATE_CHUNK_ROWS = 1 << 20
+# number of points thinned at a time by --decimate
+DECIMATE_CHUNK_ROWS = 1 << 20
+# files with at most this many values get an exact density estimate
+DENSITY_EXACT_ROWS = 1 << 14
+# largest grid the binned density estimate is computed on
+DENSITY_MAX_GRID = 1 << 16
+# number of values binned at a time by the density estimate
+DENSITY_CHUNK_ROWS = 1 << 20
+# shade of a pixel holding a single point, so lone points stay visible
+AGGREGATE_MIN_SHADE = 0.25
+# matrices with more cells than this are drawn as a raster
+MATRIX_RASTER_CELLS = 1 << 16
+# inches above the --facet grid given over to --title
+FACET_TITLE_HEIGHT = 0.4
+# number of points added to a 2D histogram at a time
+HISTOGRAM_CHUNK_ROWS = 1 << 20
+# number of rows added to the --regression sums at a time
+REGRESSION_CHUNK_ROWS = 1 << 20
+# number of compressed bytes inflated at a time
+COMPRESSED_CHUNK_BYTES = 1 << 16
+# parsed columns are held about this many times over while being read,
+# as chunks and then joined into one array
+MEMORY_COPIES = 2
+# leading bytes that identify compressed inputs
+COMPRESSION_MAGIC = [('\x1f\x8b', 'gzip'),
+                     ('BZh', 'bz2'),
+                     ('\xfd7zXZ\x00', 'xz')]
 
 
 class BadInput(Exception):
   pass
 
 
-class Row(object):
-  """ Class Row holds a single line of a file in split format.
-  """
-  def __init__(self):
-    self.columns = []
-    self.line_number = None
+class JobTimeout(Exception):
+  pass
 
 
 class Data(object):
   """ Class Data holds data from one file for plotting.
   """
   def __init__(self):
-    self.rows = None  # this will be a list of lists.
+    self.matrix = None  # 2D numpy array for --mode matrix
     self.x = None  # this will be a numpy array
     self.y = None
     self.xtick_labels = None
     self.label = ''
-  def process_data(self, args):
-    if args.mode == 'matrix':
-      self._create_matrix(args)
-    i = 1
-    for r in self.rows:
+    self.num_rows = None  # number of rows read, before any sampling
+    self.num_dropped = None  # rows holding a NaN, counted for --profile
+    # (counts, xedges, yedges) for --mode contour or (counts, edges) for
+    # --mode hist, when counted while streaming
+    self.histogram = None
+    self.regression = None  # RegressionStats of every row read
+    self.limits = None  # (xmin, xmax, ymin, ymax) of this file alone
+  def process_columns(self, columns, labels, args, plotted=None):
+    """ fill x, y and xtick_labels from the numpy arrays of a ColumnReader.
+    plotted is the x and y, or just the y, column to use, by default
+    --columns. rows where x or y is NaN are dropped.
+    """
+    if plotted is None:
+      plotted = args.columns
+    if len(plotted) > 1:
+      # get 2D data
+      x = columns[plotted[0]]
+      y = columns[plotted[1]]
+      keep = ~numpy.isnan(x)
+      if keep.any():
+        args.xmin = min(args.xmin, numpy.min(x[keep]))
+        args.xmax = max(args.xmax, numpy.max(x[keep]))
+      keep &= ~numpy.isnan(y)
+    else:
+      # get just 1D data
       x = None
-      y = None
-      label = None
-      if len(args.columns) > 1:
-        # get 2D data
-        x = self._get_element(r, args.columns[0])
-        y = self._get_element(r, args.columns[1])
-        if numpy.isnan(x):
-          continue
-        if args.xmin > x:
-          args.xmin = x
-        if args.xmax < x:
-          args.xmax = x
-      else:
-        # get just 1D data
-        y = self._get_element(r, args.columns[0])
-      # xtick_labels
-      if args.xtick_label_column is not None:
-          label = self._get_element(r, args.xtick_label_column, label_mode=True)
-      if numpy.isnan(y):
-        continue
-      if args.ymin > y:
-        args.ymin = y
-      if args.ymax < y:
-        args.ymax = y
-      if x is None:
-        if args.mode in ('scatter', 'line'):
-          x = i
-          if self.x is None:
-            self.x = []
-          self.x.append(x)
-          i += 1
-      else:
-        if self.x is None:
-          self.x = []
-        self.x.append(x)
-      if self.y is None:
-        self.y = []
-      self.y.append(y)
-      if label is not None:
-        if self.xtick_labels is None:
-          self.xtick_labels = []
-        self.xtick_labels.append(label)
-    # finally, turn the lists into arrays
-    if x is not None:
-      self.x = numpy.array(self.x)
-    self.y = numpy.array(self.y)
+      y = columns[plotted[0]]
+      keep = ~numpy.isnan(y)
+    if not keep.all():
+      y = y[keep]
+      if x is not None:
+        x = x[keep]
+      if labels is not None:
+        labels = [l for l, k in zip(labels, keep) if k]
+    if len(y):
+      args.ymin = min(args.ymin, numpy.min(y))
+      args.ymax = max(args.ymax, numpy.max(y))
+    if x is None and args.mode in ('scatter', 'line'):
+      x = numpy.arange(1, len(y) + 1)
+    self.x = x
+    self.y = y
+    self.xtick_labels = labels
   def reverse_matrix_rows(self):
     """ reverse the matrix row order for matrix plotting.
     """
@@ -134,37 +196,857 @@ class Data(object):
     """ reverse the matrix column order for matrix plotting.
     """
     self.matrix = self.matrix[:, ::-1]
-  def _get_element(self, row, i, label_mode=False):
-    """ internal method, retrieve value in row located at index.
-    if label_mode is True, just return the element at position i.
+
+
+class RegressionStats(object):
+  """ Class RegressionStats keeps the running sums a least squares line needs.
+
+  Blocks of x, y pairs are merged into the count, the means and the
+  centered sums of squares and cross products (the pairwise update of Chan
+  et al.), which stay accurate where raw sums of squares would cancel.
+  Memory use does not grow with the number of pairs.
+  """
+  def __init__(self):
+    self.n = 0
+    self.mean_x = 0.0
+    self.mean_y = 0.0
+    self.ss_x = 0.0
+    self.ss_y = 0.0
+    self.ss_xy = 0.0
+    self.min_x = numpy.nan
+    self.max_x = numpy.nan
+    self.first_x = None
+    self.last_x = None
+  def add(self, x, y):
+    """ add the pairs of numpy arrays x and y, skipping pairs with a NaN.
+    """
+    for start in xrange(0, len(x), REGRESSION_CHUNK_ROWS):
+      end = start + REGRESSION_CHUNK_ROWS
+      self._add_block(x[start:end], y[start:end])
+  def fit(self):
+    """ return (slope, intercept, r, p value) of the least squares line,
+    as scipy.stats.linregress computes them, or None if no line fits.
+    """
+    if self.n < 2 or not self.ss_x > 0:
+      return None
+    slope = self.ss_xy / self.ss_x
+    intercept = self.mean_y - slope * self.mean_x
+    if self.ss_y > 0:
+      r = min(1.0, max(-1.0, self.ss_xy / numpy.sqrt(self.ss_x * self.ss_y)))
+    else:
+      r = 0.0
+    df = self.n - 2
+    if df > 0:
+      tiny = 1.0e-20
+      t = r * numpy.sqrt(df / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+      p = 2 * ImportModule('scipy.stats').t.sf(numpy.abs(t), df)
+    else:
+      p = numpy.nan
+    return slope, intercept, r, p
+  def _add_block(self, x, y):
+    """ internal method, merge one block of pairs into the sums.
+    """
+    keep = ~(numpy.isnan(x) | numpy.isnan(y))
+    if not keep.all():
+      x, y = x[keep], y[keep]
+    n = len(x)
+    if not n:
+      return
+    mean_x, mean_y = numpy.mean(x), numpy.mean(y)
+    dx, dy = x - mean_x, y - mean_y
+    total = self.n + n
+    delta_x, delta_y = mean_x - self.mean_x, mean_y - self.mean_y
+    weight = float(self.n) * n / total
+    self.ss_x += numpy.dot(dx, dx) + delta_x * delta_x * weight
+    self.ss_y += numpy.dot(dy, dy) + delta_y * delta_y * weight
+    self.ss_xy += numpy.dot(dx, dy) + delta_x * delta_y * weight
+    self.mean_x += delta_x * n / total
+    self.mean_y += delta_y * n / total
+    self.n = total
+    self.min_x = numpy.fmin(self.min_x, numpy.min(x))
+    self.max_x = numpy.fmax(self.max_x, numpy.max(x))
+    if self.first_x is None:
+      self.first_x = x[0]
+    self.last_x = x[-1]
+
+
+class ColumnReader(object):
+  """ Class ColumnReader parses whitespace delimited text into numpy columns.
+
+  Text is consumed a chunk of lines at a time. Only the columns named by
+  --columns are converted to numbers, the --xtick_label_column, if any, is
+  kept as strings, and all other columns are discarded as soon as they
+  are read.
+  """
+  def __init__(self, a_file, args):
+    self.a_file = a_file
+    self.label = os.path.basename(a_file)
+    self.wanted = sorted(set(args.columns))
+    self.label_column = args.xtick_label_column
+    self.max_column = max(self.wanted)
+    if self.label_column is not None:
+      self.max_column = max(self.max_column, self.label_column)
+    self.num_columns = None
+    self.column_names = None  # from a header line, if there is one
+    self.last_comment = None
+    self.line_number = 0
+    self.num_rows = 0
+    self.num_dropped = None
+    if args.profile:
+      self.num_dropped = 0
+    self.dtype = numpy.dtype(args.dtype)
+    self.max_bytes = None  # of columns held in memory, from --max_memory
+    if args.max_memory is not None:
+      self.max_bytes = args.max_memory * 1048576
+    self.stored_bytes = 0
+    self.min = dict((c, numpy.nan) for c in self.wanted)
+    self.max = dict((c, numpy.nan) for c in self.wanted)
+    self.chunks = dict((c, []) for c in self.wanted)
+    self.labels = None
+    if self.label_column is not None:
+      self.labels = []
+    self.cache_writer = None  # a CacheWriter, if parses are being cached
+    self.regression = None
+    if args.regression and len(args.columns) > 1:
+      # sums over every row read, whatever is kept of the rows themselves,
+      # for each y column against the x column
+      self.regression_x = args.columns[0]
+      self.regression = dict((y, RegressionStats())
+                             for y in args.columns[1:])
+  def read(self, f):
+    """ parse all of file object f and return (columns, labels).
+    """
+    while True:
+      lines = f.readlines(PARSE_CHUNK_BYTES)
+      if not lines:
+        break
+      self.parse_lines(lines)
+    return self.finish()
+  def parse_lines(self, lines):
+    """ parse a list of raw lines, storing the requested columns.
+    """
+    if self.num_columns is None:
+      self._find_num_columns(lines)
+    block, labels = None, None
+    if self.label_column is None and self.num_columns is not None:
+      block = self._parse_fast(lines)
+    if block is None:
+      block, labels = self._parse_slow(lines)
+    self.line_number += len(lines)
+    self._update_stats(block)
+    self._update_dropped(block)
+    self._update_regression(block)
+    self.store(block, labels)
+    if self.cache_writer is not None:
+      self.cache_writer.write(block, labels)
+    return block
+  def replay(self, block, labels, num_rows, mins, maxs, column_names=None):
+    """ take columns parsed earlier as if they had just been read. block,
+    mins and maxs are keyed on column index and may hold extra columns.
+    """
+    self.num_rows = num_rows
+    self.column_names = column_names
+    for c in self.wanted:
+      self.min[c] = mins[c]
+      self.max[c] = maxs[c]
+    self._update_dropped(block)
+    self._update_regression(block)
+    self.store(block, labels)
+  def store(self, block, labels):
+    """ keep a parsed block of columns, as --dtype, and its labels, if any.
+    memory mapped columns are kept as they are.
+    """
+    for c in self.wanted:
+      column = block[c]
+      if not isinstance(column, numpy.memmap):
+        if column.dtype != self.dtype:
+          column = column.astype(self.dtype)
+        self.stored_bytes += column.nbytes
+      self.chunks[c].append(column)
+    if labels is not None:
+      self.labels.extend(labels)
+    self._check_memory('--stream and --downsample')
+  def finish(self):
+    """ return a dict of numpy arrays keyed on column index and the labels.
+    """
+    columns = {}
+    for c in self.wanted:
+      if len(self.chunks[c]) == 1:
+        columns[c] = self.chunks[c][0]
+      elif self.chunks[c]:
+        columns[c] = numpy.concatenate(self.chunks[c])
+      else:
+        columns[c] = numpy.zeros(0, dtype=self.dtype)
+    return columns, self.labels
+  def _check_memory(self, remedy):
+    """ internal method, stop reading once the columns held in memory
+    outgrow --max_memory, rather than running out of memory.
+    """
+    if self.max_bytes is not None and self.stored_bytes > self.max_bytes:
+      raise BadInput('Input file %s takes more than the --max_memory of %g '
+                     'MB, read it with %s.'
+                     % (self.a_file, self.max_bytes / 1048576, remedy))
+  def _update_stats(self, block):
+    """ internal method, track the row count and the min and max of each
+    column, ignoring NaNs.
+    """
+    n = len(block[self.wanted[0]])
+    if not n:
+      return
+    self.num_rows += n
+    for c in self.wanted:
+      self.min[c] = numpy.fmin(self.min[c], numpy.fmin.reduce(block[c]))
+      self.max[c] = numpy.fmax(self.max[c], numpy.fmax.reduce(block[c]))
+  def _update_dropped(self, block):
+    """ internal method, count the rows of a block holding a NaN in any
+    requested column, for --profile.
+    """
+    if self.num_dropped is not None and self.wanted:
+      dropped = numpy.zeros(len(block[self.wanted[0]]), dtype=bool)
+      for c in self.wanted:
+        dropped |= numpy.isnan(block[c])
+      self.num_dropped += int(numpy.count_nonzero(dropped))
+  def _update_regression(self, block):
+    """ internal method, add a block's x, y pairs to the --regression sums.
+    """
+    if self.regression is not None:
+      for y_column, stats in self.regression.iteritems():
+        stats.add(block[self.regression_x], block[y_column])
+  def _find_num_columns(self, lines):
+    """ internal method, set the number of columns from the first data line.
+    """
+    line_number = self.line_number
+    for line in lines:
+      line_number += 1
+      line = line.strip()
+      if line.startswith('#'):
+        self.last_comment = line
+        continue
+      self._check_num_columns(line.split(), line_number, line)
+      if self.last_comment is not None:
+        # a comment naming every column just before the data is a header
+        names = self.last_comment.lstrip('#').split()
+        if len(names) == self.num_columns:
+          self.column_names = [n.decode('utf-8', 'replace') for n in names]
+      return
+  def _check_num_columns(self, columns, line_number, line):
+    """ internal method, all lines must have as many columns as the first.
+    """
+    if self.num_columns is None:
+      self.num_columns = len(columns)
+      if self.num_columns <= self.max_column:
+        raise BadInput('Input file %s has only %d columns, you requested a '
+                       'column, %d, which is out of bounds.'
+                       % (self.a_file, self.num_columns, self.max_column + 1))
+    elif self.num_columns != len(columns):
+      raise BadInput('Input file %s had %d columns, switches to %d '
+                     'columns on line %d:\n%s\n'
+                     % (self.a_file, self.num_columns, len(columns),
+                        line_number, line))
+  def _parse_fast(self, lines):
+    """ internal method, parse lines without visiting them one at a time.
+    returns None if the lines are not well formed, in which case the line
+    by line parser is used to produce the appropriate error.
+    """
+    tokens = self._split_tokens(lines)
+    if tokens is None:
+      return None
+    block = {}
+    for c in self.wanted:
+      try:
+        block[c] = numpy.array(tokens[c::self.num_columns], dtype=float)
+      except ValueError:
+        return None
+    return block
+  def _split_tokens(self, lines):
+    """ internal method, split non comment lines into one list of tokens.
+    returns None unless every line holds exactly num_columns tokens.
+    """
+    if any('#' in line for line in lines):
+      lines = [line for line in lines if not line.lstrip().startswith('#')]
+    if not lines:
+      return []
+    text = ''.join(lines)
+    tokens = text.split()
+    if len(tokens) != len(lines) * self.num_columns:
+      return None
+    # every line must hold exactly num_columns tokens. a token starts
+    # wherever a white space byte is followed by a non white space byte.
+    raw = numpy.frombuffer(text, dtype=numpy.uint8)
+    space = numpy.concatenate(([True], raw <= 32))
+    starts = numpy.flatnonzero(space[:-1] > space[1:])
+    ends = numpy.flatnonzero(raw == 10)
+    if len(ends) < len(lines):
+      ends = numpy.append(ends, len(raw))
+    per_line = numpy.diff(
+      numpy.concatenate(([0], numpy.searchsorted(starts, ends))))
+    if (per_line != self.num_columns).any():
+      return None
+    return tokens
+  def _parse_slow(self, lines):
+    """ internal method, parse lines one at a time, raising on bad input.
+    """
+    rows = []
+    line_numbers = []
+    line_number = self.line_number
+    for line in lines:
+      line_number += 1
+      line = line.strip()
+      if line.startswith('#'):
+        continue
+      columns = line.split()
+      self._check_num_columns(columns, line_number, line)
+      rows.append(columns)
+      line_numbers.append(line_number)
+    block = {}
+    for c in self.wanted:
+      try:
+        block[c] = numpy.array([r[c] for r in rows], dtype=float)
+      except ValueError:
+        self._report_bad_value(rows, line_numbers, c)
+        raise
+    labels = None
+    if self.label_column is not None:
+      labels = [r[self.label_column] for r in rows]
+    return block, labels
+  def _report_bad_value(self, rows, line_numbers, i):
+    """ internal method, describe the first value in column i that is not
+    a number.
+    """
+    for r, line_number in zip(rows, line_numbers):
+      try:
+        float(r[i])
+      except ValueError:
+        sys.stderr.write(
+          'Bad input when trying to process file %s at column %d on line %d: '
+          '%s\n' % (self.label, i, line_number, ' '.join(r)))
+        raise
+
+
+class ReservoirReader(ColumnReader):
+  """ Class ReservoirReader keeps a uniform random sample of a file's rows.
+
+  Rows are chosen by reservoir sampling as each chunk is parsed, so memory
+  is bounded by the sample size no matter how long the input is. The
+  sample is handed back in file order, so lines join rows as they were.
+  """
+  def __init__(self, a_file, args, size):
+    ColumnReader.__init__(self, a_file, args)
+    self.size = size
+    self.random = numpy.random.RandomState(args.random_seed)
+    self.seen = 0
+    self.reservoir = dict((c, numpy.zeros(size, dtype=self.dtype))
+                          for c in self.wanted)
+    self.row_numbers = numpy.zeros(size, dtype=numpy.int64)
+    self.reservoir_labels = None
+    if self.label_column is not None:
+      self.reservoir_labels = numpy.zeros(size, dtype=object)
+  def store(self, block, labels):
+    """ offer every row of a parsed block to the reservoir.
+    """
+    n = len(block[self.wanted[0]])
+    if n > RESERVOIR_BLOCK_ROWS:
+      # blocks replayed from the parse cache can be arbitrarily long
+      for i in xrange(0, n, RESERVOIR_BLOCK_ROWS):
+        j = i + RESERVOIR_BLOCK_ROWS
+        self.store(dict((c, block[c][i:j]) for c in self.wanted),
+                   None if labels is None else labels[i:j])
+      return
+    if labels is not None:
+      labels = numpy.array(labels, dtype=object)
+    # the first size rows fill the reservoir directly
+    fill = min(n, max(0, self.size - self.seen))
+    if fill:
+      for c in self.wanted:
+        self.reservoir[c][self.seen:self.seen + fill] = block[c][:fill]
+      self.row_numbers[self.seen:self.seen + fill] = numpy.arange(
+        self.seen, self.seen + fill)
+      if labels is not None:
+        self.reservoir_labels[self.seen:self.seen + fill] = labels[:fill]
+    # row t (0-based, over the whole file) then replaces slot j, drawn
+    # uniformly from [0, t], whenever j lands inside the reservoir.
+    if fill < n:
+      t = numpy.arange(self.seen + fill, self.seen + n)
+      j = (self.random.random_sample(len(t)) * (t + 1)).astype(numpy.int64)
+      chosen = numpy.flatnonzero(j < self.size)
+      # when several rows of a block pick one slot the last of them wins
+      slots, last = numpy.unique(j[chosen][::-1], return_index=True)
+      rows = fill + chosen[::-1][last]
+      for c in self.wanted:
+        self.reservoir[c][slots] = block[c][rows]
+      self.row_numbers[slots] = self.seen + rows
+      if labels is not None:
+        self.reservoir_labels[slots] = labels[rows]
+    self.seen += n
+  def finish(self):
+    """ return the sampled columns and labels, in file order.
+    """
+    k = min(self.seen, self.size)
+    order = numpy.argsort(self.row_numbers[:k], kind='mergesort')
+    columns = dict((c, self.reservoir[c][:k][order]) for c in self.wanted)
+    labels = None
+    if self.reservoir_labels is not None:
+      labels = list(self.reservoir_labels[:k][order])
+    return columns, labels
+
+
+class MatrixReader(ColumnReader):
+  """ Class MatrixReader parses a file of numbers into one 2D float array.
+
+  Every column is kept. Parsed rows are held in memory or, with
+  --matrix_memmap, appended to a temporary file that is memory mapped once
+  the whole file has been read. Values that are not numbers are reported
+  and read as 0.
+  """
+  def __init__(self, a_file, args):
+    ColumnReader.__init__(self, a_file, args)
+    self.blocks = []
+    self.spill = None
+    if args.matrix_memmap:
+      self.spill = tempfile.TemporaryFile()
+  def parse_lines(self, lines):
+    """ parse a list of raw lines, keeping every column.
+    """
+    if self.num_columns is None:
+      self._find_num_columns(lines)
+    matrix = None
+    if self.num_columns is not None:
+      matrix = self._parse_fast(lines)
+    if matrix is None:
+      matrix = self._parse_slow(lines)
+    self.line_number += len(lines)
+    self.num_rows += len(matrix)
+    if matrix.dtype != self.dtype:
+      matrix = matrix.astype(self.dtype)
+    if self.spill is not None:
+      self.spill.write(matrix.tostring())
+    else:
+      self.blocks.append(matrix)
+      self.stored_bytes += matrix.nbytes
+      self._check_memory('--matrix_memmap')
+    return matrix
+  def finish(self):
+    """ return the matrix, a numpy array of shape (rows, columns).
     """
-    if label_mode:
-      return row.columns[i]
+    if not self.num_rows:
+      raise BadInput('Input file %s holds no data to plot.' % self.a_file)
+    if self.spill is not None:
+      self.spill.flush()
+      return numpy.memmap(self.spill, dtype=self.dtype, mode='r',
+                          shape=(self.num_rows, self.num_columns))
+    if len(self.blocks) == 1:
+      return self.blocks[0]
+    return numpy.concatenate(self.blocks)
+  def _parse_fast(self, lines):
+    """ internal method, parse well formed lines in one go, else None.
+    """
+    tokens = self._split_tokens(lines)
+    if tokens is None:
+      return None
     try:
-      x = float(row.columns[i])
+      return numpy.array(tokens, dtype=float).reshape(-1, self.num_columns)
     except ValueError:
-      sys.stderr.write(
-        'Bad input when trying to process file %s at column %d on line %d: %s\n'
-        % (self.label, i, row.line_number, ' '.join(row.columns)))
-      raise
-    return x
-  def _create_matrix(self, args):
-    """ inspect self.rows and try to create a single data matrix from all input.
+      return None
+  def _parse_slow(self, lines):
+    """ internal method, parse lines one at a time, raising on bad input.
     """
-    num_rows = len(self.rows)
-    num_cols = len(self.rows[0].columns)
-    for i in xrange(0, num_rows):
-      if len(self.rows[i].columns) > num_cols:
-        self.matrix = None
-        # this is an error state, all rows need to have same number of columns
-        return
-      self.matrix = numpy.zeros((num_rows, num_cols), dtype=float)
-    for i in xrange(0, len(self.rows)):
-      for j in xrange(0, len(self.rows[i].columns)):
+    rows = []
+    line_number = self.line_number
+    for line in lines:
+      line_number += 1
+      line = line.strip()
+      if line.startswith('#'):
+        continue
+      columns = line.split()
+      self._check_num_columns(columns, line_number, line)
+      row = []
+      for i, value in enumerate(columns):
         try:
-          self.matrix[i][j] = self._get_element(self.rows[i], j)
+          row.append(float(value))
         except ValueError:
-          pass
+          sys.stderr.write(
+            'Bad input when trying to process file %s at column %d on line '
+            '%d: %s\n' % (self.label, i, line_number, ' '.join(columns)))
+          row.append(0.0)
+      rows.append(row)
+    return numpy.array(rows, dtype=float).reshape(-1, self.num_columns)
+
+
+class LimitsReader(ColumnReader):
+  """ Class LimitsReader only tracks the row count and column limits.
+
+  Blocks are discarded as soon as they are parsed. It is the first pass
+  over an input whose limits must be known before it can be streamed.
+  """
+  def store(self, block, labels):
+    pass
+  def finish(self):
+    return {}, None
+
+
+class HistogramReader(ColumnReader):
+  """ Class HistogramReader adds the x, y rows of a file to a 2D histogram.
+
+  Rows are counted as each chunk is parsed and then discarded, so memory
+  is bounded by the number of bins no matter how long the input is.
+  """
+  def __init__(self, a_file, args, bins, limits):
+    ColumnReader.__init__(self, a_file, args)
+    self.x_column, self.y_column = args.columns[0], args.columns[1]
+    self.bins = bins
+    self.limits = limits
+    self.histogram = numpy.zeros((bins, bins))
+    self.xedges = None
+    self.yedges = None
+  def store(self, block, labels):
+    """ count the rows of a parsed block, skipping rows holding a NaN.
+    """
+    x, y = block[self.x_column], block[self.y_column]
+    keep = ~(numpy.isnan(x) | numpy.isnan(y))
+    H, self.xedges, self.yedges = Histogram2D(x[keep], y[keep], self.bins,
+                                              self.limits)
+    self.histogram += H
+  def finish(self):
+    return {}, None
+
+
+class BinCountReader(ColumnReader):
+  """ Class BinCountReader counts the values of a file into fixed bins.
+
+  Values are counted as each chunk is parsed and then discarded, so memory
+  is bounded by the number of bins no matter how long the input is.
+  """
+  def __init__(self, a_file, args, edges):
+    ColumnReader.__init__(self, a_file, args)
+    self.column = args.columns[-1]
+    self.edges = edges
+    self.counts = numpy.zeros(len(edges) - 1, dtype=numpy.int64)
+  def store(self, block, labels):
+    """ count the values of a parsed block.
+    """
+    self.counts += BinCounts(block[self.column], self.edges)
+  def finish(self):
+    return {}, None
+
+
+class WatchedFile(object):
+  """ Class WatchedFile follows an input file that grows, for --watch.
+
+  Only the lines appended since the last update are parsed, by a
+  ColumnReader kept for the life of the file. A line still being written,
+  one without its newline, waits for the next update. If the file shrinks,
+  is replaced, its first bytes change or it is modified without growing,
+  it is read again from the start.
+  """
+  def __init__(self, a_file, args):
+    self.a_file = a_file
+    self.args = args
+    self.reset()
+  def reset(self):
+    """ forget everything read so far.
+    """
+    self.reader = ColumnReader(self.a_file, self.args)
+    self.offset = 0
+    self.inode = None
+    self.mtime = None
+    self.head = ''
+  def update(self):
+    """ parse whatever has been appended since the last update and return
+    True if there were new lines, or if the file was read again.
+    """
+    try:
+      st = os.stat(self.a_file)
+    except OSError:
+      # mid rotation, try again next time
+      return False
+    f = open(self.a_file, 'rb')
+    try:
+      changed = False
+      if self.inode is not None and (
+          st.st_ino != self.inode or st.st_size < self.offset or
+          f.read(len(self.head)) != self.head or
+          (st.st_size == self.offset and st.st_mtime != self.mtime)):
+        self._reread()
+        changed = True
+      elif self.inode is not None and st.st_size == self.offset:
+        return False
+      if not self.offset:
+        self._check_head(f)
+      self.inode = st.st_ino
+      f.seek(self.offset)
+      while True:
+        lines = f.readlines(PARSE_CHUNK_BYTES)
+        if not lines:
+          break
+        partial = not lines[-1].endswith('\n')
+        if partial:
+          lines.pop()
+        if lines:
+          self.offset += sum(len(line) for line in lines)
+          self.reader.parse_lines(lines)
+          changed = True
+        if partial:
+          break
+      if len(self.head) < WATCH_HEAD_BYTES and self.offset:
+        f.seek(0)
+        self.head = f.read(min(self.offset, WATCH_HEAD_BYTES))
+      # taken after reading, so lines written meanwhile are not mistaken
+      # for a rewrite next time
+      self.mtime = os.fstat(f.fileno()).st_mtime
+    finally:
+      f.close()
+    return changed
+  def columns(self):
+    """ return the columns and labels of everything read so far.
+    """
+    columns, labels = self.reader.finish()
+    # keep one array per column so the next finish() is a single join
+    for c in self.reader.wanted:
+      self.reader.chunks[c] = [columns[c]]
+    return columns, labels
+  def _reread(self):
+    """ internal method, start over on a rewritten file.
+    """
+    sys.stderr.write('%s was rewritten, reading it again\n' % self.a_file)
+    self.reset()
+  def _check_head(self, f):
+    """ internal method, refuse compressed input, which cannot be followed.
+    """
+    f.seek(0)
+    head = f.read(max(len(magic) for magic, name in COMPRESSION_MAGIC))
+    for magic, name in COMPRESSION_MAGIC:
+      if head.startswith(magic):
+        raise BadInput('--watch can not follow %s compressed input %s'
+                       % (name, self.a_file))
+
+
+class ParseCache(object):
+  """ Class ParseCache keeps the parsed columns of input files on disk.
+
+  Each entry is a set of raw float64 column files that are memory mapped
+  when read back, a text file of labels if --xtick_label_column was used,
+  and a json .meta file, written last, describing the entry. Entries are
+  keyed on the input's path, size and mtime and on the parse options.
+  """
+  VERSION = 2
+  def __init__(self, args):
+    self.directory = args.cache_dir
+    self.max_bytes = args.cache_max_size * 1024 * 1024
+    self.max_age = args.cache_max_age * 24 * 60 * 60
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+  def key(self, a_file, reader):
+    """ return the name of the cache entry for a_file parsed by reader.
+    """
+    st = os.stat(a_file)
+    description = repr((self.VERSION, os.path.abspath(a_file), st.st_size,
+                        st.st_mtime, reader.wanted, reader.label_column))
+    return hashlib.sha1(description).hexdigest()
+  def path(self, key, suffix):
+    return os.path.join(self.directory, key + suffix)
+  def load(self, a_file, reader):
+    """ feed the cached columns of a_file to reader.
+
+    Returns:
+      True if the entry existed and was handed to the reader, else False.
+    """
+    key = self.key(a_file, reader)
+    try:
+      f = open(self.path(key, '.meta'), 'r')
+      meta = json.load(f)
+      f.close()
+    except (IOError, ValueError):
+      return False
+    num_rows = meta['num_rows']
+    block = {}
+    for c in reader.wanted:
+      column_path = self.path(key, '.%d.bin' % c)
+      if (not os.path.exists(column_path) or
+          os.path.getsize(column_path) != num_rows * 8):
+        return False
+      if num_rows:
+        block[c] = numpy.memmap(column_path, dtype='<f8', mode='r',
+                                shape=(num_rows,))
+      else:
+        block[c] = numpy.zeros(0, dtype=float)
+    labels = None
+    if reader.label_column is not None:
+      try:
+        f = open(self.path(key, '.labels'), 'r')
+        labels = f.read().splitlines()
+        f.close()
+      except IOError:
+        return False
+      if len(labels) != num_rows:
+        return False
+    os.utime(self.path(key, '.meta'), None)  # mark as recently used
+    reader.replay(block, labels, num_rows,
+                  dict(zip(reader.wanted, meta['min'])),
+                  dict(zip(reader.wanted, meta['max'])),
+                  meta['column_names'])
+    return True
+  def writer(self, a_file, reader):
+    """ return a CacheWriter for a new entry for a_file parsed by reader.
+    """
+    return CacheWriter(self, self.key(a_file, reader), reader)
+  def entries(self):
+    """ return a list of (last used time, bytes, key) of every entry.
+    """
+    entries = []
+    sizes = {}
+    for name in os.listdir(self.directory):
+      key = name.split('.')[0]
+      sizes[key] = (sizes.get(key, 0) +
+                    os.path.getsize(os.path.join(self.directory, name)))
+    for key in sizes:
+      meta_path = self.path(key, '.meta')
+      if os.path.exists(meta_path):
+        entries.append((os.path.getmtime(meta_path), sizes[key], key))
+    return entries
+  def remove(self, key):
+    """ delete every file belonging to the entry key.
+    """
+    for name in os.listdir(self.directory):
+      if name.split('.')[0] == key:
+        os.remove(os.path.join(self.directory, name))
+  def evict(self):
+    """ remove entries older than --cache_max_age, then the least recently
+    used entries until the cache fits in --cache_max_size.
+    """
+    now = time.time()
+    entries = sorted(self.entries())
+    total = sum(e[1] for e in entries)
+    for last_used, size, key in entries:
+      if now - last_used > self.max_age or total > self.max_bytes:
+        self.remove(key)
+        total -= size
+
+
+class CacheWriter(object):
+  """ Class CacheWriter writes a new ParseCache entry as a file is parsed.
+  """
+  def __init__(self, cache, key, reader):
+    self.cache = cache
+    self.key = key
+    self.reader = reader
+    # several processes may be writing the same entry at once
+    self.tmp = '.tmp%d' % os.getpid()
+    self.files = {}
+    for c in reader.wanted:
+      self.files[c] = open(cache.path(key, '.%d.bin' % c + self.tmp), 'wb')
+    self.label_file = None
+    if reader.label_column is not None:
+      self.label_file = open(cache.path(key, '.labels' + self.tmp), 'w')
+  def write(self, block, labels):
+    """ append a parsed block to the entry.
+    """
+    for c in self.reader.wanted:
+      self.files[c].write(block[c].astype('<f8').tostring())
+    if self.label_file is not None and labels:
+      self.label_file.write('\n'.join(labels) + '\n')
+  def commit(self):
+    """ finish the entry, making it visible to later runs.
+    """
+    names = ['.%d.bin' % c for c in self.reader.wanted]
+    for c in self.reader.wanted:
+      self.files[c].close()
+    if self.label_file is not None:
+      self.label_file.close()
+      names.append('.labels')
+    for name in names:
+      os.rename(self.cache.path(self.key, name + self.tmp),
+                self.cache.path(self.key, name))
+    meta = {'version': ParseCache.VERSION,
+            'columns': self.reader.wanted,
+            'num_rows': self.reader.num_rows,
+            'min': [float(self.reader.min[c]) for c in self.reader.wanted],
+            'max': [float(self.reader.max[c]) for c in self.reader.wanted],
+            'column_names': self.reader.column_names}
+    f = open(self.cache.path(self.key, '.meta' + self.tmp), 'w')
+    json.dump(meta, f)
+    f.close()
+    os.rename(self.cache.path(self.key, '.meta' + self.tmp),
+              self.cache.path(self.key, '.meta'))
+  def abort(self):
+    """ throw away a partially written entry.
+    """
+    for f in self.files.values():
+      f.close()
+    if self.label_file is not None:
+      self.label_file.close()
+    self.cache.remove(self.key)
+
+
+class InputStream(io.RawIOBase):
+  """ Class InputStream reads a raw byte stream, optionally inflating it.
+
+  head holds bytes already taken from the front of raw, e.g. while
+  sniffing for a compression format, that must be read first. Wrap an
+  InputStream in io.BufferedReader to read it a line at a time.
+  """
+  def __init__(self, raw, head='', compression=None):
+    io.RawIOBase.__init__(self)
+    self.raw = raw
+    self.pending = head
+    self.compression = compression
+    self.decompressor = None
+    if compression is not None:
+      self.decompressor = NewDecompressor(compression)
+    self.buffer = ''
+    self.offset = 0
+  def readable(self):
+    return True
+  def readinto(self, b):
+    while self.offset == len(self.buffer):
+      if not self._fill():
+        return 0
+    n = min(len(b), len(self.buffer) - self.offset)
+    b[:n] = self.buffer[self.offset:self.offset + n]
+    self.offset += n
+    return n
+  def close(self):
+    if not self.closed:
+      self.raw.close()
+    io.RawIOBase.close(self)
+  def _fill(self):
+    """ internal method, refill self.buffer. returns False at end of input.
+    """
+    chunk = self.pending or self.raw.read(COMPRESSED_CHUNK_BYTES)
+    self.pending = ''
+    if not chunk:
+      return False
+    if self.decompressor is None:
+      self.buffer = chunk
+    else:
+      self.buffer = self.decompressor.decompress(chunk)
+      if self.decompressor.unused_data:
+        # concatenated streams, e.g. from cat a.gz b.gz, are read in turn
+        self.pending = self.decompressor.unused_data
+        self.decompressor = NewDecompressor(self.compression)
+    self.offset = 0
+    return True
+
+
+def ImportModule(name):
+  """ Import a module the first time it is needed.
+
+  Args:
+    name: the full dotted name of the module
+
+  Returns:
+    module: the module object
+  """
+  if name not in sys.modules:
+    start = time.time()
+    __import__(name)
+    LAZY_IMPORT_TIMES.append((name, time.time() - start))
+  return sys.modules[name]
+
+
+def ColorMaps():
+  """ Return the names of the matplotlib colormaps, less the reversed ones.
+  """
+  return [m for m in matplotlib.cm.datad if not m.endswith("_r")]
 
 
 def InitArguments(parser):
@@ -173,7 +1055,11 @@ def InitArguments(parser):
   Args:
     parser: an argparse parser object
   """
-  parser.add_argument('files', nargs='+', help='files to plot')
+  parser.add_argument('files', nargs='+',
+                      help=('files to plot, which may be gzip, bzip2 or xz '
+                            'compressed. Use - to read from stdin.'))
+  # set by PlotArrays(), whose files are only the names of its series
+  parser.set_defaults(in_memory=False)
   parser.add_argument('--out', dest='out', default='my_plot',
                       type=str,
                       help=('path/filename where figure will be created. No '
@@ -183,8 +1069,11 @@ def InitArguments(parser):
                             'column, bar, hist, tick, barcode, point, contour, '
                             'density, matrix) default=%(default)s'))
   parser.add_argument('--columns', dest='columns', default=None, type=str,
-                      help=('two numbers, comma separated, can be reverse '
-                            'order, indicates x,y for plotting. 1-based.'))
+                      help=('numbers, comma separated, can be reverse '
+                            'order, indicates x,y for plotting. Give more '
+                            'than two, x,y,y,..., to plot one series per y '
+                            'column, all read in one pass, for --mode line '
+                            'and scatter only. 1-based.'))
   parser.add_argument('--xtick_label_column', type=int,
                       help=('for plot modes bar and column, using this will '
                             'allow for the xtick labels to be shown. 1-based.'))
@@ -192,6 +1081,27 @@ def InitArguments(parser):
                       help=('Randomly sample only n values from each input. '
                             'Can help cutdown on runtime and output size '
                             'for pdfs.'))
+  parser.add_argument('--stream', dest='stream', default=False,
+                      action='store_true',
+                      help=('Read each input in a single streaming pass. With '
+                            '--downsample rows are reservoir sampled so memory '
+                            'is bounded by the sample size, and axis limits '
+                            'still cover every row read. In --mode contour '
+                            'and hist rows are counted into the histogram as '
+                            'they are read; unless its range is given by '
+                            '--xmin, --xmax (and --ymin, --ymax for contour) '
+                            'this takes a second pass to find the range.'))
+  parser.add_argument('--decimate', dest='decimate', default=None, type=str,
+                      help=('For --mode line, thin each series to a few '
+                            'points per horizontal pixel before drawing it. '
+                            'may be in (minmax, lttb). minmax keeps the '
+                            'first, last, lowest and highest point of each '
+                            'pixel column so peaks and dips survive, lttb '
+                            'keeps the point of each column that forms the '
+                            'largest triangle with its neighbours.'))
+  parser.add_argument('--jobs', dest='jobs', default=1, type=int,
+                      help=('Number of processes used to parse input files '
+                            'in parallel. default=%(default)s'))
   parser.add_argument('--colors', dest='colors', default='brewer', type=str,
                       help=('color palatte mode. may be in (bostock, brewer, '
                             'mono, hcl_ggplot2) '
@@ -248,8 +1158,16 @@ def InitArguments(parser):
                             'default=%(default)s'))
   parser.add_argument('--out_format', dest='out_format', default='pdf',
                       type=str,
-                      help=('output format [pdf|png|eps|all]. '
-                            'default=%(default)s'))
+                      help=('output format [pdf|png|eps|all], or a comma '
+                            'separated list of them, e.g. png,pdf. The '
+                            'pdf and eps are each drawn by their own '
+                            'backend, at the same time by separate '
+                            'processes. default=%(default)s'))
+  parser.add_argument('--png_compression', dest='png_compression',
+                      default=None, type=int,
+                      help=('zlib compression level of png output, 0 to 9. '
+                            'Lower levels write faster but larger files. '
+                            'Default is matplotlib\'s.'))
   parser.add_argument('--no_legend', dest='is_legend', default=True,
                       action='store_false',
                       help=('Turns off the filename / color legend. '
@@ -267,6 +1185,109 @@ def InitArguments(parser):
   parser.add_argument('--aspect_equal', dest='aspect_equal', default=False,
                       action='store_true',
                       help='Turn on equal aspect ratio for the plot')
+  parser.add_argument('--timing', dest='timing', default=False,
+                      action='store_true',
+                      help=('Report how long start up and each stage of the '
+                            'plot took, on stderr.'))
+  parser.add_argument('--startup_budget', dest='startup_budget', default=1.0,
+                      type=float,
+                      help=('With --timing, warn if start up, everything '
+                            'before the first input is read, takes longer '
+                            'than this many seconds. default=%(default)s'))
+  parser.add_argument('--profile', dest='profile', default=False,
+                      action='store_true',
+                      help=('Report the wall time, cpu time and peak '
+                            'resident memory of each stage, the rows read '
+                            'and dropped for holding a NaN and the number '
+                            'of artists drawn, on stderr.'))
+  parser.add_argument('--profile_format', dest='profile_format',
+                      default='table', type=str,
+                      help=('Write the --profile report as a table or as '
+                            'a single json line. may be in (table, json) '
+                            'default=%(default)s'))
+  parser.add_argument('--profile_dump', dest='profile_dump', default=None,
+                      type=str,
+                      help=('Run the plot under cProfile and write its '
+                            'statistics to this file, for pstats or '
+                            'snakeviz.'))
+  binary = parser.add_argument_group('binary input')
+  binary.add_argument('--raw_dtype', dest='raw_dtype', default=None,
+                      type=str,
+                      help=('Read inputs as headerless binary numbers of '
+                            'this numpy dtype, e.g. <f8, <f4 or <i4. .npy '
+                            'and .npz inputs are always read as binary.'))
+  binary.add_argument('--raw_columns', dest='raw_columns', default=1,
+                      type=int,
+                      help=('Number of columns in a --raw_dtype input. '
+                            'default=%(default)s'))
+  binary.add_argument('--raw_order', dest='raw_order', default='C',
+                      type=str,
+                      help=('Layout of a --raw_dtype input, C for one row '
+                            'after another, F for one column after '
+                            'another. With F only the --columns plotted '
+                            'are read. default=%(default)s'))
+  memory = parser.add_argument_group('memory')
+  memory.add_argument('--dtype', dest='dtype', default='float64', type=str,
+                      help=('Type the parsed columns are kept as, float64 '
+                            'or float32. float32 halves the memory they '
+                            'take, keeping about 7 significant digits. '
+                            'default=%(default)s'))
+  memory.add_argument('--max_memory', dest='max_memory', default=None,
+                      type=float,
+                      help=('Megabytes the parsed inputs may take. Inputs '
+                            'estimated to need more are read with --stream, '
+                            'and --downsample if the mode needs every row, '
+                            'or with --matrix_memmap, and a warning is '
+                            'written. default is no limit.'))
+  watch = parser.add_argument_group('watch')
+  watch.add_argument('--watch', dest='watch', default=False,
+                     action='store_true',
+                     help=('Keep running and draw the plot again whenever '
+                           'the inputs change, parsing only the lines '
+                           'appended since the last drawing. Stop with '
+                           'control-c.'))
+  watch.add_argument('--watch_interval', dest='watch_interval', default=1.0,
+                     type=float,
+                     help=('Seconds between checks of the inputs. '
+                           'default=%(default)s'))
+  facet = parser.add_argument_group('several files')
+  facet.add_argument('--facet', dest='facet', default=False,
+                     action='store_true',
+                     help=('Draw each series on its own axis, laid out '
+                           'in a grid in one figure. --width and --height '
+                           'then give the size of each axis.'))
+  facet.add_argument('--facet_columns', dest='facet_columns', default=None,
+                     type=int,
+                     help=('Number of axes per row of the --facet grid. '
+                           'Default is the square root of the number of '
+                           'series, rounded up.'))
+  facet.add_argument('--facet_limits', dest='facet_limits',
+                     default='shared', type=str,
+                     help=('shared gives every --facet axis the same x and '
+                           'y limits, independent fits each axis to its own '
+                           'series. default=%(default)s'))
+  facet.add_argument('--multipage', dest='multipage', default=False,
+                     action='store_true',
+                     help=('Write a pdf with one page per series, '
+                           'all read in a single pass.'))
+  aggregate = parser.add_argument_group('aggregated scatter')
+  aggregate.add_argument('--aggregate', dest='aggregate', default=False,
+                         action='store_true',
+                         help=('For --mode scatter, count the points that '
+                               'fall in each pixel of the plot and draw the '
+                               'counts as an image instead of drawing a '
+                               'marker per point. Suited to millions of '
+                               'points.'))
+  aggregate.add_argument('--aggregate_cmap', dest='aggregate_cmap',
+                         type=str, default=None,
+                         help=('Colormap for the counts of all files '
+                               'together. By default the counts of each file '
+                               'shade that file\'s color and the files are '
+                               'blended in order.'))
+  hist = parser.add_argument_group('hist mode')
+  hist.add_argument('--hist_bins', dest='hist_bins', default=10, type=int,
+                    help=('Number of bins, shared by all files. '
+                          'default=%(default)s'))
   contour = parser.add_argument_group('contour mode')
   contour.add_argument('--contour_bin', dest='contour_bin', default=10,
                        type=int,
@@ -280,6 +1301,11 @@ def InitArguments(parser):
                        default=6, type=int,
                        help=('The number of levels in the contour plot, '
                              'default=%(default)s'))
+  contour.add_argument('--contour_smooth', dest='contour_smooth',
+                       default=0.0, type=float,
+                       help=('Smooth the 2D histogram with a Gaussian kernel '
+                             'of this standard deviation, in bins, before '
+                             'drawing contours. default=%(default)s'))
   density = parser.add_argument_group('density mode')
   density.add_argument('--density_covariance', dest='density_covariance',
                        type=float,
@@ -295,11 +1321,19 @@ def InitArguments(parser):
   matrix.add_argument('--matrix_matshow', default=False, action='store_true',
                       help=('Switches the drawing call from pcolor() to '
                             'matshow(). matshow() uses rasters, pcolor() uses '
-                            'vectors. For very large matrices matshow() may be '
-                            'desirable.'))
+                            'vectors. Matrices of more than %d cells are '
+                            'always drawn as a raster.' % MATRIX_RASTER_CELLS))
+  matrix.add_argument('--matrix_aggregate', default='mean', type=str,
+                      help=('How cells are combined when a raster matrix has '
+                            'more rows or columns than the plot has pixels. '
+                            'may be in (mean, max) default=%(default)s'))
+  matrix.add_argument('--matrix_memmap', default=False, action='store_true',
+                      help=('Keep the parsed matrix in a memory mapped '
+                            'temporary file rather than in memory.'))
   matrix.add_argument('--matrix_cmap', type=str, default='binary',
                       help=('The colormap to be used. default=%(default)s. '
-                            'Possible values: ' + '%s' % ', '.join(COLOR_MAPS)))
+                            'Possible values: ' +
+                            '%s' % ', '.join(ColorMaps())))
   matrix.add_argument('--matrix_no_colorbar', default=False,
                       action='store_true',
                       help='turn off the colorbar.')
@@ -309,7 +1343,31 @@ def InitArguments(parser):
                       help='Lower bound of colormap')
   matrix.add_argument('--matrix_colormap_max', type=float,
                       help='Upper bound of colormap')
-
+  cache = parser.add_argument_group('parse cache')
+  cache.add_argument('--cache', dest='cache', default=False,
+                     action='store_true',
+                     help=('Keep the parsed columns of each input in a binary '
+                           'cache so later runs over an unchanged file load '
+                           'them with mmap instead of parsing the text.'))
+  cache.add_argument('--cache_dir', dest='cache_dir', type=str,
+                     default=os.path.join(
+                       os.environ.get('XDG_CACHE_HOME',
+                                      os.path.join(os.path.expanduser('~'),
+                                                   '.cache')),
+                       'quick_plot'),
+                     help='Directory holding the cache. default=%(default)s')
+  cache.add_argument('--cache_rebuild', dest='cache_rebuild', default=False,
+                     action='store_true',
+                     help=('Ignore existing cache entries and parse the '
+                           'inputs again, replacing them. Implies --cache.'))
+  cache.add_argument('--cache_max_size', dest='cache_max_size', default=1024,
+                     type=float,
+                     help=('Evict least recently used entries once the cache '
+                           'exceeds this many megabytes. default=%(default)s'))
+  cache.add_argument('--cache_max_age', dest='cache_max_age', default=30,
+                     type=float,
+                     help=('Evict entries not used for this many days. '
+                           'default=%(default)s'))
 
 
 def CheckArguments(args, parser):
@@ -324,25 +1382,83 @@ def CheckArguments(args, parser):
                            'density', 'matrix']
   if len(args.files) > 0:
     for f in args.files:
-      if not os.path.exists(f):
+      if f != '-' and not args.in_memory and not os.path.exists(f):
         parser.error('File %s does not exist.\n' % f)
+    if args.files.count('-') > 1:
+      parser.error('stdin, -, may only be read once.')
   else:
     parser.error('File paths must be passed in on command line!')
   if args.dpi < 72:
     parser.error('--dpi %d less than screen res, 72. Must be >= 72.'
                  % args.dpi)
-  if args.out_format not in ('pdf', 'png', 'eps', 'all'):
-    parser.error('Unrecognized --out_format %s. Choose one from: '
-                 'pdf png eps all.' % args.out_format)
+  args.out_formats = []
+  for out_format in args.out_format.split(','):
+    if out_format not in ('pdf', 'png', 'eps', 'all'):
+      parser.error('Unrecognized --out_format %s. Choose one from: '
+                   'pdf png eps all.' % out_format)
+    if out_format == 'all':
+      new_formats = ['pdf', 'png', 'eps']
+    else:
+      new_formats = [out_format]
+    for f in new_formats:
+      if f not in args.out_formats:
+        args.out_formats.append(f)
+  if (args.png_compression is not None and
+      not 0 <= args.png_compression <= 9):
+    parser.error('--png_compression must be between 0 and 9.')
   if args.mode not in args.recognized_modes:
     parser.error('Unrecognized --mode %s. Choose one from: %s'
                  % (args.mode, str(args.recognized_modes)))
   if args.mode == 'histogram':
     args.mode = 'hist'
-  if args.mode == 'contour':
+  if args.raw_dtype is not None:
+    try:
+      numpy.dtype(args.raw_dtype)
+    except TypeError:
+      parser.error('--raw_dtype %s is not a numpy dtype.' % args.raw_dtype)
+  if args.raw_columns < 1:
+    parser.error('--raw_columns must be at least 1.')
+  if args.raw_order not in ('C', 'F'):
+    parser.error('Unrecognized --raw_order %s. Choose one from: C F.'
+                 % args.raw_order)
+  binary_inputs = []
+  if not args.in_memory:
+    binary_inputs = [f for f in args.files if IsBinaryInput(f, args)]
+  if binary_inputs and args.xtick_label_column is not None:
+    parser.error('--xtick_label_column can not be read from binary input '
+                 '%s.' % binary_inputs[0])
+  if binary_inputs and args.watch:
+    parser.error('--watch can not follow binary input %s.'
+                 % binary_inputs[0])
+  if args.dtype not in ('float64', 'float32'):
+    parser.error('Unrecognized --dtype %s. Choose one from: float64 '
+                 'float32.' % args.dtype)
+  if args.max_memory is not None and args.max_memory <= 0:
+    parser.error('--max_memory must be greater than 0.')
+  if args.watch:
+    if '-' in args.files:
+      parser.error('--watch can not follow stdin.')
+    if args.mode == 'matrix':
+      parser.error('--watch is not available with --mode matrix.')
+    for option in ('stream', 'cache', 'multipage', 'max_memory'):
+      if getattr(args, option):
+        parser.error('--watch can not be used with --%s.' % option)
+    if args.watch_interval <= 0:
+      parser.error('--watch_interval must be greater than 0.')
+  if args.facet and args.multipage:
+    parser.error('--facet and --multipage may not be used together.')
+  if args.facet_limits not in ('shared', 'independent'):
+    parser.error('Unrecognized --facet_limits %s. Choose one from: '
+                 'shared independent.' % args.facet_limits)
+  if args.facet_columns is not None and args.facet_columns < 1:
+    parser.error('--facet_columns must be at least 1.')
+  if args.multipage and args.out_formats != ['pdf']:
+    parser.error('--multipage is only available with --out_format pdf.')
+  if args.mode == 'contour' and not (args.facet or args.multipage):
     if len(args.files) > 1:
       parser.error('--mode=contour does not permit more than one file '
-                   'to be plotted at a time.')
+                   'to be plotted at a time, except with --facet or '
+                   '--multipage.')
   if args.colors not in ('bostock', 'brewer', 'mono'):
     parser.error('Unrecognized --colors %s palette. Choose one from: '
                  'bostock brewer mono.' % args.colors)
@@ -355,6 +1471,10 @@ def CheckArguments(args, parser):
   args.ymin = sys.maxint
   if args.contour_bin < 3:
     parser.error('--contour_bin must be greater than 3.')
+  if args.hist_bins < 1:
+    parser.error('--hist_bins must be at least 1.')
+  if args.contour_smooth < 0:
+    parser.error('--contour_smooth must not be negative.')
   DefineColors(parser, args)
   DefineColumns(parser, args)
   if args.xtick_label_column is not None:
@@ -364,12 +1484,36 @@ def CheckArguments(args, parser):
                    (args.xtick_label_column, str(args.columns)))
   if args.random_seed is not None and args.jitter:
     numpy.random.seed(seed=args.random_seed)
-  if args.random_seed is not None and args.downsample:
-    random.seed(args.random_seed)
+  if args.matrix_aggregate not in ('mean', 'max'):
+    parser.error('Unrecognized --matrix_aggregate %s. Choose one from: '
+                 'mean max.' % args.matrix_aggregate)
   if (args.matrix_discritize_colormap == 1 or
       args.matrix_discritize_colormap < 0):
     parser.error('--matrix_discritize_colormap must be either 0, '
                  'or greater than 1')
+  if args.jobs < 1:
+    parser.error('--jobs must be at least 1.')
+  if args.profile_format not in ('table', 'json'):
+    parser.error('Unrecognized --profile_format %s. Choose one from: '
+                 'table json.' % args.profile_format)
+  if args.decimate is not None:
+    if args.decimate not in ('minmax', 'lttb'):
+      parser.error('Unrecognized --decimate %s. Choose one from: '
+                   'minmax lttb.' % args.decimate)
+    if args.mode != 'line':
+      parser.error('--decimate is only available with --mode line.')
+  if args.aggregate and args.mode != 'scatter':
+    parser.error('--aggregate is only available with --mode scatter.')
+  if (args.aggregate_cmap is not None and
+      args.aggregate_cmap not in ColorMaps()):
+    parser.error('--aggregate_cmap %s not a valid option. Pick from %s'
+                 % (args.aggregate_cmap, ', '.join(ColorMaps())))
+  if args.cache_rebuild:
+    args.cache = True
+  if args.cache_max_size <= 0:
+    parser.error('--cache_max_size must be greater than 0.')
+  if args.cache_max_age <= 0:
+    parser.error('--cache_max_age must be greater than 0.')
 
 
 def DefineColumns(parser, args):
@@ -384,8 +1528,9 @@ def DefineColumns(parser, args):
     else:
       args.columns = '1'
   columns = args.columns.split(',')
-  if len(columns) > 2:
-    parser.error('Too many --columns specified, can only take 2.')
+  if len(columns) > 2 and args.mode not in ('scatter', 'line'):
+    parser.error('Too many --columns specified, --mode %s can only take '
+                 '2.' % args.mode)
   if len(columns) < 1:
     parser.error('Too few --columns specified, needs at least 1.')
   for i in xrange(0, len(columns)):
@@ -399,6 +1544,24 @@ def DefineColumns(parser, args):
   args.columns = []
   for i in xrange(0, len(columns)):
     args.columns.append(columns[i] - 1)
+  if len(set(args.columns)) != len(args.columns):
+    parser.error('--columns may not repeat a column.')
+  args.series_labels = [os.path.basename(f) for f in args.files]
+
+
+def YColumns(args):
+  """ Return the --columns plotted as y values, one series each.
+
+  The first of several --columns is x and the rest are y. Modes that only
+  plot y values take at most two --columns and ignore the x column.
+  """
+  return args.columns[1:] or args.columns
+
+
+def NumSeries(args):
+  """ Return the number of series to be drawn, one per y column per file.
+  """
+  return len(args.files) * len(YColumns(args))
 
 
 def DefineColors(parser, args):
@@ -500,9 +1663,9 @@ def DefineColors(parser, args):
                        ]
   if isinstance(args.colors_light[0], tuple):
     CorrectColorTuples(args)
-  if args.matrix_cmap not in COLOR_MAPS:
+  if args.matrix_cmap not in ColorMaps():
     parser.error('--cmap %s not a valid option. Pick from %s'
-                 % (args.matrix_cmap, ', '.join(COLOR_MAPS)))
+                 % (args.matrix_cmap, ', '.join(ColorMaps())))
 
 
 def CorrectColorTuples(args):
@@ -536,11 +1699,48 @@ def InitImage(args):
     pdf: a matplotlib pdf drawing (backend) object
   """
   pdf = None
-  if args.out_format == 'pdf' or args.out_format == 'all':
-    pdf = pltBack.PdfPages(args.out + '.pdf')
-  fig = plt.figure(figsize=(args.width, args.height),
-                   dpi=args.dpi, facecolor='w')
-  return (fig, pdf)
+  if 'pdf' in args.out_formats:
+    backend_pdf = ImportModule('matplotlib.backends.backend_pdf')
+    pdf = backend_pdf.PdfPages(args.out + '.pdf')
+  return (NewFigure(args), pdf)
+
+
+def NewFigure(args):
+  """ Create an empty figure of the size the arguments call for.
+
+  Args:
+    args: an argparse arguments object
+
+  Returns:
+    fig: a matplotlib figure object
+  """
+  width, height = args.width, args.height
+  if args.facet:
+    rows, columns = FacetGrid(args)
+    width *= columns
+    height *= rows
+    if args.title != 'sentinel_value':
+      height += FACET_TITLE_HEIGHT
+  return plt.figure(figsize=(width, height), dpi=args.dpi, facecolor='w')
+
+
+def FacetGrid(args):
+  """ Decide the rows and columns of the --facet grid.
+
+  Args:
+    args: an argparse arguments object
+
+  Returns:
+    rows: number of rows of axes
+    columns: number of axes in each row
+  """
+  n = NumSeries(args)
+  columns = args.facet_columns
+  if columns is None:
+    columns = int(numpy.ceil(numpy.sqrt(n)))
+  columns = min(columns, n)
+  rows = int(numpy.ceil(n / float(columns)))
+  return rows, columns
 
 
 def EstablishAxes(fig, args):
@@ -565,8 +1765,55 @@ def EstablishAxes(fig, args):
   args.axHeight = args.axTop - args.axBottom
   ax = fig.add_axes([args.axLeft, args.axBottom,
                      args.axWidth, args.axHeight])
-  ax.yaxis.set_major_locator(pylab.NullLocator())
-  ax.xaxis.set_major_locator(pylab.NullLocator())
+  StyleAxis(ax)
+  return ax
+
+
+def EstablishFacetAxes(fig, args):
+  """ Create one axis per series on the figure object, in a grid.
+
+  Each cell of the grid is --width by --height inches and its axis sits
+  inside it with the same margins as the axis of EstablishAxes(). A
+  --title gets a band of its own above the grid.
+
+  Args:
+    fig: a matplotlib figure object
+    args: an argparse arguments object
+
+  Returns:
+    axes: a list of matplotlib axis objects, one per series
+  """
+  rows, columns = FacetGrid(args)
+  args.axLeft = 0.99 / args.width
+  args.axRight = 1.0 - (0.54 / args.width)
+  args.axWidth = args.axRight - args.axLeft
+  args.axBottom = 0.68 / args.height
+  args.axTop = 1.0 - (0.28 / args.height)
+  args.axHeight = args.axTop - args.axBottom
+  fig_width, fig_height = fig.get_size_inches()
+  axes = []
+  for i in xrange(NumSeries(args)):
+    row, column = divmod(i, columns)
+    left = (column + args.axLeft) * args.width / fig_width
+    bottom = (rows - 1 - row + args.axBottom) * args.height / fig_height
+    ax = fig.add_axes([left, bottom, args.axWidth * args.width / fig_width,
+                       args.axHeight * args.height / fig_height])
+    StyleAxis(ax)
+    axes.append(ax)
+  return axes
+
+
+def StyleAxis(ax):
+  """ Move the left and bottom spines out and hide the others.
+
+  Args:
+    ax: a matplotlib axis object
+
+  Raises:
+    ValueError: If an unknown spine location is passed.
+  """
+  ax.yaxis.set_major_locator(NullLocator())
+  ax.xaxis.set_major_locator(NullLocator())
   for loc, spine in ax.spines.iteritems():
     if loc in ['left', 'bottom']:
       spine.set_position(('outward', 10))
@@ -576,31 +1823,164 @@ def EstablishAxes(fig, args):
       raise ValueError('unknown spine location: %s' % loc)
   ax.xaxis.set_ticks_position('bottom')
   ax.yaxis.set_ticks_position('left')
-  return ax
 
 
 def WriteImage(fig, pdf, args):
-  """ Write the image to disk.
+  """ Write the image to disk in every --out_format.
+
+  Agg draws the figure once, here, and the png is written from that
+  drawing. The pdf and eps backends can not reuse Agg's pixels, so each
+  of them draws the figure again with its own renderer. When both are
+  wanted and there is more than one CPU, the eps is written by a forked
+  copy of this process at the same time as this process writes the pdf
+  and the png. Figures drawn by PlotArrays are always written one format
+  after another, as forking the caller's process, with whatever threads
+  it runs, is unsafe.
 
   Args:
     fig: a matplotlib figure object
     pdf: a matplotlib pdf drawing (backend) object
     args: an argparse arguments object
+  Raises:
+    IOError: If a child process failed to write its format.
+  """
+  if 'png' in args.out_formats:
+    fig.canvas.draw()
+  # this process writes the png, from its drawing, and the pdf, as it
+  # opened the PdfPages object
+  mine = ([f for f in args.out_formats if f in ('png', 'pdf')] or
+          args.out_formats[:1])
+  forked = [f for f in args.out_formats if f not in mine]
+  if multiprocessing.cpu_count() < 2 or args.in_memory:
+    mine += forked
+    forked = []
+  children = []
+  for out_format in forked:
+    pid = os.fork()
+    if pid == 0:
+      status = 1
+      try:
+        SaveFigure(fig, pdf, out_format, args)
+        status = 0
+      except:
+        traceback.print_exc()
+      finally:
+        # skip exit handlers and buffered output that belong to the parent
+        os._exit(status)
+    children.append((out_format, pid))
+  try:
+    for out_format in mine:
+      SaveFigure(fig, pdf, out_format, args)
+  finally:
+    failed = []
+    for out_format, pid in children:
+      if os.waitpid(pid, 0)[1] != 0:
+        failed.append(out_format)
+  if failed:
+    raise IOError('Unable to write the %s output.' % ', '.join(failed))
+
+
+def SaveFigure(fig, pdf, out_format, args):
+  """ Write the image to disk in one format.
+
+  Args:
+    fig: a matplotlib figure object, drawn with Agg already for png
+    pdf: a matplotlib pdf drawing (backend) object
+    out_format: one of pdf, png or eps
+    args: an argparse arguments object
   """
-  if args.out_format == 'pdf':
-    fig.savefig(pdf, format = 'pdf')
-    pdf.close()
-  elif args.out_format == 'png':
-    fig.savefig(args.out + '.png', format='png', dpi=args.dpi)
-  elif args.out_format == 'all':
+  if out_format == 'pdf':
     fig.savefig(pdf, format='pdf')
     pdf.close()
-    fig.savefig(args.out + '.png', format='png', dpi=args.dpi)
-    fig.savefig(args.out + '.eps', format='eps')
-  elif args.out_format == 'eps':
+  elif out_format == 'png':
+    f = open(args.out + '.png', 'wb')
+    try:
+      if args.png_compression is None:
+        WriteAggPng(fig, f)
+      else:
+        WritePng(fig, f, args.dpi, args.png_compression)
+    finally:
+      f.close()
+  elif out_format == 'eps':
     fig.savefig(args.out + '.eps', format='eps')
 
 
+def WriteAggPng(fig, f):
+  """ Write the figure's Agg drawing as a png, just as fig.savefig would
+  but without drawing the figure again.
+
+  Args:
+    fig: a matplotlib figure object, drawn with fig.canvas.draw()
+    f: a file object opened for binary writing
+  """
+  try:
+    from matplotlib import _png
+  except ImportError:
+    # matplotlib versions without the writer can only draw again
+    fig.savefig(f, format='png', dpi=fig.dpi)
+    return
+  metadata = {'Software': ('matplotlib version %s, http://matplotlib.org/'
+                           % matplotlib.__version__)}
+  _png.write_png(fig.canvas.get_renderer()._renderer, f, fig.dpi,
+                 metadata=metadata)
+
+
+def WritePng(fig, f, dpi, level):
+  """ Write the figure's Agg drawing as a png at a compression level.
+
+  Args:
+    fig: a matplotlib figure object at dpi dots per inch, drawn with
+      fig.canvas.draw()
+    f: a file object opened for binary writing
+    dpi: dots per inch, recorded in the file
+    level: zlib compression level, 0 to 9
+  """
+  renderer = fig.canvas.get_renderer()
+  width, height = int(renderer.width), int(renderer.height)
+  rows = numpy.frombuffer(fig.canvas.buffer_rgba(), dtype=numpy.uint8)
+  rows = rows.reshape(height, width * 4)
+  # every scanline is stored as its difference from the one above it,
+  # png filter type 2, which compresses well and is quick to compute
+  scanlines = numpy.empty((height, width * 4 + 1), dtype=numpy.uint8)
+  scanlines[:, 0] = 2
+  scanlines[0, 1:] = rows[0]
+  scanlines[1:, 1:] = rows[1:] - rows[:-1]
+  pixels_per_meter = int(round(dpi / 0.0254))
+  f.write('\x89PNG\r\n\x1a\n')
+  # 8 bit RGBA, default compression, filtering and no interlacing
+  WritePngChunk(f, 'IHDR',
+                struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+  WritePngChunk(f, 'pHYs', struct.pack('>IIB', pixels_per_meter,
+                                       pixels_per_meter, 1))
+  WritePngChunk(f, 'IDAT', zlib.compress(scanlines.tostring(), level))
+  WritePngChunk(f, 'IEND', '')
+
+
+def WritePngChunk(f, kind, data):
+  """ Write one chunk of a png file.
+
+  Args:
+    f: a file object open for writing
+    kind: the four letter chunk type
+    data: the chunk's contents, a string
+  """
+  f.write(struct.pack('>I', len(data)))
+  f.write(kind + data)
+  f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+def OutputPaths(args):
+  """ List the files WriteImage creates.
+
+  Args:
+    args: an argparse arguments object
+
+  Returns:
+    paths: a list of absolute paths
+  """
+  return [os.path.abspath(args.out + '.' + f) for f in args.out_formats]
+
+
 def ColorPicker(i, args):
   """ Returns a valid matplotlib color based on the index, plot mode and palette.
 
@@ -619,7 +1999,7 @@ def ColorPicker(i, args):
   elif args.mode in ('hist'):
     # hist requires a list of colors be returned
     colors = []
-    for i in xrange(0, i):
+    for i in xrange(args.color_index_offset, i):
       colors.append(args.colors_light[i % len(args.colors_light)])
     return colors
   elif args.mode in ('contour'):
@@ -638,37 +2018,116 @@ def PlotDensity(data_list, ax, args):
     args: an argparse arguments object
   """
   # first create density list, then pass that to PlotLineScatter
+  jobs = [(data.y, args.density_num_bins, args.density_covariance)
+          for data in data_list]
+  if args.jobs > 1 and len(jobs) > 1:
+    pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+    try:
+      densities = pool.map(DensityJob, jobs)
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+  else:
+    densities = map(DensityJob, jobs)
   density_list = []
-  for data in data_list:
+  for data, (x_data, y_data) in zip(data_list, densities):
     d = Data()
     d.label = data.label
-    density = gaussian_kde(data.y)
-    x_data = numpy.linspace(numpy.min(data.y),
-                            numpy.max(data.y),
-                            args.density_num_bins)
-    if args.density_covariance is not None:
-      density.covariance_factor = lambda : args.density_covariance
-      density._compute_covariance()  # bad mojo calling privates like this
-    d.x = numpy.array(x_data)
-    d.y = numpy.array(density(x_data))
+    d.x = x_data
+    d.y = y_data
     density_list.append(d)
   PlotLineScatter(density_list, ax, args)
 
 
-def HandleColormapLimits(data, args):
-  """ Return appropriate values for upper and lower bound colorbar limits.
+def DensityJob(job):
+  """ Estimate the density of one file's values, possibly in a worker process.
 
   Args:
-    data: a Data object
-    args: an argparse arguments object
+    job: a tuple of the values, --density_num_bins and --density_covariance
+
   Returns:
-    lb: a lower bound value for the map
-    ub: an upper bound value for the map
+    x_data: a numpy array of density_num_bins points spanning the values
+    y_data: a numpy array of the density at each of those points
   """
-  if args.matrix_colormap_min is not None:
-    lb = args.matrix_colormap_min
-  else:
-    lb = numpy.min(numpy.min(data.matrix))
+  values, num_bins, covariance = job
+  x_data = numpy.linspace(numpy.min(values), numpy.max(values), num_bins)
+  if len(values) > DENSITY_EXACT_ROWS:
+    y_data = BinnedDensity(values, x_data, covariance)
+    if y_data is not None:
+      return x_data, y_data
+  density = ImportModule('scipy.stats').gaussian_kde(values)
+  if covariance is not None:
+    density.covariance_factor = lambda : covariance
+    density._compute_covariance()  # bad mojo calling privates like this
+  return numpy.array(x_data), numpy.array(density(x_data))
+
+
+def BinnedDensity(values, x_data, covariance):
+  """ Gaussian kernel density estimate by linear binning and FFT convolution.
+
+  Matches scipy.stats.gaussian_kde: the kernel's standard deviation is the
+  covariance factor, --density_covariance or else Scott's rule, times the
+  standard deviation of the values. The values are split between the two
+  nearest points of a grid a quarter of a bandwidth apart or finer, the
+  grid is convolved with the kernel and the result interpolated at x_data.
+
+  Args:
+    values: a numpy array of values
+    x_data: a sorted numpy array of the points to estimate the density at
+    covariance: --density_covariance, or None
+
+  Returns:
+    y_data: a numpy array of the density at x_data, or None if the values
+            are all the same.
+  """
+  n = len(values)
+  if covariance is None:
+    covariance = n ** (-1.0 / 5)  # Scott's rule, as gaussian_kde uses
+  bandwidth = covariance * numpy.std(values, ddof=1)
+  lo, hi = x_data[0], x_data[-1]
+  if not bandwidth > 0 or not hi > lo:
+    return None
+  num_grid = int(min(DENSITY_MAX_GRID,
+                     max(4 * len(x_data), 4 * (hi - lo) / bandwidth))) + 1
+  step = (hi - lo) / (num_grid - 1)
+  counts = numpy.zeros(num_grid + 1)
+  for start in xrange(0, n, DENSITY_CHUNK_ROWS):
+    position = (values[start:start + DENSITY_CHUNK_ROWS] - lo) / step
+    left = numpy.floor(position).astype(numpy.intp)
+    right_share = position - left
+    counts += numpy.bincount(left, weights=1 - right_share,
+                             minlength=num_grid + 1)
+    counts += numpy.bincount(left + 1, weights=right_share,
+                             minlength=num_grid + 1)
+  counts = counts[:num_grid]  # hi falls exactly on the last grid point
+  # the kernel is cut off 5 bandwidths out, or at the width of the grid
+  reach = min(num_grid - 1, int(numpy.ceil(5 * bandwidth / step)))
+  offsets = numpy.arange(-reach, reach + 1) * step
+  kernel = (numpy.exp(-0.5 * (offsets / bandwidth) ** 2) /
+            (n * bandwidth * numpy.sqrt(2 * numpy.pi)))
+  size = 1 << int(numpy.ceil(numpy.log2(num_grid + 2 * reach)))
+  smoothed = numpy.fft.irfft(numpy.fft.rfft(counts, size) *
+                             numpy.fft.rfft(kernel, size), size)
+  smoothed = numpy.maximum(smoothed[reach:reach + num_grid], 0.0)
+  grid = lo + numpy.arange(num_grid) * step
+  return numpy.interp(x_data, grid, smoothed)
+
+
+def HandleColormapLimits(data, args):
+  """ Return appropriate values for upper and lower bound colorbar limits.
+
+  Args:
+    data: a Data object
+    args: an argparse arguments object
+  Returns:
+    lb: a lower bound value for the map
+    ub: an upper bound value for the map
+  """
+  if args.matrix_colormap_min is not None:
+    lb = args.matrix_colormap_min
+  else:
+    lb = numpy.min(numpy.min(data.matrix))
   if args.matrix_colormap_max is not None:
     ub = args.matrix_colormap_max
   else:
@@ -700,9 +2159,20 @@ def PlotMatrix(data_list, ax, args):
     norm = matplotlib.colors.BoundaryNorm(bounds, cmap.N)
   else:
     norm = matplotlib.colors.Normalize(vmin=cmap_lb, vmax=cmap_ub)
+  num_rows, num_cols = data.matrix.shape
+  if args.matrix_matshow or num_rows * num_cols > MATRIX_RASTER_CELLS:
+    matrix = AggregateMatrix(data.matrix,
+                             args.axHeight * args.height * args.dpi,
+                             args.axWidth * args.width * args.dpi,
+                             args.matrix_aggregate)
   if args.matrix_matshow:
-    plt.matshow(data.matrix, fignum=False, origin='upper',
-                cmap=cmap, norm=norm)
+    plt.matshow(matrix, fignum=False, origin='upper', cmap=cmap, norm=norm,
+                extent=(-0.5, num_cols - 0.5, num_rows - 0.5, -0.5))
+  elif num_rows * num_cols > MATRIX_RASTER_CELLS:
+    # a raster laid out exactly where pcolor() would put its cells
+    plt.imshow(matrix, origin='lower', interpolation='nearest',
+               aspect='auto', cmap=cmap, norm=norm,
+               extent=(0, num_cols, 0, num_rows))
   else:
     plt.pcolor(data.matrix, cmap=cmap, norm=norm)
   if not args.matrix_no_colorbar:
@@ -717,6 +2187,37 @@ def PlotMatrix(data_list, ax, args):
   plt.box(on=False)
 
 
+def AggregateMatrix(matrix, num_pixel_rows, num_pixel_cols, how):
+  """ Shrink a matrix to about one cell per output pixel.
+
+  Runs of neighbouring rows, then of neighbouring columns, are combined
+  into one by their mean or max.
+
+  Args:
+    matrix: a 2D numpy array
+    num_pixel_rows: the height of the plot in pixels
+    num_pixel_cols: the width of the plot in pixels
+    how: 'mean' or 'max'
+
+  Returns:
+    matrix: a 2D numpy array no larger than the input
+  """
+  for axis, num_pixels in ((0, num_pixel_rows), (1, num_pixel_cols)):
+    n = matrix.shape[axis]
+    step = int(numpy.ceil(n / float(max(num_pixels, 1))))
+    if step < 2:
+      continue
+    starts = numpy.arange(0, n, step)
+    if how == 'max':
+      matrix = numpy.fmax.reduceat(matrix, starts, axis=axis)
+    else:
+      counts = numpy.diff(numpy.append(starts, n)).astype(float)
+      if axis == 0:
+        counts = counts[:, None]
+      matrix = numpy.add.reduceat(matrix, starts, axis=axis) / counts
+  return matrix
+
+
 def PlotTwoDimension(data_list, ax, args):
   """ Plot two dimensional data.
 
@@ -747,14 +2248,19 @@ def PlotContour(data_list, ax, args):
     raise BadInput('You cannot create a contour plot with more '
                    'than one input file')
   data = data_list[0]
-  x = data.x
-  y = data.y
-  H, xedges, yedges = numpy.histogram2d(
-    x, y, range=[[min(x), max(x)], [min(y), max(y)]],
-    bins=(args.contour_bin, args.contour_bin))
+  if data.histogram is not None:
+    H, xedges, yedges = data.histogram
+  else:
+    x = data.x
+    y = data.y
+    H, xedges, yedges = Histogram2D(
+      x, y, args.contour_bin,
+      [[numpy.min(x), numpy.max(x)], [numpy.min(y), numpy.max(y)]])
+  if args.contour_smooth:
+    H = SmoothHistogram(H, args.contour_smooth)
   extent = [yedges[0], yedges[-1], xedges[0], xedges[-1]]
-  c_max = max(map(max, H))
-  c_min = min(map(min, H))
+  c_max = H.max()
+  c_min = H.min()
   nc_levels = args.contour_num_levels
   if args.contour_logspace:
     c_levels = numpy.logspace(c_min, c_max, nc_levels)
@@ -770,6 +2276,51 @@ def PlotContour(data_list, ax, args):
   #   c.set_linestyle('solid')
 
 
+def Histogram2D(x, y, bins, limits):
+  """ numpy.histogram2d, HISTOGRAM_CHUNK_ROWS points at a time.
+
+  Args:
+    x: a numpy array of x values
+    y: a numpy array of y values
+    bins: number of bins along each axis
+    limits: [[xmin, xmax], [ymin, ymax]], points outside are not counted
+
+  Returns:
+    H: a numpy array of shape (bins, bins), H[i, j] counts the points in
+       x bin i and y bin j
+    xedges: a numpy array of the bin edges along x
+    yedges: a numpy array of the bin edges along y
+  """
+  H = numpy.zeros((bins, bins))
+  for start in xrange(0, max(len(x), 1), HISTOGRAM_CHUNK_ROWS):
+    end = start + HISTOGRAM_CHUNK_ROWS
+    counts, xedges, yedges = numpy.histogram2d(
+      x[start:end], y[start:end], range=limits, bins=(bins, bins))
+    H += counts
+  return H, xedges, yedges
+
+
+def SmoothHistogram(H, sigma):
+  """ Convolve a 2D histogram with a Gaussian kernel, by FFT.
+
+  Args:
+    H: a 2D numpy array
+    sigma: standard deviation of the kernel, in bins
+
+  Returns:
+    smoothed: a numpy array shaped like H
+  """
+  reach = int(numpy.ceil(4 * sigma))
+  offsets = numpy.arange(-reach, reach + 1)
+  kernel = numpy.exp(-0.5 * (offsets / float(sigma)) ** 2)
+  kernel = numpy.outer(kernel, kernel) / kernel.sum() ** 2
+  shape = [1 << int(numpy.ceil(numpy.log2(n + 2 * reach))) for n in H.shape]
+  smoothed = numpy.fft.irfft2(numpy.fft.rfft2(H, shape) *
+                              numpy.fft.rfft2(kernel, shape), shape)
+  smoothed = smoothed[reach:reach + H.shape[0], reach:reach + H.shape[1]]
+  return numpy.maximum(smoothed, 0.0)
+
+
 def PlotLineScatter(data_list, ax, args):
   """ Plot two dimensional line or scatter data.
 
@@ -788,296 +2339,1209 @@ def PlotLineScatter(data_list, ax, args):
   else:
     marker = args.marker
     alpha = 1.0
-  args.xmin = min(map(min, map(lambda data: data.x, data_list)))
-  args.xmax = max(map(max, map(lambda data: data.x, data_list)))
-  args.ymin = min(map(min, map(lambda data: data.y, data_list)))
-  args.ymax = max(map(max, map(lambda data: data.y, data_list)))
+  args.xmin = min(map(numpy.min, map(lambda data: data.x, data_list)))
+  args.xmax = max(map(numpy.max, map(lambda data: data.x, data_list)))
+  args.ymin = min(map(numpy.min, map(lambda data: data.y, data_list)))
+  args.ymax = max(map(numpy.max, map(lambda data: data.y, data_list)))
+  if args.aggregate:
+    PlotAggregate(data_list, ax, args)
+  if args.decimate is not None:
+    x_grid = PixelGrid([data.x for data in data_list], args.is_log_x,
+                       args.xmin, args.xmax, args.user_xmin, args.user_xmax,
+                       args.axWidth * args.width * args.dpi)
   for i, data in enumerate(data_list, 0):
-    ax.add_line(
-      lines.Line2D(xdata=data.x,
-                   ydata=data.y,
-                   color=ColorPicker(i, args),
-                   marker=marker,
-                   markersize=args.markersize,
-                   markerfacecolor=ColorPicker(i, args),
-                   markeredgecolor='None',
-                   alpha=alpha,
-                   linewidth=args.linewidth))
+    if args.decimate is not None:
+      keep = DecimateLine(data, x_grid, args)
+      xdata, ydata = data.x[keep], data.y[keep]
+    else:
+      xdata, ydata = data.x, data.y
+    if not args.aggregate:
+      ax.add_line(
+        lines.Line2D(xdata=xdata,
+                     ydata=ydata,
+                     color=ColorPicker(i, args),
+                     marker=marker,
+                     markersize=args.markersize,
+                     markerfacecolor=ColorPicker(i, args),
+                     markeredgecolor='None',
+                     alpha=alpha,
+                     linewidth=args.linewidth))
     if args.regression:
-      rxlist = numpy.array(data.x)
-      rylist = numpy.array(data.y)
-      A = numpy.array([rxlist, numpy.ones(len(rxlist))])
-      try:
-        w = numpy.linalg.lstsq(A.T, rylist)[0]
-      except ValueError:
+      stats = data.regression
+      if stats is None:
+        stats = RegressionStats()
+        stats.add(numpy.asarray(data.x, dtype=float),
+                  numpy.asarray(data.y, dtype=float))
+      fit = stats.fit()
+      if fit is None:
         sys.stderr.write('Warning, unable to perform regression!\n')
-        return
-
-      sorted_rxlist = numpy.array(sorted(rxlist))
-      fitline = w[0] * sorted_rxlist + w[1]
+        continue
+      slope, intercept, r_value, p_value = fit
+      fitline = [slope * stats.min_x + intercept,
+                 slope * stats.max_x + intercept]
       ax.add_line(
-        lines.Line2D(xdata=[numpy.min(rxlist), numpy.max(rxlist)],
-                     ydata=[fitline[0], fitline[-1]],
+        lines.Line2D(xdata=[stats.min_x, stats.max_x],
+                     ydata=fitline,
                      color='red',
                      linestyle='--'))
-      slope, intercept, r_value, p_value, stderr = linregress(rxlist, rylist)
-      if w[1] > 0:
+      if intercept > 0:
         op = '+'
       else:
         op = '-'
-        w[1] = abs(w[1])
-      ax.text(x=(rxlist[0] + rxlist[-1]) / 2.0,
+        intercept = abs(intercept)
+      ax.text(x=(stats.first_x + stats.last_x) / 2.0,
               y=(fitline[0] + fitline[-1]) / 2.0,
               s=('%f * x %s %f,\n$r^2$=%f, $p$=%f'
-                 % (w[0], op, w[1], r_value * r_value, p_value)),
+                 % (slope, op, intercept, r_value * r_value, p_value)),
               verticalalignment='bottom',
               horizontalalignment='center')
 
 
-def ReadFiles(args):
-  """ Read and parse all input files.
+def PlotAggregate(data_list, ax, args):
+  """ Plot two dimensional scatter data as an image of per pixel counts.
 
   Args:
+    data_list: a list of Data objects
+    ax: a matplotlib axis object
     args: an argparse arguments object
+  """
+  x_grid = PixelGrid([data.x for data in data_list], args.is_log_x,
+                         args.xmin, args.xmax, args.user_xmin, args.user_xmax,
+                         args.axWidth * args.width * args.dpi)
+  y_grid = PixelGrid([data.y for data in data_list], args.is_log_y,
+                         args.ymin, args.ymax, args.user_ymin, args.user_ymax,
+                         args.axHeight * args.height * args.dpi)
+  count_list = [CountPixels(data, x_grid, y_grid) for data in data_list]
+  rgba = BlendCounts(count_list, args)
+  extent = (x_grid[0], x_grid[1], y_grid[0], y_grid[1])
+  if args.is_log_x or args.is_log_y:
+    # images can't be drawn on log axes. the grid is laid out in the axis'
+    # own coordinates, so pin the image to the axis box instead.
+    ax.imshow(rgba, origin='lower', interpolation='nearest', aspect='auto',
+              extent=(0, 1, 0, 1), transform=ax.transAxes)
+  else:
+    ax.imshow(rgba, origin='lower', interpolation='nearest', aspect='auto',
+              extent=extent)
+  ax.set_xlim(extent[0], extent[1])
+  ax.set_ylim(extent[2], extent[3])
+
+
+def PixelGrid(values_list, is_log, data_min, data_max, user_min, user_max,
+              num_pixels):
+  """ Decide the limits and number of pixels of one axis of the plot.
+
+  The limits are the ones CleanAxis() gives a normal scatter plot, 5% of
+  padding around the data, or on a log axis 5% of padding in log space
+  around the positive data.
+
+  Args:
+    values_list: a list of numpy arrays, the values on this axis of each file
+    is_log: True if the axis is logarithmic
+    data_min: minimum value from the data
+    data_max: maximum value from the data
+    user_min: possibly a user requested value for min
+    user_max: possibly a user requested value for max
+    num_pixels: the length of the axis in pixels
 
   Returns:
-    data_list: a list of numpy arrays of dimension (n by c) where
-      n is the number of observations and c is the number of columns.
+    grid: a tuple (a_min, a_max, num_pixels, is_log)
   """
-  data_list = []
-  for a_file in args.files:
-    num_columns = None
-    f = open(a_file, 'r')
-    rows = []
-    line_number = 0
-    for line in f:
-      line_number += 1
-      line = line.strip()
-      if line.startswith('#'):
-        continue
-      r = Row()
-      r.columns = line.split()
-      r.line_number = line_number
-      if num_columns is None:
-        num_columns = len(r.columns)
-        if num_columns < max(args.columns):
-          raise BadInput('Input file %s has only %d columns, you requested a '
-                         'column, %d, which is out of bounds.'
-                         % (a_file, num_columns, max(args.columns)))
-      else:
-        if num_columns != len(r.columns):
-          raise BadInput('Input file %s had %d columns, switches to %d '
-                         'columns on line %d:\n%s\n'
-                         % (a_file, num_columns, len(r.columns),
-                            line_number, line))
-      rows.append(r)
-    f.close()
-    d = Data()
-    d.label = os.path.basename(a_file)
-    if args.downsample:
-      if len(rows) > args.downsample:
-        rows = random.sample(rows, args.downsample)
-    d.rows = rows
-    d.process_data(args)
-    data_list.append(d)
-  return data_list
+  if is_log:
+    positive = [v[v > 0] for v in values_list]
+    positive = [v for v in positive if len(v)]
+    if not positive:
+      raise BadInput('No positive values to plot on a log axis.')
+    data_min = numpy.log10(min(numpy.min(v) for v in positive))
+    data_max = numpy.log10(max(numpy.max(v) for v in positive))
+  arange = data_max - data_min
+  data_min, data_max = data_min - arange * 0.05, data_max + arange * 0.05
+  if is_log:
+    data_min, data_max = 10 ** data_min, 10 ** data_max
+  a_min, a_max = HandleLimits(data_min, data_max, user_min, user_max)
+  a_min, a_max = matplotlib.transforms.nonsingular(a_min, a_max)
+  return a_min, a_max, max(1, int(round(num_pixels))), is_log
 
 
-def PlotOneDimension(data_list, ax, args):
-  """ Plot one dimensional data.
+def PixelPositions(values, grid):
+  """ Return the pixel coordinate of each value along one axis.
 
   Args:
-    data_list: a list of Data objects.
-    ax: a matplotlib axis object.
-    args: an argparse arguments object.
+    values: a numpy array of values
+    grid: a tuple from PixelGrid()
+
+  Returns:
+    positions: a float numpy array, pixel i covers [i, i + 1). values off
+               the axis, or not positive on a log axis, are outside
+               [0, num_pixels) or NaN.
   """
-  if args.mode == 'bar' or args.mode == 'column':
-    PlotColumns(data_list, ax, args)
-  elif args.mode == 'hist':
-    PlotHistogram(data_list, ax, args)
-  elif args.mode == 'tick' or args.mode == 'barcode':
-    PlotTicks(data_list, ax, args)
-  elif args.mode == 'point':
-    PlotPoints(data_list, ax, args)
+  a_min, a_max, num_pixels, is_log = grid
+  if is_log:
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      values = numpy.log10(values)
+    a_min, a_max = numpy.log10(a_min), numpy.log10(a_max)
+  return (values - a_min) * (num_pixels / (a_max - a_min))
 
 
-def PlotHistogram(data_list, ax, args):
-  """ Plot one dimensional data as histogram.
+def CountPixels(data, x_grid, y_grid):
+  """ Count the points of one file falling in each pixel.
 
   Args:
-    data_list: a list of Data objects.
-    ax: a matplotlib axis object.
-    args: an argparse arguments object.
+    data: a Data object
+    x_grid: a tuple from PixelGrid() for the x axis
+    y_grid: a tuple from PixelGrid() for the y axis
+
+  Returns:
+    counts: a numpy array of shape (y pixels, x pixels)
   """
-  width = 2.0 / 3.0 / len(data_list)
-  datas = []
-  for data in data_list:
-    datas.append(data.y)
-  n, bins, patch_groups = ax.hist(
-    datas, color=ColorPicker(len(data_list), args), histtype='bar')
-  for pg in patch_groups:
-    if isinstance(pg, matplotlib.container.BarContainer):
-      # if there are multiple files, pg will be a BarContainer
-      for patch in pg.patches:
-        patch.set_edgecolor('none')
-    else:
-      # if there is only one file to plot, pg is a Rectangle
-      pg.set_edgecolor('white')
+  nx, ny = x_grid[2], y_grid[2]
+  counts = numpy.zeros(nx * ny, dtype=numpy.int64)
+  for start in xrange(0, len(data.x), AGGREGATE_CHUNK_ROWS):
+    end = start + AGGREGATE_CHUNK_ROWS
+    px = PixelPositions(data.x[start:end], x_grid)
+    py = PixelPositions(data.y[start:end], y_grid)
+    with numpy.errstate(invalid='ignore'):
+      keep = (px >= 0) & (px < nx) & (py >= 0) & (py < ny)
+    index = py[keep].astype(numpy.intp) * nx + px[keep].astype(numpy.intp)
+    counts += numpy.bincount(index, minlength=nx * ny)
+  return counts.reshape(ny, nx)
 
 
-def PlotColumns(data_list, ax, args):
-  """ Plot one dimensional data as column / bar plot.
+def BlendCounts(count_list, args):
+  """ Turn per pixel counts into an RGBA image.
+
+  Counts are log scaled, see CountShades(). With --aggregate_cmap the
+  counts of all files are summed and colored by the colormap, otherwise
+  each file shades its own color and later files are composited over
+  earlier ones, as their markers would be.
 
   Args:
-    data_list: a list of Data objects.
-    ax: a matplotlib axis object.
-    args: an argparse arguments object.
+    count_list: a list of numpy arrays from CountPixels(), one per file
+    args: an argparse arguments object
+
+  Returns:
+    rgba: a float numpy array of shape (y pixels, x pixels, 4)
   """
-  width = 2.0 / 3.0 / len(data_list)
-  data_min = min(map(numpy.min, map(lambda x: x.y, data_list)))
-  data_max = max(map(numpy.max, map(lambda x: x.y, data_list)))
-  args.xmin = 0
-  args.xmax = max(map(len, map(lambda data: data.y, data_list)))
-  for i, data in enumerate(data_list, 0):
-    data.x = range(0, len(data.y))
-    data.x = numpy.add(data.x, width * i)  # offset
-    rects = ax.bar(data.x,
-                   data.y,
-                   width,
-                   color=ColorPicker(i, args),
-                   linewidth=0.0,
-                   alpha=1.0)
-    ax.xaxis.set_ticklabels([])
-  xmin, xmax, ymin, ymax = ax.axis()
-  xmin, xmax = HandleLimits(xmin, xmax, args.user_xmin, args.user_xmax)
-  ymin, ymax = HandleLimits(min(0.0, data_min), ymax,
-                            args.user_ymin, args.user_ymax)
-  args.ymin = ymin
-  args.ymax = ymax
-  ax.set_ylim([ymin, ymax])
-  if args.xtick_label_column is not None:
-    ax.xaxis.set_ticks(numpy.arange(0, len(data.xtick_labels)) + width / 2.)
-    ax.xaxis.set_ticklabels(data.xtick_labels, rotation=35,
-                            horizontalalignment='right')
-  args.xmin = xmin
-  args.xmax = xmax
-  ax.set_xlim([xmin, xmax])
+  if args.aggregate_cmap is not None:
+    total = sum(count_list)
+    rgba = plt.get_cmap(args.aggregate_cmap)(
+      CountShades(total, numpy.max(total)))
+    rgba[..., 3] = numpy.where(total > 0, args.alpha, 0.0)
+    return rgba
+  max_count = max(numpy.max(c) for c in count_list)
+  # premultiplied color and alpha of the layers blended so far
+  premultiplied = numpy.zeros(count_list[0].shape + (3,))
+  alpha = numpy.zeros(count_list[0].shape)
+  for i, counts in enumerate(count_list, 0):
+    color = numpy.array(matplotlib.colors.to_rgb(ColorPicker(i, args)))
+    a = args.alpha * CountShades(counts, max_count)
+    premultiplied = color * a[..., None] + premultiplied * (1 - a)[..., None]
+    alpha = a + alpha * (1 - a)
+  rgba = numpy.zeros(alpha.shape + (4,))
+  covered = alpha > 0
+  rgba[covered, :3] = premultiplied[covered] / alpha[covered][:, None]
+  rgba[..., 3] = alpha
+  return rgba
 
 
-def GetTickYValues(i, args):
-  """ Produce the lower and upper y values for a Tick plot.
+def CountShades(counts, max_count):
+  """ Log scale counts onto [0, 1].
 
   Args:
-    i: Integer offset of this set of values.
-    args: an argparse arguments object.
+    counts: a numpy array of counts
+    max_count: the count that gets shade 1
 
   Returns:
-    y0, y1: the lower and upper y values for a Tick Plot
+    shades: a float numpy array, 0 where there are no points and at least
+            AGGREGATE_MIN_SHADE where there are.
   """
-  if args.jitter:
-    lo = numpy.random.uniform(low=0.0, high=0.3)
-    return i + lo, i + lo + 0.1
-  else:
-    return i, i + 0.8
+  scale = numpy.log(max(max_count, 2))
+  with numpy.errstate(divide='ignore'):
+    shades = numpy.log(counts) / scale
+  return numpy.where(counts > 0,
+                     AGGREGATE_MIN_SHADE + (1 - AGGREGATE_MIN_SHADE) * shades,
+                     0.0)
 
 
-def HandleLimits(data_min, data_max, user_min, user_max):
-  """ Decides whether to use the data values or user supplied values.
+def DecimateLine(data, x_grid, args):
+  """ Choose the points of a line series worth drawing, per --decimate.
+
+  Points are put in buckets by the pixel column they fall in, or if x is
+  not sorted by their position in the series, and a few points are kept
+  from each bucket. Buckets never span DECIMATE_CHUNK_ROWS points.
 
   Args:
-    data_min: minimum value from the data
-    data_max: maximum value from the data
-    user_min: possibly a user requested value for min
-    user_max: possibly a user requested value for max
+    data: a Data object
+    x_grid: a tuple from PixelGrid() for the x axis
+    args: an argparse arguments object
 
   Returns:
-    a_min: the correct minimum
-    a_max: the correct maximum
+    keep: a sorted numpy array of the indices of the points to draw
   """
-  a_min, a_max = data_min, data_max
-  if user_min != sys.maxint:
-    a_min = user_min
-  if user_max != -sys.maxint:
-    a_max = user_max
-  return a_min, a_max
+  n = len(data.x)
+  num_pixels = x_grid[2]
+  if n <= 4 * num_pixels:
+    return numpy.arange(n)
+  is_sorted = True
+  for start in xrange(0, n, DECIMATE_CHUNK_ROWS):
+    # chunks overlap by one point to compare across their boundary
+    x = data.x[start:start + DECIMATE_CHUNK_ROWS + 1]
+    if numpy.any(x[1:] < x[:-1]):
+      is_sorted = False
+      break
+  keep = [numpy.array([0, n - 1])]
+  for start in xrange(0, n, DECIMATE_CHUNK_ROWS):
+    end = min(start + DECIMATE_CHUNK_ROWS, n)
+    y = data.y[start:end]
+    if is_sorted:
+      position = PixelPositions(data.x[start:end], x_grid)
+    else:
+      position = numpy.arange(start, end) * (num_pixels / float(n))
+    column = numpy.floor(position)
+    starts = numpy.flatnonzero(
+      numpy.concatenate(([True], column[1:] != column[:-1])))
+    counts = numpy.diff(numpy.append(starts, len(y)))
+    if args.decimate == 'minmax':
+      picks = [starts, starts + counts - 1,
+               BucketArgmax(y, starts, counts),
+               BucketArgmax(-y, starts, counts)]
+    else:
+      picks = [LargestTriangles(position, y, starts, counts)]
+    keep.extend(p + start for p in picks)
+  return numpy.unique(numpy.concatenate(keep))
 
 
-def PlotTicks(data_list, ax, args):
-  """ Plot one dimensional data as tick marks on a line.
+def BucketArgmax(values, starts, counts):
+  """ Find the index of the largest value in each bucket.
 
   Args:
-    data_list: a list of Data objects
-    ax: a matplotlib axis object
-    args: an argparse arguments object
+    values: a numpy array
+    starts: a numpy array of the index where each bucket starts
+    counts: a numpy array of the number of values in each bucket
+
+  Returns:
+    indices: a numpy array, the first index of each bucket's largest value
   """
-  data_min = min(map(numpy.min, map(lambda x: x.y, data_list)))
-  data_max = max(map(numpy.max, map(lambda x: x.y, data_list)))
-  data_range = data_max - data_min
-  if data_range == 0.0:
-    data_min, data_max, data_range = -0.5, 0.5, 1.0
-  data_min -= data_range * 0.1
-  data_max += data_range * 0.1
-  for i, data in enumerate(data_list, 0):
-    for d in data.y:
-      y0, y1 = GetTickYValues(i, args)
-      ax.add_line(
-        lines.Line2D(xdata=[d, d],
-                     ydata=[y0, y1],
-                     color=ColorPicker(i, args),
-                     marker=None,
-                     markersize=args.markersize,
-                     markerfacecolor=ColorPicker(i, args),
-                     markeredgecolor='None',
-                     alpha=args.alpha,
-                     linewidth=args.linewidth))
-  ymin, ymax = HandleLimits(0.0, len(data_list),
-                            args.user_ymin, args.user_ymax)
-  ax.set_ylim([ymin, ymax])
-  xmin, xmax = HandleLimits(data_min, data_max,
-                            args.user_xmin, args.user_xmax)
-  ax.set_xlim([xmin, xmax])
-  ax.yaxis.set_ticks_position('none')
-  ax.yaxis.set_ticks([])
+  best = numpy.maximum.reduceat(values, starts)
+  hits = numpy.flatnonzero(values == numpy.repeat(best, counts))
+  bucket = numpy.repeat(numpy.arange(len(starts)), counts)[hits]
+  first = numpy.concatenate(([True], bucket[1:] != bucket[:-1]))
+  return hits[first]
 
 
-def GetPointYValues(n, i, args):
-  """ Produce the y values for a Point plot.
+def LargestTriangles(x, y, starts, counts):
+  """ Pick one point per bucket, Largest Triangle Three Buckets style.
+
+  Each bucket keeps the point forming the largest triangle with the mean
+  point of the buckets on either side. Using the previous bucket's mean
+  rather than the point picked there leaves buckets independent, so all
+  of them are picked at once.
 
   Args:
-    n: number of values to produce.
-    i: Integer offset of this set of values.
-    args: an argparse arguments object.
+    x: a numpy array of x positions
+    y: a numpy array of y values
+    starts: a numpy array of the index where each bucket starts
+    counts: a numpy array of the number of points in each bucket
 
   Returns:
-    y: a list of y values for a Point plot.
+    indices: a numpy array of the index picked in each bucket
   """
-  if args.jitter:
-    return numpy.random.uniform(low=i, high=i + 0.5, size=n)
+  mean_x = numpy.add.reduceat(x, starts) / counts
+  mean_y = numpy.add.reduceat(y, starts) / counts
+  # the series' own end points stand in past the first and last buckets
+  prev_x = numpy.repeat(numpy.concatenate(([x[0]], mean_x[:-1])), counts)
+  prev_y = numpy.repeat(numpy.concatenate(([y[0]], mean_y[:-1])), counts)
+  next_x = numpy.repeat(numpy.concatenate((mean_x[1:], [x[-1]])), counts)
+  next_y = numpy.repeat(numpy.concatenate((mean_y[1:], [y[-1]])), counts)
+  area = numpy.abs((prev_x - next_x) * (y - prev_y) -
+                   (prev_x - x) * (next_y - prev_y))
+  return BucketArgmax(area, starts, counts)
+
+
+def ReadFiles(args):
+  """ Read and parse all input files.
+
+  Args:
+    args: an argparse arguments object
+
+  Returns:
+    data_list: a list of Data objects, one per series of each input file.
+  """
+  if args.max_memory is not None:
+    ApplyMemoryBudget(args)
+  if args.mode == 'hist' and args.stream:
+    args.hist_edges = HistogramEdges(args)
+  if args.jobs > 1 and len(args.files) > 1:
+    data_list = ReadFilesParallel(args)
   else:
-    return [i] * n
+    data_list = []
+    for i, a_file in enumerate(args.files):
+      data_list.extend(ReadFile(a_file, args, i))
+  args.series_labels = [d.label for d in data_list]
+  return data_list
 
 
-def PlotPoints(data_list, ax, args):
-  """ Plot one dimensional data as points on a line.
+def ReadFilesParallel(args):
+  """ Read and parse all input files in a pool of --jobs processes.
+
+  Results come back in the order of args.files. Anything a worker wrote
+  to stderr is replayed in that same order and the first failure is
+  raised once it is reached, so errors read exactly as they do when the
+  files are read one after another.
 
   Args:
-    data_list: a list of Data objects
-    ax: a matplotlib axis object
     args: an argparse arguments object
+
+  Returns:
+    data_list: a list of Data objects, one per series of each input file.
   """
-  data_min = min(map(numpy.min, map(lambda x: x.y, data_list)))
-  data_max = max(map(numpy.max, map(lambda x: x.y, data_list)))
-  data_range = data_max - data_min
-  if data_range == 0.0:
-    data_min, data_max, data_range = -0.5, 0.5, 1.0
-  data_min -= data_range * 0.1
-  data_max += data_range * 0.1
-  for i, data in enumerate(data_list, 0):
-    data.x = GetPointYValues(len(data.y), i, args)
-    ax.add_line(
-      lines.Line2D(xdata=data.y,
-                   ydata=data.x,
-                   color=ColorPicker(i, args),
+  pool = multiprocessing.Pool(min(args.jobs, len(args.files)))
+  try:
+    data_list = []
+    jobs = [(i, a_file, args) for i, a_file in enumerate(args.files)
+            if a_file != '-']
+    results = pool.imap(ReadFileJob, jobs)
+    for i, a_file in enumerate(args.files):
+      if a_file == '-':
+        # stdin belongs to this process, so it is read here
+        file_data, limits, messages, error = ReadFileJob((i, a_file, args))
+      else:
+        file_data, limits, messages, error = results.next()
+      sys.stderr.write(messages)
+      if error is not None:
+        raise error
+      xmin, xmax, ymin, ymax = limits
+      args.xmin = min(args.xmin, xmin)
+      args.xmax = max(args.xmax, xmax)
+      args.ymin = min(args.ymin, ymin)
+      args.ymax = max(args.ymax, ymax)
+      data_list.extend(file_data)
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+  return data_list
+
+
+def ReadFileJob(job):
+  """ Read one file inside a ReadFilesParallel worker process.
+
+  Args:
+    job: a tuple of the file's index, its path and the arguments object
+
+  Returns:
+    file_data: a list of Data objects, or None if the file could not be
+      read
+    limits: the (xmin, xmax, ymin, ymax) of the file's data
+    messages: everything written to stderr while reading
+    error: the exception raised while reading, or None
+  """
+  i, a_file, args = job
+  args = copy.copy(args)
+  args.xmin, args.xmax = sys.maxint, -sys.maxint
+  args.ymin, args.ymax = sys.maxint, -sys.maxint
+  stderr = sys.stderr
+  sys.stderr = StringIO()
+  try:
+    try:
+      file_data = ReadFile(a_file, args, i)
+    except Exception as e:
+      return None, None, sys.stderr.getvalue(), e
+    limits = (args.xmin, args.xmax, args.ymin, args.ymax)
+    return file_data, limits, sys.stderr.getvalue(), None
+  finally:
+    sys.stderr = stderr
+
+
+def ReadFile(a_file, args, index=0):
+  """ Read and parse a single input file.
+
+  Args:
+    a_file: path to the input file
+    args: an argparse arguments object
+    index: the file's position in args.files, which seeds its --downsample
+
+  Returns:
+    file_data: a list of Data objects, one per y column of --columns
+  """
+  d = Data()
+  d.label = os.path.basename(a_file)
+  file_data = [d]
+  # note the limits of this file alone, then fold them into the others
+  limits = (args.xmin, args.xmax, args.ymin, args.ymax)
+  args.xmin, args.xmax = sys.maxint, -sys.maxint
+  args.ymin, args.ymax = sys.maxint, -sys.maxint
+  if args.mode == 'matrix':
+    reader = MatrixReader(a_file, args)
+    if IsBinaryInput(a_file, args):
+      matrix = LoadBinaryArray(a_file, args)
+      reader.num_rows = len(matrix)
+    else:
+      f = OpenInput(a_file)
+      matrix = reader.read(f)
+      f.close()
+    if args.downsample:
+      if len(matrix) > args.downsample:
+        matrix = matrix[SampleRows(len(matrix), args, index)]
+    d.matrix = matrix
+    d.process_columns(dict((c, matrix[:, c]) for c in args.columns), None,
+                      args)
+    d.num_rows = reader.num_rows
+    d.num_dropped = reader.num_dropped
+  elif args.mode == 'hist' and args.stream:
+    reader = BinCountReader(a_file, args, args.hist_edges)
+    ReadColumns(a_file, reader, args)
+    d.histogram = reader.counts, reader.edges
+    d.num_rows = reader.num_rows
+    d.num_dropped = reader.num_dropped
+    ExtendLimits(reader, args)
+  elif args.mode == 'contour' and args.stream:
+    reader = ReadHistogram(a_file, args)
+    d.histogram = reader.histogram, reader.xedges, reader.yedges
+    d.num_rows = reader.num_rows
+    d.num_dropped = reader.num_dropped
+    ExtendLimits(reader, args)
+  else:
+    if args.stream and args.downsample:
+      reader = ReservoirReader(a_file, args, args.downsample)
+    else:
+      reader = ColumnReader(a_file, args)
+    columns, labels = ReadColumns(a_file, reader, args)
+    if args.downsample and not args.stream:
+      columns, labels = DownsampleColumns(columns, labels, args, index)
+    file_data = SeriesData(d.label, columns, labels, args, reader)
+    file_data[0].num_rows = reader.num_rows
+    file_data[0].num_dropped = reader.num_dropped
+    if args.stream:
+      ExtendLimits(reader, args)
+  for d in file_data:
+    if d.limits is None:
+      d.limits = (args.xmin, args.xmax, args.ymin, args.ymax)
+  args.xmin = min(args.xmin, limits[0])
+  args.xmax = max(args.xmax, limits[1])
+  args.ymin = min(args.ymin, limits[2])
+  args.ymax = max(args.ymax, limits[3])
+  return file_data
+
+
+def ApplyMemoryBudget(args):
+  """ Switch to reading with bounded memory if the inputs would not fit in
+  --max_memory.
+
+  --mode hist and contour then count rows into their histograms as they
+  are read, with --stream, --mode matrix spills to --matrix_memmap and
+  the other modes keep a --stream --downsample sample, in file order, of
+  as many rows of each input as fit. --mode line is also drawn with
+  --decimate minmax. Inputs that can not be sized beforehand, stdin and
+  .npz files, are left out of the estimate; their readers stop with an
+  error once they outgrow the budget.
+
+  Args:
+    args: an argparse arguments object
+  """
+  if args.stream and (args.downsample or args.mode in ('hist', 'contour')):
+    return  # memory is already bounded
+  itemsize = numpy.dtype(args.dtype).itemsize
+  sizes = [size for size in (EstimateInput(a_file, args)
+                             for a_file in args.files)
+           if size is not None]
+  if args.mode == 'matrix':
+    row_bytes = None
+    needed = (sum(rows * columns for rows, columns in sizes) * itemsize *
+              MEMORY_COPIES)
+  else:
+    row_bytes = len(set(args.columns)) * itemsize * MEMORY_COPIES
+    needed = sum(rows for rows, columns in sizes) * row_bytes
+  budget = args.max_memory * 1048576
+  if needed <= budget:
+    return
+  if args.mode == 'matrix':
+    if args.matrix_memmap:
+      return
+    args.matrix_memmap = True
+    remedy = '--matrix_memmap'
+  elif (args.mode in ('hist', 'contour') and '-' not in args.files and
+        len(args.columns) <= 2):
+    # stdin could not be read again to find the histogram range
+    args.stream = True
+    remedy = '--stream'
+  else:
+    downsample = max(1, int(budget / row_bytes / len(args.files)))
+    if args.downsample is not None:
+      downsample = min(downsample, args.downsample)
+    args.stream = True
+    args.downsample = downsample
+    remedy = '--stream --downsample %d' % downsample
+    if args.mode == 'line' and args.decimate is None:
+      # a sample can still be too many points for one line to draw
+      args.decimate = 'minmax'
+      remedy += ' --decimate minmax'
+  sys.stderr.write('Warning, the inputs would take about %.1f MB, more '
+                   'than the --max_memory of %g MB. Reading them with %s '
+                   'instead.\n' % (needed / 1048576.0, args.max_memory,
+                                    remedy))
+
+
+def EstimateInput(a_file, args):
+  """ Estimate the size of an input from its first chunk.
+
+  Args:
+    a_file: path to the input file
+    args: an argparse arguments object
+
+  Returns:
+    (rows, columns) of the input, or None if it can not be sized without
+    reading all of it.
+  """
+  if a_file == '-':
+    return None
+  if IsBinaryInput(a_file, args):
+    if os.path.splitext(a_file)[1].lower() == '.npz':
+      return None
+    return LoadBinaryArray(a_file, args).shape
+  f = OpenInput(a_file)
+  try:
+    lines = f.readlines(PARSE_CHUNK_BYTES)
+    at_end = not f.read(1)
+    if isinstance(f, io.BufferedReader):
+      read_bytes = f.raw.raw.tell()  # compressed bytes taken so far
+    else:
+      read_bytes = sum(len(line) for line in lines)
+  finally:
+    f.close()
+  data = [line for line in lines
+          if line.strip() and not line.lstrip().startswith('#')]
+  if not data:
+    return None
+  rows = len(data)
+  if not at_end and read_bytes:
+    rows = int(rows * float(os.path.getsize(a_file)) / read_bytes)
+  return rows, len(data[0].split())
+
+
+def ReadColumns(a_file, reader, args):
+  """ Parse a file with reader, going through the parse cache if --cache.
+
+  Args:
+    a_file: path to the input file
+    reader: a ColumnReader
+    args: an argparse arguments object
+
+  Returns:
+    columns: a dict of numpy arrays keyed on column index
+    labels: a list of strings or None
+  """
+  if IsBinaryInput(a_file, args):
+    reader.replay(*LoadBinaryColumns(a_file, reader.wanted, args))
+    return reader.finish()
+  key = (os.path.abspath(a_file), reader.label_column)
+  bounded = args.stream or args.max_memory is not None
+  if key in PARSED_INPUTS and not bounded:
+    reader.replay(*PARSED_INPUTS[key])
+    return reader.finish()
+  if not args.cache or a_file == '-':
+    f = OpenInput(a_file)
+    columns, labels = reader.read(f)
+    f.close()
+    return columns, labels
+  cache = ParseCache(args)
+  if not args.cache_rebuild and cache.load(a_file, reader):
+    cache.evict()
+    return reader.finish()
+  reader.cache_writer = cache.writer(a_file, reader)
+  try:
+    f = OpenInput(a_file)
+    columns, labels = reader.read(f)
+    f.close()
+  except:
+    reader.cache_writer.abort()
+    raise
+  reader.cache_writer.commit()
+  cache.evict()
+  return columns, labels
+
+
+def IsBinaryInput(a_file, args):
+  """ Return True if an input holds binary numbers rather than text.
+
+  .npy and .npz files always do, every other file does if --raw_dtype is
+  given.
+  """
+  if a_file == '-':
+    return False
+  extension = os.path.splitext(a_file)[1].lower()
+  return extension in ('.npy', '.npz') or args.raw_dtype is not None
+
+
+def LoadBinaryArray(a_file, args):
+  """ Memory map a binary input as a 2D array of rows by columns.
+
+  .npy files and --raw_dtype files are memory mapped, so only the pages
+  that are used are ever read. Members of an .npz file can not be mapped
+  and are read whole.
+
+  Args:
+    a_file: path to the input file
+    args: an argparse arguments object
+
+  Returns:
+    array: a 2D numpy array or memmap
+  Raises:
+    BadInput: If the input does not hold a 1D or 2D array of numbers.
+  """
+  extension = os.path.splitext(a_file)[1].lower()
+  if extension == '.npz':
+    archive = numpy.load(a_file)
+    try:
+      if len(archive.files) == 1:
+        array = archive[archive.files[0]]
+      else:
+        array = numpy.column_stack([archive[name]
+                                    for name in NpzColumnNames(archive)])
+    finally:
+      archive.close()
+  elif extension == '.npy':
+    array = numpy.load(a_file, mmap_mode='r')
+  else:
+    array = MapRawFile(a_file, args)
+  if array.dtype.names is not None:
+    array = numpy.column_stack([array[name] for name in array.dtype.names])
+  if array.ndim == 1:
+    array = array.reshape(-1, 1)
+  if array.ndim != 2 or array.dtype.kind not in 'biuf':
+    raise BadInput('%s does not hold a 1D or 2D array of numbers.' % a_file)
+  return array
+
+
+def LoadBinaryColumns(a_file, wanted, args):
+  """ Load the wanted columns of a binary input.
+
+  Columns of a memory mapped input are views of the file, so a column
+  laid out contiguously, as in a Fortran order .npy, a --raw_order F file
+  or an .npz file of one member per column, is the only part of the file
+  read. Columns that are not native float64 are converted.
+
+  Args:
+    a_file: path to the input file
+    wanted: a list of column indices
+    args: an argparse arguments object
+
+  Returns:
+    the arguments of ColumnReader.replay(): a dict of numpy arrays keyed
+    on column index, None for the labels, the number of rows and the min
+    and max of each column
+  Raises:
+    BadInput: If a wanted column is not in the file.
+  """
+  extension = os.path.splitext(a_file)[1].lower()
+  block = {}
+  if extension == '.npz':
+    archive = numpy.load(a_file)
+    try:
+      if len(archive.files) > 1:
+        # one member per column, only the wanted ones are decompressed
+        names = NpzColumnNames(archive)
+        CheckBinaryColumns(a_file, wanted, len(names))
+        for c in wanted:
+          block[c] = archive[names[c]].ravel()
+    finally:
+      archive.close()
+  if not block:
+    array = LoadBinaryArray(a_file, args)
+    CheckBinaryColumns(a_file, wanted, array.shape[1])
+    for c in wanted:
+      block[c] = array[:, c]
+  num_rows = len(block[wanted[0]])
+  mins, maxs = {}, {}
+  for c in wanted:
+    if len(block[c]) != num_rows:
+      raise BadInput('The columns of %s differ in length.' % a_file)
+    if block[c].dtype != numpy.dtype(float):
+      block[c] = block[c].astype(float)
+    mins[c], maxs[c] = numpy.nan, numpy.nan
+    if num_rows:
+      mins[c] = numpy.fmin.reduce(block[c])
+      maxs[c] = numpy.fmax.reduce(block[c])
+  return block, None, num_rows, mins, maxs
+
+
+def NpzColumnNames(archive):
+  """ Order the members of an .npz file as columns.
+
+  numpy.savez() does not keep the order of its arguments, so members are
+  ordered by name: numpy's own arr_0, arr_1, ... by number, then any
+  others alphabetically.
+
+  Args:
+    archive: a numpy NpzFile
+
+  Returns:
+    names: a list of member names, one per column
+  """
+  def Key(name):
+    if name.startswith('arr_') and name[4:].isdigit():
+      return (0, int(name[4:]), name)
+    return (1, 0, name)
+  return sorted(archive.files, key=Key)
+
+
+def CheckBinaryColumns(a_file, wanted, num_columns):
+  """ Raise BadInput if a wanted column is past the last of a binary input.
+  """
+  if max(wanted) >= num_columns:
+    raise BadInput('--columns %d requested but %s has %d columns.'
+                   % (max(wanted) + 1, a_file, num_columns))
+
+
+def MapRawFile(a_file, args):
+  """ Memory map a headerless file of --raw_columns columns of --raw_dtype.
+
+  Args:
+    a_file: path to the input file
+    args: an argparse arguments object
+
+  Returns:
+    array: a 2D numpy memmap
+  Raises:
+    BadInput: If the file size is not a whole number of rows.
+  """
+  dtype = numpy.dtype(args.raw_dtype)
+  row_bytes = dtype.itemsize * args.raw_columns
+  size = os.path.getsize(a_file)
+  if size % row_bytes:
+    raise BadInput('%s holds %d bytes, not a whole number of %d byte rows '
+                   'of --raw_columns %d --raw_dtype %s.'
+                   % (a_file, size, row_bytes, args.raw_columns,
+                      args.raw_dtype))
+  if not size:
+    # empty files can not be mapped
+    return numpy.zeros((0, args.raw_columns), dtype=dtype)
+  return numpy.memmap(a_file, dtype=dtype, mode='r',
+                      shape=(size // row_bytes, args.raw_columns),
+                      order=args.raw_order)
+
+
+def HistogramEdges(args):
+  """ Decide the bins of --mode hist --stream, shared by every file.
+
+  The bins span --xmin to --xmax where given and the limits of the
+  counted column, the last of --columns, otherwise, which takes a first
+  pass over every file to find.
+
+  Args:
+    args: an argparse arguments object
+
+  Returns:
+    edges: a numpy array of --hist_bins + 1 evenly spaced bin edges
+  """
+  lo, hi = args.user_xmin, args.user_xmax
+  if lo == sys.maxint or hi == -sys.maxint:
+    if '-' in args.files:
+      raise BadInput('--mode hist --stream can only read stdin once, '
+                     'so needs both --xmin and --xmax.')
+    data_min, data_max = numpy.nan, numpy.nan
+    column = args.columns[-1]  # as BinCountReader counts
+    for a_file in args.files:
+      first_pass = LimitsReader(a_file, args)
+      ReadColumns(a_file, first_pass, args)
+      data_min = numpy.fmin(data_min, first_pass.min[column])
+      data_max = numpy.fmax(data_max, first_pass.max[column])
+    if numpy.isnan(data_min):
+      raise BadInput('The input files hold no data to plot.')
+    lo, hi = HandleLimits(data_min, data_max, args.user_xmin, args.user_xmax)
+  if lo == hi:
+    # as numpy.histogram does
+    lo, hi = lo - 0.5, hi + 0.5
+  return numpy.linspace(lo, hi, args.hist_bins + 1)
+
+
+def ReadHistogram(a_file, args):
+  """ Stream a file into the 2D histogram of --mode contour --stream.
+
+  The histogram spans --xmin, --xmax, --ymin and --ymax where given and
+  the limits of the data otherwise, which takes a first pass to find.
+
+  Args:
+    a_file: path to the input file
+    args: an argparse arguments object
+
+  Returns:
+    reader: a HistogramReader that has finished reading
+  """
+  x_column, y_column = args.columns[0], args.columns[1]
+  limits = [[args.user_xmin, args.user_xmax], [args.user_ymin, args.user_ymax]]
+  if (sys.maxint in (limits[0][0], limits[1][0]) or
+      -sys.maxint in (limits[0][1], limits[1][1])):
+    if a_file == '-':
+      raise BadInput('--mode contour --stream can only read stdin once, '
+                     'so needs all of --xmin, --xmax, --ymin and --ymax.')
+    first_pass = LimitsReader(a_file, args)
+    ReadColumns(a_file, first_pass, args)
+    if numpy.isnan([first_pass.min[x_column], first_pass.min[y_column]]).any():
+      raise BadInput('Input file %s holds no data to plot.' % a_file)
+    limits = [list(HandleLimits(first_pass.min[c], first_pass.max[c],
+                                user_min, user_max))
+              for c, (user_min, user_max) in zip((x_column, y_column), limits)]
+  reader = HistogramReader(a_file, args, args.contour_bin, limits)
+  ReadColumns(a_file, reader, args)
+  return reader
+
+
+def ExtendLimits(reader, args, y_columns=None):
+  """ Widen the data limits to cover every row a reader has seen.
+
+  Args:
+    reader: a ColumnReader that has finished reading
+    args: an argparse arguments object
+    y_columns: the y columns to cover, by default all of them
+  """
+  if y_columns is None:
+    y_columns = YColumns(args)
+  if not reader.num_rows:
+    return
+  if len(args.columns) > 1:
+    x_column = args.columns[0]
+    if not numpy.isnan(reader.min[x_column]):
+      args.xmin = min(args.xmin, reader.min[x_column])
+      args.xmax = max(args.xmax, reader.max[x_column])
+  for y_column in y_columns:
+    if not numpy.isnan(reader.min[y_column]):
+      args.ymin = min(args.ymin, reader.min[y_column])
+      args.ymax = max(args.ymax, reader.max[y_column])
+
+
+def OpenInput(a_file):
+  """ Open an input file, inflating gzip, bzip2 and xz data as it is read.
+
+  The compression format is recognized by the file's leading bytes, not
+  by its name.
+
+  Args:
+    a_file: path to the input file, or - for stdin
+
+  Returns:
+    f: a file like object
+  """
+  if a_file == '-':
+    raw = sys.stdin
+  else:
+    raw = open(a_file, 'rb')
+  head = raw.read(max(len(magic) for magic, name in COMPRESSION_MAGIC))
+  compression = None
+  for magic, name in COMPRESSION_MAGIC:
+    if head.startswith(magic):
+      compression = name
+  if compression is None and a_file != '-':
+    raw.seek(0)
+    return raw
+  return io.BufferedReader(InputStream(raw, head, compression),
+                           COMPRESSED_CHUNK_BYTES)
+
+
+def NewDecompressor(compression):
+  """ Return a streaming decompressor object.
+
+  Args:
+    compression: one of gzip, bz2 or xz
+
+  Returns:
+    decompressor: an object with decompress() and unused_data
+  Raises:
+    BadInput: If xz input is read without the lzma module.
+  """
+  if compression == 'gzip':
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+  elif compression == 'bz2':
+    return bz2.BZ2Decompressor()
+  elif compression == 'xz':
+    if lzma is None:
+      raise BadInput('Reading xz compressed input requires the lzma module '
+                     '(backports.lzma for python 2).')
+    return lzma.LZMADecompressor()
+
+
+def DownsampleColumns(columns, labels, args, index=0):
+  """ Randomly sample --downsample rows from parsed columns.
+
+  Args:
+    columns: a dict of numpy arrays keyed on column index
+    labels: a list of strings or None
+    args: an argparse arguments object
+    index: the input's position among the inputs, see SampleRows()
+
+  Returns:
+    columns: a dict of numpy arrays keyed on column index
+    labels: a list of strings or None
+  """
+  n = len(columns.values()[0])
+  if n <= args.downsample:
+    return columns, labels
+  rows = SampleRows(n, args, index)
+  for c in columns:
+    columns[c] = columns[c][rows]
+  if labels is not None:
+    labels = [labels[i] for i in rows]
+  return columns, labels
+
+
+def SampleRows(n, args, index=0):
+  """ Pick --downsample of n rows at random.
+
+  With --random_seed each input is sampled with a generator of its own,
+  seeded with the seed plus the input's position, so the rows picked from
+  a file do not depend on the files read before it or on --jobs. The
+  first input gets the rows random.sample() always gave for the seed.
+
+  Args:
+    n: number of rows
+    args: an argparse arguments object
+    index: the input's position among the inputs
+
+  Returns:
+    rows: a list of row indices
+  """
+  if args.random_seed is None:
+    return random.sample(xrange(n), args.downsample)
+  return random.Random(args.random_seed + index).sample(xrange(n),
+                                                        args.downsample)
+
+
+def PlotOneDimension(data_list, ax, args):
+  """ Plot one dimensional data.
+
+  Args:
+    data_list: a list of Data objects.
+    ax: a matplotlib axis object.
+    args: an argparse arguments object.
+  """
+  if args.mode == 'bar' or args.mode == 'column':
+    PlotColumns(data_list, ax, args)
+  elif args.mode == 'hist':
+    PlotHistogram(data_list, ax, args)
+  elif args.mode == 'tick' or args.mode == 'barcode':
+    PlotTicks(data_list, ax, args)
+  elif args.mode == 'point':
+    PlotPoints(data_list, ax, args)
+
+
+def PlotHistogram(data_list, ax, args):
+  """ Plot one dimensional data as histogram.
+
+  Args:
+    data_list: a list of Data objects.
+    ax: a matplotlib axis object.
+    args: an argparse arguments object.
+  """
+  width = 2.0 / 3.0 / len(data_list)
+  if data_list[0].histogram is not None:
+    # counted while streaming, each bin is drawn as one value at its center
+    edges = data_list[0].histogram[1]
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    n, bins, patch_groups = ax.hist(
+      [centers] * len(data_list), bins=edges,
+      weights=[data.histogram[0] for data in data_list],
+      color=ColorPicker(len(data_list), args), histtype='bar')
+  else:
+    datas = []
+    for data in data_list:
+      datas.append(data.y)
+    n, bins, patch_groups = ax.hist(
+      datas, bins=args.hist_bins, color=ColorPicker(len(data_list), args),
+      histtype='bar')
+  for pg in patch_groups:
+    if isinstance(pg, matplotlib.container.BarContainer):
+      # if there are multiple files, pg will be a BarContainer
+      for patch in pg.patches:
+        patch.set_edgecolor('none')
+    else:
+      # if there is only one file to plot, pg is a Rectangle
+      pg.set_edgecolor('white')
+
+
+def BinCounts(values, edges):
+  """ numpy.histogram for evenly spaced bins, by bincount.
+
+  Values are placed arithmetically, HISTOGRAM_CHUNK_ROWS at a time, then
+  nudged across any edge rounding put them on the wrong side of, as
+  numpy.histogram does, so the counts are the same as its.
+
+  Args:
+    values: a numpy array
+    edges: a numpy array of evenly spaced bin edges
+
+  Returns:
+    counts: a numpy array of the number of values in each bin, values
+            outside the edges and NaNs are not counted.
+  """
+  num_bins = len(edges) - 1
+  lo, hi = edges[0], edges[-1]
+  counts = numpy.zeros(num_bins, dtype=numpy.int64)
+  for start in xrange(0, len(values), HISTOGRAM_CHUNK_ROWS):
+    v = values[start:start + HISTOGRAM_CHUNK_ROWS]
+    with numpy.errstate(invalid='ignore'):
+      v = v[(v >= lo) & (v <= hi)]
+    i = ((v - lo) * (num_bins / (hi - lo))).astype(numpy.intp)
+    i[i == num_bins] -= 1
+    i[v < edges[i]] -= 1
+    i[(v >= edges[i + 1]) & (i != num_bins - 1)] += 1
+    counts += numpy.bincount(i, minlength=num_bins)
+  return counts
+
+
+def PlotColumns(data_list, ax, args):
+  """ Plot one dimensional data as column / bar plot.
+
+  Args:
+    data_list: a list of Data objects.
+    ax: a matplotlib axis object.
+    args: an argparse arguments object.
+  """
+  width = 2.0 / 3.0 / len(data_list)
+  data_min = min(map(numpy.min, map(lambda x: x.y, data_list)))
+  data_max = max(map(numpy.max, map(lambda x: x.y, data_list)))
+  args.xmin = 0
+  args.xmax = max(map(len, map(lambda data: data.y, data_list)))
+  for i, data in enumerate(data_list, 0):
+    data.x = range(0, len(data.y))
+    data.x = numpy.add(data.x, width * i)  # offset
+    rects = ax.bar(data.x,
+                   data.y,
+                   width,
+                   color=ColorPicker(i, args),
+                   linewidth=0.0,
+                   alpha=1.0)
+    ax.xaxis.set_ticklabels([])
+  xmin, xmax, ymin, ymax = ax.axis()
+  xmin, xmax = HandleLimits(xmin, xmax, args.user_xmin, args.user_xmax)
+  ymin, ymax = HandleLimits(min(0.0, data_min), ymax,
+                            args.user_ymin, args.user_ymax)
+  args.ymin = ymin
+  args.ymax = ymax
+  ax.set_ylim([ymin, ymax])
+  if args.xtick_label_column is not None:
+    ax.xaxis.set_ticks(numpy.arange(0, len(data.xtick_labels)) + width / 2.)
+    ax.xaxis.set_ticklabels(data.xtick_labels, rotation=35,
+                            horizontalalignment='right')
+  args.xmin = xmin
+  args.xmax = xmax
+  ax.set_xlim([xmin, xmax])
+
+
+def GetTickYValues(n, i, args):
+  """ Produce the lower and upper y values for a Tick plot.
+
+  Args:
+    n: number of ticks to produce values for.
+    i: Integer offset of this set of values.
+    args: an argparse arguments object.
+
+  Returns:
+    y0, y1: arrays of the lower and upper y values for a Tick Plot
+  """
+  if args.jitter:
+    lo = numpy.random.uniform(low=0.0, high=0.3, size=n)
+    return i + lo, i + lo + 0.1
+  else:
+    return numpy.repeat(float(i), n), numpy.repeat(i + 0.8, n)
+
+
+def HandleLimits(data_min, data_max, user_min, user_max):
+  """ Decides whether to use the data values or user supplied values.
+
+  Args:
+    data_min: minimum value from the data
+    data_max: maximum value from the data
+    user_min: possibly a user requested value for min
+    user_max: possibly a user requested value for max
+
+  Returns:
+    a_min: the correct minimum
+    a_max: the correct maximum
+  """
+  a_min, a_max = data_min, data_max
+  if user_min != sys.maxint:
+    a_min = user_min
+  if user_max != -sys.maxint:
+    a_max = user_max
+  return a_min, a_max
+
+
+def PlotTicks(data_list, ax, args):
+  """ Plot one dimensional data as tick marks on a line.
+
+  Args:
+    data_list: a list of Data objects
+    ax: a matplotlib axis object
+    args: an argparse arguments object
+  """
+  data_min = min(map(numpy.min, map(lambda x: x.y, data_list)))
+  data_max = max(map(numpy.max, map(lambda x: x.y, data_list)))
+  data_range = data_max - data_min
+  if data_range == 0.0:
+    data_min, data_max, data_range = -0.5, 0.5, 1.0
+  data_min -= data_range * 0.1
+  data_max += data_range * 0.1
+  for i, data in enumerate(data_list, 0):
+    # one collection per file, segments[k] runs from (x, y0) to (x, y1)
+    y0, y1 = GetTickYValues(len(data.y), i, args)
+    segments = numpy.empty((len(data.y), 2, 2))
+    segments[:, 0, 0] = data.y
+    segments[:, 1, 0] = data.y
+    segments[:, 0, 1] = y0
+    segments[:, 1, 1] = y1
+    ticks = collections.LineCollection(segments,
+                                       colors=[ColorPicker(i, args)],
+                                       linewidths=args.linewidth,
+                                       alpha=args.alpha)
+    ticks.set_capstyle(matplotlib.rcParams['lines.solid_capstyle'])
+    ax.add_collection(ticks, autolim=False)
+  ymin, ymax = HandleLimits(0.0, len(data_list),
+                            args.user_ymin, args.user_ymax)
+  ax.set_ylim([ymin, ymax])
+  xmin, xmax = HandleLimits(data_min, data_max,
+                            args.user_xmin, args.user_xmax)
+  ax.set_xlim([xmin, xmax])
+  ax.yaxis.set_ticks_position('none')
+  ax.yaxis.set_ticks([])
+
+
+def GetPointYValues(n, i, args):
+  """ Produce the y values for a Point plot.
+
+  Args:
+    n: number of values to produce.
+    i: Integer offset of this set of values.
+    args: an argparse arguments object.
+
+  Returns:
+    y: a list of y values for a Point plot.
+  """
+  if args.jitter:
+    return numpy.random.uniform(low=i, high=i + 0.5, size=n)
+  else:
+    return [i] * n
+
+
+def PlotPoints(data_list, ax, args):
+  """ Plot one dimensional data as points on a line.
+
+  Args:
+    data_list: a list of Data objects
+    ax: a matplotlib axis object
+    args: an argparse arguments object
+  """
+  data_min = min(map(numpy.min, map(lambda x: x.y, data_list)))
+  data_max = max(map(numpy.max, map(lambda x: x.y, data_list)))
+  data_range = data_max - data_min
+  if data_range == 0.0:
+    data_min, data_max, data_range = -0.5, 0.5, 1.0
+  data_min -= data_range * 0.1
+  data_max += data_range * 0.1
+  for i, data in enumerate(data_list, 0):
+    data.x = GetPointYValues(len(data.y), i, args)
+    ax.add_line(
+      lines.Line2D(xdata=data.y,
+                   ydata=data.x,
+                   color=ColorPicker(i, args),
                    marker='o',
                    markersize=args.markersize,
                    markerfacecolor=ColorPicker(i, args),
@@ -1094,135 +3558,1167 @@ def PlotPoints(data_list, ax, args):
   ax.yaxis.set_ticks([])
 
 
-def PlotData(data_list, ax, args):
-  """ Plot all of the data according to input arguments.
+def PlotData(data_list, ax, args):
+  """ Plot all of the data according to input arguments.
+
+  Args:
+    data_list: a list of Data objects.
+    ax: a matplotlib axis object.
+    args: an argparse argument object.
+  """
+  if args.mode in ('scatter', 'line', 'contour', 'density', 'matrix'):
+    PlotTwoDimension(data_list, ax, args)
+  elif args.mode in ('bar', 'column', 'hist', 'tick', 'barcode', 'point'):
+    PlotOneDimension(data_list, ax, args)
+
+
+def MakeProxyPlots(args):
+  """ Make some proxy plots for use with legends.
+
+  Proxy plots are plots that are not actually drawn but whose
+  colors are used for correctly populating a legend.
+
+  Args:
+    args: an argparse argument object.
+
+  Returns:
+    proxy_plots: A list of matplotlib plot objects.
+  """
+  if args.mode != 'hist':
+    proxy_plots = []
+    for i, label in enumerate(args.series_labels, 0):
+      proxy_plots.append(
+        plt.Rectangle(
+          (0, 0), 1, 1,
+          fc=ColorPicker(i, args),
+          ec=ColorPicker(i, args)))
+  else:
+    proxy_plots = []
+    for i, label in enumerate(args.series_labels, 0):
+      proxy_plots.append(
+        plt.Rectangle(
+          (0, 0), 1, 1,
+          fc=ColorPicker(len(args.series_labels), args)[i],
+          ec=ColorPicker(len(args.series_labels), args)[i]))
+  return proxy_plots
+
+
+def MakeLegendLabels(args):
+  """ Make labels for use with legends.
+
+  Args:
+    args: an argparse argument object
+
+  Returns:
+    legend_labels: A list of strings.
+  """
+  return list(args.series_labels)
+
+
+def CleanAxis(ax, args):
+  """ Clean the axis up, apply scales, add legend.
+
+  Args:
+    ax: a matplotlib axis object
+    args: an argparse argument object
+  """
+  # y axis
+  if args.is_log_y:
+    ax.set_yscale('log')
+  else:
+    if args.mode not in ('hist', 'tick', 'barcode', 'point', 'bar', 'column'):
+      arange = args.ymax - args.ymin
+      ymin, ymax = HandleLimits(args.ymin - arange * 0.05,
+                                args.ymax + arange * 0.05,
+                                args.user_ymin, args.user_ymax)
+      ax.set_ylim([ymin, ymax])
+  # x axis
+  if args.is_log_x:
+    ax.set_xscale('log')
+  else:
+    if args.mode not in ('hist', 'tick', 'barcode', 'point', 'bar', 'column'):
+      arange = args.xmax - args.xmin
+      xmin, xmax = HandleLimits(args.xmin - arange * 0.05,
+                                args.xmax + arange * 0.05,
+                                args.user_xmin, args.user_xmax)
+      ax.set_xlim([xmin, xmax])
+  # labels
+  if args.xlabel != 'sentinel_value':
+    ax.set_xlabel(args.xlabel)
+  if args.ylabel != 'sentinel_value':
+    if args.mode in ('tick', 'barcode', 'point'):
+      sys.stderr.write(
+        'Warning, --ylabel specified while '
+        '--mode=(tick, barcode or point), ylabel not displayed\n')
+    else:
+      ax.set_ylabel(args.ylabel)
+  if args.title != 'sentinel_value':
+    ax.set_title(args.title)
+  # legend
+  if args.is_legend:
+    if args.mode not in ['contour', 'matrix']:
+      proxy_plots = MakeProxyPlots(args)
+      legend_labels = MakeLegendLabels(args)
+      leg = plt.legend(proxy_plots, legend_labels, 'upper right', numpoints=1)
+      leg._drawFrame = False
+  # aspect ratio
+  if args.aspect_equal or args.mode == 'matrix':
+    ax.axis('equal')
+
+
+def DefaultSocketPath():
+  """ Return the unix socket used by --serve when none is given.
+
+  It is kept in $XDG_RUNTIME_DIR or else in a directory of this user's
+  own, made by Serve(), so no other user can bind it first.
+  """
+  if os.environ.get('QUICK_PLOT_SOCKET'):
+    return os.environ['QUICK_PLOT_SOCKET']
+  directory = os.environ.get('XDG_RUNTIME_DIR')
+  if not directory:
+    directory = os.path.join(tempfile.gettempdir(),
+                             'quick_plot-%d' % os.getuid())
+  return os.path.join(directory, 'quick_plot.sock')
+
+
+def SocketDirectory(socket_path):
+  """ Make the directory of a socket, private to this user, if need be.
+
+  Args:
+    socket_path: path of the unix socket
+  Raises:
+    BadInput: If the directory belongs to another user.
+  """
+  directory = os.path.dirname(os.path.abspath(socket_path))
+  try:
+    os.mkdir(directory, 0o700)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+  owner = os.lstat(directory).st_uid
+  if owner not in (os.getuid(), 0):
+    raise BadInput('%s belongs to another user, choose a --socket of your '
+                   'own.' % directory)
+
+
+def ReadMessage(conn):
+  """ Read one json message, sent as everything up to end of stream.
+
+  Args:
+    conn: a connected socket object
+
+  Returns:
+    message: the decoded message
+  """
+  chunks = []
+  while True:
+    chunk = conn.recv(1 << 16)
+    if not chunk:
+      break
+    chunks.append(chunk)
+  return json.loads(''.join(chunks))
+
+
+def Serve(socket_path):
+  """ Render plots for quick_plot_client until killed.
+
+  The plotting libraries are imported once, by this process. Each job
+  arrives as a json object holding a command line and a working
+  directory and is drawn in a forked child, so it starts from a fresh
+  figure and cannot disturb later jobs.
+
+  Args:
+    socket_path: path of the unix socket to listen on
+  """
+  SocketDirectory(socket_path)
+  if os.path.exists(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      probe.connect(socket_path)
+    except socket.error:
+      os.remove(socket_path)  # left behind by a server that died
+    else:
+      raise BadInput('A server is already listening on %s' % socket_path)
+    finally:
+      probe.close()
+  for name in LAZY_MODULES:
+    ImportModule(name)
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  listener.bind(socket_path)
+  listener.listen(64)
+  # exit through the finally clause below, which removes the socket
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  try:
+    while True:
+      try:
+        conn, address = listener.accept()
+      except socket.error as e:
+        if e.errno == errno.EINTR:
+          continue
+        raise
+      pid = os.fork()
+      if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        listener.close()
+        try:
+          ServeJob(conn)
+        finally:
+          os._exit(0)
+      conn.close()
+      ReapChildren()
+  finally:
+    listener.close()
+    os.remove(socket_path)
+
+
+def ReapChildren():
+  """ Collect any finished job processes of Serve.
+  """
+  while True:
+    try:
+      pid, status = os.waitpid(-1, os.WNOHANG)
+    except OSError:
+      return
+    if pid == 0:
+      return
+
+
+def ServeJob(conn):
+  """ Run one job received by Serve and send back its outcome.
+
+  The reply is a json object holding the job's exit status, what it
+  wrote to stdout and stderr and the paths of the files it created. A
+  job reading stdin, which this process does not share with the client,
+  is not run; its reply has stdin set, so the client runs it instead.
+
+  Args:
+    conn: a connected socket object
+  """
+  global START_TIME, IMPORTED_TIME
+  # for --timing, a job starts now and its imports are already done
+  START_TIME = IMPORTED_TIME = time.time()
+  del LAZY_IMPORT_TIMES[:]
+  request = ReadMessage(conn)
+  os.chdir(request['cwd'])
+  if ReadsStdin(request['argv']):
+    response = {'status': 1,
+                'stdin': True,
+                'stdout': '',
+                'stderr': ('quick_plot --serve can not read stdin, -, run '
+                           'quick_plot itself instead.\n'),
+                'outputs': []}
+  else:
+    status, stdout, stderr, outputs = RunCaptured(Run, request['argv'])
+    response = {'status': status,
+                'stdout': stdout,
+                'stderr': stderr,
+                'outputs': outputs or []}
+  conn.sendall(json.dumps(response))
+  conn.close()
+
+
+def ReadsStdin(argv):
+  """ Return True if a command line reads stdin, -, as an input file.
+
+  Only the input files count, not an option value that happens to be -,
+  such as --title -. A command line that does not parse is left for Run()
+  to report.
+
+  Args:
+    argv: a list of command line arguments, without the program name
+  """
+  status, stdout, stderr, args = RunCaptured(ParseArguments, argv)
+  return status == 0 and '-' in args.files
+
+
+def RunCaptured(function, *arguments):
+  """ Call a function, capturing its output and turning errors into an
+  exit status, the way they would end a quick_plot process.
+
+  Args:
+    function: the function to call
+    arguments: the arguments to call it with
+
+  Returns:
+    status: the exit status, 0 on success
+    stdout: everything written to stdout
+    stderr: everything written to stderr
+    result: the function's return value, or None on failure
+  """
+  stdout, stderr = sys.stdout, sys.stderr
+  sys.stdout, sys.stderr = StringIO(), StringIO()
+  status, result = 0, None
+  try:
+    result = function(*arguments)
+  except SystemExit as e:
+    # parser.error() and --help end by calling sys.exit()
+    if isinstance(e.code, int):
+      status = e.code
+    elif e.code is not None:
+      sys.stderr.write('%s\n' % e.code)
+      status = 1
+  except Exception:
+    traceback.print_exc()
+    status = 1
+  captured = (sys.stdout.getvalue(), sys.stderr.getvalue())
+  sys.stdout, sys.stderr = stdout, stderr
+  return status, captured[0], captured[1], result
+
+
+def Run(argv):
+  """ Draw the plot described by a command line.
+
+  Args:
+    argv: a list of command line arguments, without the program name
+
+  Returns:
+    outputs: a list of the paths of the files written
+  """
+  del STAGE_TIMES[:]
+  del STAGE_USAGE[:]
+  PROFILE_COUNTS.clear()
+  STAGE_TIMES.append(('start', START_TIME))
+  STAGE_USAGE.append((0.0, 0))
+  STAGE_TIMES.append(('imports', IMPORTED_TIME))
+  STAGE_USAGE.append((IMPORTED_CPU, IMPORTED_RSS))
+  args = ParseArguments(argv)
+  MarkStage('arguments')
+  if args.profile_dump is not None:
+    profiler = ImportModule('cProfile').Profile()
+    try:
+      return profiler.runcall(Plot, args)
+    finally:
+      profiler.dump_stats(args.profile_dump)
+  return Plot(args)
+
+
+def ParseArguments(argv):
+  """ Parse and check a quick_plot command line.
+
+  Args:
+    argv: a list of command line arguments, without the program name
+
+  Returns:
+    args: an argparse arguments object
+  """
+  usage = '%(prog)s file1 file2 file3... [options]\n\n'
+  description = ('%(prog)s is a tool to produce quick plots. col1 '
+                 'of input file is x value col2 is y value. If '
+                 'the --mode is column/bar/hist then only col1 is '
+                 'used.')
+  parser = ArgumentParser(usage=usage, description=description)
+  InitArguments(parser)
+  args = parser.parse_args(argv)
+  CheckArguments(args, parser)
+  return args
+
+
+class ArrayArgumentParser(ArgumentParser):
+  """ Class ArrayArgumentParser raises ValueError on bad options rather than
+  exiting, for PlotArrays().
+  """
+  def error(self, message):
+    raise ValueError(message)
+
+
+def PlotArrays(series, mode='line', out=None, labels=None, **options):
+  """ Draw numpy arrays directly, without writing them out as text first.
+
+  A series is a 1D array of values, an (x, y) tuple of arrays, a 2D array
+  whose --columns are plotted or, for --mode matrix, the matrix itself.
+  Arrays already holding --dtype, float64 by default, are used as they are,
+  not copied. options are any quick_plot command line options by name,
+  without the leading dashes, e.g. title='Loss', xmin=0, no_legend=True.
+
+  Args:
+    series: a series or a list of series
+    mode: the --mode
+    out: None, a path, or a file object opened for binary writing
+    labels: a list of legend labels, one per series
+    options: quick_plot command line options
+
+  Returns:
+    image: the image as a string of bytes if out is None, otherwise None
+  Raises:
+    TypeError: If an option is unknown.
+    ValueError: If an option or a series is not valid.
+  """
+  if not isinstance(series, list):
+    series = [series]
+  if labels is None:
+    labels = ['series %d' % (i + 1) for i in xrange(len(series))]
+  if len(labels) != len(series):
+    raise ValueError('%d labels given for %d series.'
+                     % (len(labels), len(series)))
+  parser = ArrayArgumentParser()
+  InitArguments(parser)
+  argv = ['--mode', mode]
+  if isinstance(out, basestring):
+    argv += ['--out', out]
+    extension = os.path.splitext(out)[1][1:]
+    if 'out_format' not in options and extension in ('pdf', 'png', 'eps'):
+      argv += ['--out_format', extension]
+  for name in sorted(options):
+    action = parser._option_string_actions.get('--' + name)
+    if action is None:
+      raise TypeError('Unknown quick_plot option %s.' % name)
+    if action.nargs == 0:
+      if options[name]:
+        argv.append('--' + name)
+    else:
+      argv += ['--' + name, str(options[name])]
+  args = parser.parse_args(argv + ['--'] + labels,
+                           namespace=Namespace(in_memory=True))
+  CheckArguments(args, parser)
+  if args.watch or args.multipage or args.max_memory is not None:
+    raise ValueError('--watch, --multipage and --max_memory need input '
+                     'files.')
+  data_list = []
+  for i, (label, a_series) in enumerate(zip(labels, series)):
+    data_list.extend(ArrayData(label, a_series, args, i))
+  args.series_labels = [d.label for d in data_list]
+  if isinstance(out, basestring):
+    fig, pdf = InitImage(args)
+    DrawFigure(fig, data_list, args)
+    WriteImage(fig, pdf, args)
+    plt.close(fig)
+    return None
+  if len(args.out_formats) != 1:
+    raise ValueError('Only one --out_format can be written to a file '
+                     'object.')
+  fig = NewFigure(args)
+  DrawFigure(fig, data_list, args)
+  f = io.BytesIO() if out is None else out
+  if args.out_formats[0] == 'png' and args.png_compression is not None:
+    fig.canvas.draw()
+    WritePng(fig, f, args.dpi, args.png_compression)
+  else:
+    fig.savefig(f, format=args.out_formats[0], dpi=args.dpi)
+  plt.close(fig)
+  if out is None:
+    return f.getvalue()
+  return None
+
+
+def ArrayData(label, a_series, args, index=0):
+  """ Make Data objects from one series handed to PlotArrays().
 
   Args:
-    data_list: a list of Data objects.
-    ax: a matplotlib axis object.
-    args: an argparse argument object.
+    label: the name of the series
+    a_series: a numpy array, or an (x, y) tuple of them
+    args: an argparse arguments object
+    index: the series' position among the series, see SampleRows()
+
+  Returns:
+    data_list: a list of Data objects, one per y column of --columns
+  Raises:
+    ValueError: If the series does not suit the mode or --columns.
   """
-  if args.mode in ('scatter', 'line', 'contour', 'density', 'matrix'):
-    PlotTwoDimension(data_list, ax, args)
-  elif args.mode in ('bar', 'column', 'hist', 'tick', 'barcode', 'point'):
-    PlotOneDimension(data_list, ax, args)
+  if isinstance(a_series, tuple):
+    if len(a_series) != 2 or len(args.columns) != 2:
+      raise ValueError('%s: (x, y) series need a two column --mode and '
+                       '--columns.' % label)
+    columns = {args.columns[0]: numpy.asarray(a_series[0], dtype=args.dtype),
+               args.columns[1]: numpy.asarray(a_series[1],
+                                              dtype=args.dtype)}
+    if len(columns[args.columns[0]]) != len(columns[args.columns[1]]):
+      raise ValueError('%s: x and y differ in length.' % label)
+  else:
+    values = numpy.asarray(a_series, dtype=args.dtype)
+    if values.ndim == 1 and len(YColumns(args)) > 1:
+      raise ValueError('%s: --columns %s need a 2D array.'
+                       % (label, ','.join(str(c + 1)
+                                          for c in args.columns)))
+    if values.ndim == 1 and args.mode != 'matrix':
+      columns = {args.columns[-1]: values}
+      if len(args.columns) > 1:
+        columns[args.columns[0]] = numpy.arange(1.0, len(values) + 1)
+    elif values.ndim == 2:
+      if values.shape[1] <= max(args.columns):
+        raise ValueError('%s: --columns %s not in an array of %d columns.'
+                         % (label, ','.join(str(c + 1)
+                                            for c in args.columns),
+                            values.shape[1]))
+      columns = dict((c, values[:, c]) for c in args.columns)
+    else:
+      raise ValueError('%s: can not plot a %dD array in --mode %s.'
+                       % (label, values.ndim, args.mode))
+  if args.mode == 'matrix':
+    d = ColumnsData(label, columns, None, args)
+    d.matrix = values
+    return [d]
+  if args.downsample:
+    columns = DownsampleColumns(columns, None, args, index)[0]
+  return SeriesData(label, columns, None, args)
 
 
-def MakeProxyPlots(args):
-  """ Make some proxy plots for use with legends.
+def Plot(args):
+  """ Read the inputs, draw the plot and write it out.
+
+  Args:
+    args: an argparse arguments object, from ParseArguments()
+
+  Returns:
+    outputs: a list of the paths of the files written
+  """
+  if args.multipage:
+    return PlotPages(args)
+  if args.watch:
+    return Watch(args)
+  fig, pdf = InitImage(args)
+  if args.facet:
+    axes = EstablishFacetAxes(fig, args)
+  else:
+    ax = EstablishAxes(fig, args)
+  MarkStage('figure')
+
+  data_list = ReadFiles(args)
+  MarkStage('read')
+  if args.facet:
+    PlotFacets(data_list, axes, fig, args)
+  else:
+    PlotData(data_list, ax, args)
+  MarkStage('plot')
+
+  if not args.facet:
+    CleanAxis(ax, args)
+    MarkStage('clean')
+  WriteImage(fig, pdf, args)
+  MarkStage('write')
+  if args.profile:
+    CountRows(data_list)
+    PROFILE_COUNTS['artists'] = CountArtists(fig)
+  plt.close(fig)
+  if args.timing:
+    ReportTiming(args)
+  if args.profile:
+    ReportProfile(args)
+  return OutputPaths(args)
 
-  Proxy plots are plots that are not actually drawn but whose
-  colors are used for correctly populating a legend.
+
+def PlotPages(args):
+  """ Read the inputs once and write a pdf with one page per series.
 
   Args:
-    args: an argparse argument object.
+    args: an argparse arguments object, from ParseArguments()
 
   Returns:
-    proxy_plots: A list of matplotlib plot objects.
+    outputs: a list of the paths of the files written
   """
-  if args.mode != 'hist':
-    proxy_plots = []
-    for i, afile in enumerate(args.files, 0):
-      proxy_plots.append(
-        plt.Rectangle(
-          (0, 0), 1, 1,
-          fc=ColorPicker(i, args),
-          ec=ColorPicker(i, args)))
+  backend_pdf = ImportModule('matplotlib.backends.backend_pdf')
+  pdf = backend_pdf.PdfPages(args.out + '.pdf')
+  MarkStage('figure')
+
+  data_list = ReadFiles(args)
+  MarkStage('read')
+  PROFILE_COUNTS['artists'] = 0
+  for i, data in enumerate(data_list):
+    file_args = FileArguments(args, i, data)
+    fig = plt.figure(figsize=(args.width, args.height),
+                     dpi=args.dpi, facecolor='w')
+    ax = EstablishAxes(fig, file_args)
+    PlotData([data], ax, file_args)
+    CleanAxis(ax, file_args)
+    fig.savefig(pdf, format='pdf')
+    if args.profile:
+      PROFILE_COUNTS['artists'] += CountArtists(fig)
+    plt.close(fig)
+  MarkStage('plot')
+
+  pdf.close()
+  MarkStage('write')
+  if args.profile:
+    CountRows(data_list)
+  if args.timing:
+    ReportTiming(args)
+  if args.profile:
+    ReportProfile(args)
+  return OutputPaths(args)
+
+
+def Watch(args):
+  """ Draw the plot, then draw it again whenever the inputs grow.
+
+  Runs until interrupted. Each input is followed by a WatchedFile, so the
+  cost of a refresh is parsing the new lines and drawing, not reading the
+  whole of every input again.
+
+  Args:
+    args: an argparse arguments object, from ParseArguments()
+
+  Returns:
+    outputs: a list of the paths of the files written
+  """
+  watched = [WatchedFile(a_file, args) for a_file in args.files]
+  first = True
+  try:
+    while True:
+      changed = False
+      for w in watched:
+        changed = w.update() or changed
+      if changed or first:
+        DrawWatched(watched, args)
+        if args.timing:
+          sys.stderr.write('%s drew %d rows\n'
+                           % (time.strftime('%H:%M:%S'),
+                              sum(w.reader.num_rows for w in watched)))
+        first = False
+      time.sleep(args.watch_interval)
+  except KeyboardInterrupt:
+    pass
+  return OutputPaths(args)
+
+
+def DrawWatched(watched, args):
+  """ Draw and write the plot of everything the WatchedFiles have read.
+
+  Args:
+    watched: a list of WatchedFile objects, one per input file
+    args: an argparse arguments object
+  """
+  args = copy.copy(args)
+  args.xmin, args.xmax = sys.maxint, -sys.maxint
+  args.ymin, args.ymax = sys.maxint, -sys.maxint
+  data_list = []
+  for i, w in enumerate(watched):
+    columns, labels = w.columns()
+    if args.downsample:
+      columns, labels = DownsampleColumns(columns, labels, args, i)
+    file_data = SeriesData(os.path.basename(w.a_file), columns, labels, args,
+                           w.reader)
+    file_data[0].num_rows = w.reader.num_rows
+    if w.reader.num_rows:
+      data_list.extend(file_data)
+  args.series_labels = [d.label for d in data_list]
+  fig, pdf = InitImage(args)
+  if data_list:
+    DrawFigure(fig, data_list, args)
   else:
-    proxy_plots = []
-    for i, afile in enumerate(args.files, 0):
-      proxy_plots.append(
-        plt.Rectangle(
-          (0, 0), 1, 1,
-          fc=ColorPicker(len(args.files), args)[i],
-          ec=ColorPicker(len(args.files), args)[i]))
-  return proxy_plots
+    # every input was emptied, so draw the empty axes over the old plot
+    EstablishAxes(fig, args)
+  WriteImage(fig, pdf, args)
+  plt.close(fig)
 
 
-def MakeLegendLabels(args):
-  """ Make labels for use with legends.
+def ColumnsData(label, columns, labels, args, plotted=None):
+  """ Make a Data object from columns parsed or handed over earlier.
 
   Args:
-    args: an argparse argument object
+    label: the name of the series
+    columns: a dict of numpy arrays keyed on column index
+    labels: a list of xtick label strings, or None
+    args: an argparse arguments object, whose limits are extended
+    plotted: the x and y, or just the y, column to use, by default
+      --columns
 
   Returns:
-    legend_labels: A list of strings.
+    d: a Data object
   """
-  legend_labels = []
-  for afile in args.files:
-    legend_labels.append(os.path.basename(afile))
-  return legend_labels
+  d = Data()
+  d.label = label
+  file_args = copy.copy(args)
+  file_args.xmin, file_args.xmax = sys.maxint, -sys.maxint
+  file_args.ymin, file_args.ymax = sys.maxint, -sys.maxint
+  if plotted is None:
+    plotted = args.columns
+  d.process_columns(columns, labels, file_args, plotted)
+  d.num_rows = len(columns[plotted[-1]])
+  d.limits = (file_args.xmin, file_args.xmax, file_args.ymin,
+              file_args.ymax)
+  args.xmin = min(args.xmin, file_args.xmin)
+  args.xmax = max(args.xmax, file_args.xmax)
+  args.ymin = min(args.ymin, file_args.ymin)
+  args.ymax = max(args.ymax, file_args.ymax)
+  return d
 
 
-def CleanAxis(ax, args):
-  """ Clean the axis up, apply scales, add legend.
+def SeriesData(label, columns, labels, args, reader=None):
+  """ Make a Data object for each y column of --columns.
+
+  Every series comes from the same parse of the file. The rows of the
+  file are counted against its first series alone.
 
   Args:
-    ax: a matplotlib axis object
-    args: an argparse argument object
+    label: the name of the file
+    columns: a dict of numpy arrays keyed on column index
+    labels: a list of xtick label strings, or None
+    args: an argparse arguments object, whose limits are extended
+    reader: the ColumnReader the columns came from, or None
+
+  Returns:
+    data_list: a list of Data objects, one per y column
   """
-  # y axis
-  if args.is_log_y:
-    ax.set_yscale('log')
+  x_columns = []
+  if len(args.columns) > 1:
+    x_columns = args.columns[:1]
+  data_list = []
+  for i, y_column in enumerate(YColumns(args)):
+    d = ColumnsData(SeriesLabel(label, y_column, args, reader), columns,
+                    labels, args, x_columns + [y_column])
+    if i:
+      d.num_rows = 0
+    if reader is not None and reader.regression is not None:
+      d.regression = reader.regression[y_column]
+    if reader is not None and args.stream:
+      # a reservoir holds a sample, the reader saw every row
+      series_args = copy.copy(args)
+      (series_args.xmin, series_args.xmax,
+       series_args.ymin, series_args.ymax) = d.limits
+      ExtendLimits(reader, series_args, [y_column])
+      d.limits = (series_args.xmin, series_args.xmax,
+                  series_args.ymin, series_args.ymax)
+    data_list.append(d)
+  return data_list
+
+
+def SeriesLabel(label, y_column, args, reader=None):
+  """ Name the series of a file's y column, for legends and facet titles.
+
+  With a single y column the series is named after the file. Otherwise it
+  is named after the column, from the file's header line if it has one.
+  """
+  if len(YColumns(args)) == 1:
+    return label
+  if reader is not None and reader.column_names is not None:
+    name = reader.column_names[y_column]
+    if reader.column_names.count(name) > 1:
+      name = '%s (column %d)' % (name, y_column + 1)
   else:
-    if args.mode not in ('hist', 'tick', 'barcode', 'point', 'bar', 'column'):
-      arange = args.ymax - args.ymin
-      ymin, ymax = HandleLimits(args.ymin - arange * 0.05,
-                                args.ymax + arange * 0.05,
-                                args.user_ymin, args.user_ymax)
-      ax.set_ylim([ymin, ymax])
-  # x axis
-  if args.is_log_x:
-    ax.set_xscale('log')
+    name = 'column %d' % (y_column + 1)
+  if len(args.files) > 1:
+    return '%s: %s' % (label, name)
+  return name
+
+
+def DrawFigure(fig, data_list, args):
+  """ Draw all of the data on a new figure, on one axis or as --facet.
+
+  Args:
+    fig: a matplotlib figure object, from NewFigure()
+    data_list: a list of Data objects
+    args: an argparse arguments object
+  """
+  if args.facet:
+    axes = EstablishFacetAxes(fig, args)
+    PlotFacets(data_list, axes, fig, args)
   else:
-    if args.mode not in ('hist', 'tick', 'barcode', 'point', 'bar', 'column'):
-      arange = args.xmax - args.xmin
-      xmin, xmax = HandleLimits(args.xmin - arange * 0.05,
-                                args.xmax + arange * 0.05,
-                                args.user_xmin, args.user_xmax)
-      ax.set_xlim([xmin, xmax])
-  # labels
-  if args.xlabel != 'sentinel_value':
-    ax.set_xlabel(args.xlabel)
-  if args.ylabel != 'sentinel_value':
-    if args.mode in ('tick', 'barcode', 'point'):
-      sys.stderr.write(
-        'Warning, --ylabel specified while '
-        '--mode=(tick, barcode or point), ylabel not displayed\n')
-    else:
-      ax.set_ylabel(args.ylabel)
+    ax = EstablishAxes(fig, args)
+    PlotData(data_list, ax, args)
+    CleanAxis(ax, args)
+
+
+def PlotFacets(data_list, axes, fig, args):
+  """ Plot each series on its own axis of the --facet grid.
+
+  Args:
+    data_list: a list of Data objects.
+    axes: a list of matplotlib axis objects, one per Data object.
+    fig: a matplotlib figure object
+    args: an argparse argument object.
+  """
+  for i, data in enumerate(data_list):
+    file_args = FileArguments(args, i, data)
+    file_args.title = data.label
+    file_args.is_legend = False
+    # some modes draw through pyplot, which draws on the current axis
+    plt.sca(axes[i])
+    PlotData([data], axes[i], file_args)
+    CleanAxis(axes[i], file_args)
   if args.title != 'sentinel_value':
-    ax.set_title(args.title)
-  # legend
-  if args.is_legend:
-    if args.mode not in ['contour', 'matrix']:
-      proxy_plots = MakeProxyPlots(args)
-      legend_labels = MakeLegendLabels(args)
-      leg = plt.legend(proxy_plots, legend_labels, 'upper right', numpoints=1)
-      leg._drawFrame = False
-  # aspect ratio
-  if args.aspect_equal or args.mode == 'matrix':
-    ax.axis('equal')
+    fig.suptitle(args.title)
+  if args.facet_limits == 'shared':
+    ShareLimits(axes)
 
 
-def main():
-  usage = '%(prog)s file1 file2 file3... [options]\n\n'
-  description = ('%(prog)s is a tool to produce quick plots. col1 '
-                 'of input file is x value col2 is y value. If '
-                 'the --mode is column/bar/hist then only col1 is '
-                 'used.')
-  parser = ArgumentParser(usage=usage, description=description)
-  InitArguments(parser)
-  args = parser.parse_args()
-  CheckArguments(args, parser)
-  fig, pdf = InitImage(args)
-  ax = EstablishAxes(fig, args)
+def FileArguments(args, i, data):
+  """ Copy the arguments for drawing the i-th series on its own.
 
-  data_list = ReadFiles(args)
-  PlotData(data_list, ax, args)
+  The series keeps the color it would have among all of the series and
+  the limits are those of its own data.
 
-  CleanAxis(ax, args)
-  WriteImage(fig, pdf, args)
+  Args:
+    args: an argparse arguments object
+    i: index of the series in the data list
+    data: the series' Data object
+
+  Returns:
+    file_args: an argparse arguments object
+  """
+  file_args = copy.copy(args)
+  file_args.series_labels = [data.label]
+  file_args.color_index_offset = args.color_index_offset + i
+  file_args.xmin, file_args.xmax, file_args.ymin, file_args.ymax = data.limits
+  if args.title == 'sentinel_value':
+    file_args.title = data.label
+  return file_args
+
+
+def ShareLimits(axes):
+  """ Set every axis to the limits that span all of them.
+
+  Axes drawn upside down, as --matrix_matshow is, stay that way.
+
+  Args:
+    axes: a list of matplotlib axis objects
+  """
+  xlims = [ax.get_xlim() for ax in axes]
+  ylims = [ax.get_ylim() for ax in axes]
+  xlo, xhi = numpy.min(xlims), numpy.max(xlims)
+  ylo, yhi = numpy.min(ylims), numpy.max(ylims)
+  for ax, xlim, ylim in zip(axes, xlims, ylims):
+    if xlim[0] > xlim[1]:
+      ax.set_xlim(xhi, xlo)
+    else:
+      ax.set_xlim(xlo, xhi)
+    if ylim[0] > ylim[1]:
+      ax.set_ylim(yhi, ylo)
+    else:
+      ax.set_ylim(ylo, yhi)
+
+
+def MarkStage(name):
+  """ Note that a stage of Run() has just finished, for --timing and
+  --profile.
+  """
+  STAGE_TIMES.append((name, time.time()))
+  STAGE_USAGE.append((sum(os.times()[:4]), PeakMemory()))
+
+
+def PeakMemory():
+  """ Return the largest resident set size of this process or any child
+  process it has waited for, in ru_maxrss units.
+  """
+  return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def Megabytes(max_rss):
+  """ Convert a ru_maxrss value, kilobytes on linux and bytes on mac os x,
+  to megabytes.
+  """
+  if sys.platform == 'darwin':
+    return max_rss / 1048576.0
+  return max_rss / 1024.0
+
+
+def CountRows(data_list):
+  """ Note the rows read and dropped over all inputs, for --profile.
+
+  Args:
+    data_list: a list of Data objects
+  """
+  PROFILE_COUNTS['rows_read'] = sum(d.num_rows or 0 for d in data_list)
+  PROFILE_COUNTS['rows_dropped'] = sum(d.num_dropped or 0
+                                       for d in data_list)
+
+
+def CountArtists(fig):
+  """ Return the number of matplotlib artists making up the figure.
+  """
+  return len(fig.findobj())
+
+
+def ReportProfile(args):
+  """ Write the --profile report to stderr.
+
+  Cpu time includes child processes, --jobs workers and the processes
+  writing extra --out_formats, once they have finished. Peak memory is
+  the high water mark reached by the end of each stage.
+
+  Args:
+    args: an argparse arguments object
+  """
+  stages = []
+  for i in xrange(1, len(STAGE_TIMES)):
+    stages.append({
+      'stage': STAGE_TIMES[i][0],
+      'wall': round(STAGE_TIMES[i][1] - STAGE_TIMES[i - 1][1], 6),
+      'cpu': round(STAGE_USAGE[i][0] - STAGE_USAGE[i - 1][0], 6),
+      'peak_rss_mb': round(Megabytes(STAGE_USAGE[i][1]), 3)})
+  report = {
+    'stages': stages,
+    'wall': round(STAGE_TIMES[-1][1] - STAGE_TIMES[0][1], 6),
+    'cpu': round(STAGE_USAGE[-1][0], 6),
+    'peak_rss_mb': round(Megabytes(STAGE_USAGE[-1][1]), 3),
+    'rows_read': PROFILE_COUNTS.get('rows_read', 0),
+    'rows_dropped': PROFILE_COUNTS.get('rows_dropped', 0),
+    'artists': PROFILE_COUNTS.get('artists', 0),
+    'mode': args.mode,
+    'outputs': OutputPaths(args)}
+  if args.profile_format == 'json':
+    sys.stderr.write(json.dumps(report, sort_keys=True) + '\n')
+    return
+  sys.stderr.write('profile:\n')
+  sys.stderr.write('  %-16s %8s %8s %12s\n'
+                   % ('stage', 'wall s', 'cpu s', 'peak rss MB'))
+  for stage in stages + [dict(report, stage='total')]:
+    sys.stderr.write('  %-16s %8.3f %8.3f %12.1f\n'
+                     % (stage['stage'], stage['wall'], stage['cpu'],
+                        stage['peak_rss_mb']))
+  for key in ('rows_read', 'rows_dropped', 'artists'):
+    sys.stderr.write('  %-16s %8d\n' % (key.replace('_', ' '), report[key]))
+
+
+def ReportTiming(args):
+  """ Write the --timing report to stderr.
+
+  Start up covers everything up to the first byte of input being read:
+  interpreter and module imports, argument checking and creating the
+  figure.
+
+  Args:
+    args: an argparse arguments object
+  """
+  sys.stderr.write('timing, in seconds:\n')
+  for i in xrange(1, len(STAGE_TIMES)):
+    sys.stderr.write('  %-16s %8.3f\n'
+                     % (STAGE_TIMES[i][0],
+                        STAGE_TIMES[i][1] - STAGE_TIMES[i - 1][1]))
+  for name, seconds in LAZY_IMPORT_TIMES:
+    sys.stderr.write('    import %-32s %8.3f\n' % (name, seconds))
+  stages = dict(STAGE_TIMES)
+  startup = stages['figure'] - stages['start']
+  sys.stderr.write('  %-16s %8.3f (budget %.3f)\n'
+                   % ('start up', startup, args.startup_budget))
+  sys.stderr.write('  %-16s %8.3f\n'
+                   % ('total', STAGE_TIMES[-1][1] - stages['start']))
+  if startup > args.startup_budget:
+    sys.stderr.write('Warning, start up took %.3f seconds, over the '
+                     '--startup_budget of %.3f seconds\n'
+                     % (startup, args.startup_budget))
+
+
+def ReadManifest(manifest):
+  """ Read a --batch manifest, one quick_plot command line per line.
+
+  Lines are split as a shell would split them. Blank lines and # comments
+  are ignored.
+
+  Args:
+    manifest: path to the manifest
+
+  Returns:
+    jobs: a list of (line number, list of command line arguments)
+  """
+  jobs = []
+  f = open(manifest, 'r')
+  for line_number, line in enumerate(f, 1):
+    argv = shlex.split(line, comments=True)
+    if argv:
+      jobs.append((line_number, argv))
+  f.close()
+  return jobs
+
+
+def Batch(manifest, num_jobs, timeout):
+  """ Draw every plot in a manifest, reading each input file only once.
+
+  Every command line is checked first. The inputs they name are then
+  parsed, each file once with the union of the columns its plots use,
+  and the plots drawn by a pool of num_jobs processes that inherit the
+  parsed data. A plot taking more than timeout seconds is abandoned.
+
+  Args:
+    manifest: path to the manifest
+    num_jobs: number of worker processes
+    timeout: seconds allowed per plot, or None
+
+  Returns:
+    status: 0 if every plot was drawn, 1 otherwise
+  """
+  jobs = ReadManifest(manifest)
+  failures = []
+  wanted = {}  # (absolute path, label column) -> set of columns
+  runnable = []
+  for line_number, argv in jobs:
+    status, stdout, stderr, args = RunCaptured(ParseArguments, argv)
+    sys.stdout.write(stdout)
+    if status:
+      failures.append((line_number, argv, stderr))
+      continue
+    runnable.append((line_number, argv))
+    if args.mode == 'matrix' or args.stream or args.max_memory is not None:
+      # plots bounding their memory read their inputs themselves, rather
+      # than have every row parsed up front
+      continue
+    for a_file in args.files:
+      # binary inputs are mapped, not parsed, so gain nothing from sharing
+      if a_file != '-' and not IsBinaryInput(a_file, args):
+        key = (os.path.abspath(a_file), args.xtick_label_column)
+        wanted.setdefault(key, set()).update(args.columns)
+  pool = multiprocessing.Pool(num_jobs)
+  try:
+    keys = sorted(wanted)
+    parse_jobs = [(key, sorted(wanted[key])) for key in keys]
+    for key, parsed in zip(keys, pool.imap(ParseInputJob, parse_jobs)):
+      # files that fail to parse are left to each plot, which reports
+      # the problem with its own columns
+      if parsed is not None:
+        PARSED_INPUTS[key] = parsed
+  finally:
+    pool.terminate()
+    pool.join()
+  # a new pool, forked after the parse, shares the parsed inputs
+  pool = multiprocessing.Pool(num_jobs)
+  try:
+    results = [pool.apply_async(BatchJob, (argv, timeout))
+               for line_number, argv in runnable]
+    for (line_number, argv), result in zip(runnable, results):
+      status, stdout, stderr, outputs = result.get()
+      sys.stdout.write(stdout)
+      if status:
+        failures.append((line_number, argv, stderr))
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+    PARSED_INPUTS.clear()
+  failures.sort()
+  for line_number, argv, stderr in failures:
+    sys.stderr.write('%s line %d failed: %s\n%s'
+                     % (manifest, line_number, ' '.join(argv), stderr))
+  sys.stderr.write('batch: %d plots, %d drawn, %d failed\n'
+                   % (len(jobs), len(jobs) - len(failures), len(failures)))
+  for line_number, argv, stderr in failures:
+    sys.stderr.write('  line %d: %s\n' % (line_number, ErrorLine(stderr)))
+  if failures:
+    return 1
+  return 0
+
+
+def ErrorLine(stderr):
+  """ Pick the line of a failed plot's stderr that says what went wrong.
+
+  That is the exception ending a traceback, with the first line of its
+  message, else an argument error, else the last line written.
+
+  Args:
+    stderr: everything the plot wrote to stderr
+
+  Returns:
+    line: a string
+  """
+  lines = [line for line in stderr.splitlines() if line.strip()]
+  if not lines:
+    return ''
+  marker = 'Traceback (most recent call last):'
+  if marker in lines:
+    start = len(lines) - lines[::-1].index(marker)
+    for line in lines[start:]:
+      if not line.startswith(' '):
+        return line
+  for line in reversed(lines):
+    if ': error: ' in line:
+      return line
+  return lines[-1]
+
+
+def ParseInputJob(job):
+  """ Parse one input file for Batch, in a worker process.
+
+  Args:
+    job: a tuple of the (absolute path, label column) key and the list of
+      columns to read
+
+  Returns:
+    parsed: the arguments of ColumnReader.replay(), or None on failure
+  """
+  (a_file, label_column), columns = job
+  # rows are stored as they are, the plots that replay them do the rest
+  reader = ColumnReader(a_file, Namespace(columns=columns,
+                                          xtick_label_column=label_column,
+                                          regression=False, profile=False,
+                                          dtype='float64', max_memory=None))
+  stderr = sys.stderr
+  sys.stderr = StringIO()
+  try:
+    f = OpenInput(a_file)
+    block, labels = reader.read(f)
+    f.close()
+  except Exception:
+    return None
+  finally:
+    sys.stderr = stderr
+  return (block, labels, reader.num_rows, reader.min, reader.max,
+          reader.column_names)
+
+
+def BatchJob(argv, timeout):
+  """ Draw one plot for Batch, in a worker process.
+
+  Args:
+    argv: a list of command line arguments
+    timeout: seconds allowed for the plot, or None
+
+  Returns:
+    the status, stdout, stderr and output paths, as from RunCaptured()
+  """
+  if timeout:
+    signal.signal(signal.SIGALRM, RaiseJobTimeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+  try:
+    return RunCaptured(BatchPlot, argv, timeout)
+  finally:
+    if timeout:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+    plt.close('all')
+
+
+def BatchPlot(argv, timeout):
+  """ Parse and draw a command line from a --batch manifest.
+  """
+  try:
+    args = ParseArguments(argv)
+    args.jobs = 1  # already inside a worker process
+    return Plot(args)
+  except JobTimeout:
+    sys.exit('Timed out after %g seconds.' % timeout)
+
+
+def RaiseJobTimeout(signum, frame):
+  raise JobTimeout()
+
+
+def main():
+  if sys.argv[1:2] == ['--serve']:
+    usage = '%(prog)s --serve [--socket SOCKET]'
+    description = ('Keep the plotting libraries loaded and render the jobs '
+                   'sent by quick_plot_client.')
+    parser = ArgumentParser(usage=usage, description=description)
+    parser.add_argument('--serve', action='store_true',
+                        help='run as a plotting server.')
+    parser.add_argument('--socket', default=DefaultSocketPath(),
+                        help=('unix socket to listen on. '
+                              'default=%(default)s'))
+    args = parser.parse_args()
+    Serve(args.socket)
+  elif sys.argv[1:2] == ['--batch']:
+    usage = '%(prog)s --batch MANIFEST [--batch_jobs N] [--batch_timeout S]'
+    description = ('Draw every plot in MANIFEST, a file holding one '
+                   'quick_plot command line, less the program name, per '
+                   'line. Each input file is read only once.')
+    parser = ArgumentParser(usage=usage, description=description)
+    parser.add_argument('--batch', dest='manifest', required=True,
+                        help='the manifest file.')
+    parser.add_argument('--batch_jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=('number of plots drawn at once. '
+                              'default=%(default)s'))
+    parser.add_argument('--batch_timeout', type=float, default=None,
+                        help=('seconds allowed per plot before it is '
+                              'abandoned. default is no limit.'))
+    args = parser.parse_args()
+    if args.batch_jobs < 1:
+      parser.error('--batch_jobs must be at least 1.')
+    if not os.path.exists(args.manifest):
+      parser.error('Manifest %s does not exist.' % args.manifest)
+    sys.exit(Batch(args.manifest, args.batch_jobs, args.batch_timeout))
+  else:
+    outputs = Run(sys.argv[1:])
+    if os.environ.get('QUICK_PLOT_PRINT_OUTPUTS'):
+      # set by quick_plot_client, which lists what a server job wrote
+      for path in outputs:
+        sys.stdout.write('%s\n' % path)
 
 
 if __name__ == '__main__':
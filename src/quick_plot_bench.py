@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+quick_plot_bench
+
+Times quick_plot end to end over synthetic inputs of increasing size. Each
+plot mode is run in every output format by a fresh quick_plot process with
+--profile, so the wall time, cpu time and peak memory of every stage are
+those of a real run. Results can be saved as a baseline and later runs
+compared against it, to catch performance regressions before a release.
+
+"""
+##############################
+# Copyright (C) 2013-2014 by
+# Dent Earl (dearl@soe.ucsc.edu, dent.earl@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##############################
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy
+
+# (case name, input kind, quick_plot arguments, most rows worth running or
+# None for no limit). Modes that draw an artist per value are capped, past
+# the cap they take minutes and produce unusable output.
+CASES = [
+  ('scatter', '2d', ['--mode', 'scatter'], 10 ** 6),
+  ('scatter_aggregate', '2d', ['--mode', 'scatter', '--aggregate'], None),
+  ('line', '2d', ['--mode', 'line'], 10 ** 6),
+  ('line_decimate', '2d', ['--mode', 'line', '--decimate', 'minmax'], None),
+  ('contour', '2d', ['--mode', 'contour'], None),
+  ('contour_stream', '2d', ['--mode', 'contour', '--stream'], None),
+  ('density', '1d', ['--mode', 'density'], None),
+  ('hist', '1d', ['--mode', 'hist'], None),
+  ('hist_stream', '1d', ['--mode', 'hist', '--stream'], None),
+  ('matrix', 'matrix', ['--mode', 'matrix'], None),
+  ('bar', '1d', ['--mode', 'bar'], 10 ** 4),
+  ('column', '1d', ['--mode', 'column'], 10 ** 4),
+  ('tick', '1d', ['--mode', 'tick'], 10 ** 5),
+  ('barcode', '1d', ['--mode', 'barcode'], 10 ** 5),
+  ('point', '1d', ['--mode', 'point'], 10 ** 5),
+]
+FORMATS = ['pdf', 'png', 'eps']
+# rows generated and written at a time
+GENERATE_CHUNK_ROWS = 1 << 20
+
+
+def InitArguments(parser):
+  """ Initialize arguments for the program.
+
+  Args:
+    parser: an argparse parser object
+  """
+  parser.add_argument('--sizes', dest='sizes', default='1e3,1e4,1e5',
+                      help=('comma separated input sizes, in rows, or in '
+                            'cells for matrix inputs. 1e3 through 1e8 are '
+                            'sensible. default=%(default)s'))
+  parser.add_argument('--cases', dest='cases', default=None,
+                      help=('comma separated cases to run. default is all '
+                            'of: %s' % ', '.join(c[0] for c in CASES)))
+  parser.add_argument('--formats', dest='formats', default=','.join(FORMATS),
+                      help=('comma separated output formats. '
+                            'default=%(default)s'))
+  parser.add_argument('--no_caps', dest='no_caps', default=False,
+                      action='store_true',
+                      help=('run every case at every size, even the ones '
+                            'that draw an artist per value.'))
+  parser.add_argument('--repeat', dest='repeat', default=1, type=int,
+                      help=('runs of each case, the fastest is kept. '
+                            'default=%(default)s'))
+  parser.add_argument('--timeout', dest='timeout', default=None, type=float,
+                      help='seconds allowed per run. default is no limit.')
+  parser.add_argument('--data_dir', dest='data_dir',
+                      default=os.path.join(tempfile.gettempdir(),
+                                           'quick_plot_bench'),
+                      help=('where generated inputs are kept between '
+                            'runs. default=%(default)s'))
+  parser.add_argument('--seed', dest='seed', default=0, type=int,
+                      help='random seed of the generated inputs.')
+  parser.add_argument('--save_baseline', dest='save_baseline', default=None,
+                      help='write the results to this json file.')
+  parser.add_argument('--baseline', dest='baseline', default=None,
+                      help=('compare the results against this json file '
+                            'and exit with status 1 on any regression.'))
+  parser.add_argument('--tolerance', dest='tolerance', default=0.25,
+                      type=float,
+                      help=('fraction by which wall time or peak memory may '
+                            'grow before it is a regression. '
+                            'default=%(default)s'))
+  parser.add_argument('--noise', dest='noise', default=0.1, type=float,
+                      help=('seconds of extra wall time that are never '
+                            'counted as a regression. default=%(default)s'))
+
+
+def CheckArguments(args, parser):
+  """ Verify that input arguments are correct and sufficient.
+
+  Args:
+    args: an argparse arguments object
+    parser: an argparse parser object
+  """
+  try:
+    args.sizes = [int(float(s)) for s in args.sizes.split(',')]
+  except ValueError:
+    parser.error('--sizes must be a comma separated list of numbers.')
+  if min(args.sizes) < 1:
+    parser.error('--sizes must be at least 1.')
+  names = [c[0] for c in CASES]
+  if args.cases is None:
+    args.cases = names
+  else:
+    args.cases = args.cases.split(',')
+    for name in args.cases:
+      if name not in names:
+        parser.error('Unrecognized case %s. Choose from: %s'
+                     % (name, ', '.join(names)))
+  args.formats = args.formats.split(',')
+  for f in args.formats:
+    if f not in FORMATS:
+      parser.error('Unrecognized format %s. Choose from: %s'
+                   % (f, ', '.join(FORMATS)))
+  if args.repeat < 1:
+    parser.error('--repeat must be at least 1.')
+  if args.baseline is not None and not os.path.exists(args.baseline):
+    parser.error('--baseline %s does not exist.' % args.baseline)
+
+
+def QuickPlotPath():
+  """ Return the path of the quick_plot script next to this one.
+  """
+  here = os.path.dirname(os.path.abspath(__file__))
+  for name in ('quick_plot', 'quick_plot.py'):
+    path = os.path.join(here, name)
+    if os.path.exists(path):
+      return path
+  sys.stderr.write('Unable to find quick_plot next to %s\n' % __file__)
+  sys.exit(1)
+
+
+def InputPath(kind, size, args):
+  """ Return the path of a generated input, generating it if need be.
+
+  Args:
+    kind: one of 1d, 2d or matrix
+    size: rows, or cells for a matrix
+    args: an argparse arguments object
+
+  Returns:
+    path: path of the input file
+  """
+  if not os.path.exists(args.data_dir):
+    os.makedirs(args.data_dir)
+  path = os.path.join(args.data_dir,
+                      '%s_%d_seed%d.txt' % (kind, size, args.seed))
+  if not os.path.exists(path):
+    sys.stderr.write('generating %s\n' % path)
+    random = numpy.random.RandomState(args.seed)
+    f = open(path + '.tmp', 'w')
+    try:
+      if kind == '1d':
+        Generate1D(f, size, random)
+      elif kind == '2d':
+        Generate2D(f, size, random)
+      else:
+        GenerateMatrix(f, size, random)
+    finally:
+      f.close()
+    os.rename(path + '.tmp', path)
+  return path
+
+
+def Generate1D(f, size, random):
+  """ Write size values drawn from a mixture of two normals, one per line.
+  """
+  for start in xrange(0, size, GENERATE_CHUNK_ROWS):
+    n = min(GENERATE_CHUNK_ROWS, size - start)
+    values = random.normal(0, 1, n) + 4 * (random.random_sample(n) < 0.3)
+    f.write(('%.6g\n' * n) % tuple(values))
+
+
+def Generate2D(f, size, random):
+  """ Write size x, y rows of a noisy random walk.
+  """
+  y = 0.0
+  for start in xrange(0, size, GENERATE_CHUNK_ROWS):
+    n = min(GENERATE_CHUNK_ROWS, size - start)
+    rows = numpy.empty((n, 2))
+    rows[:, 0] = numpy.arange(start, start + n)
+    walk = y + numpy.cumsum(random.normal(0, 1, n))
+    y = walk[-1]
+    rows[:, 1] = walk + random.normal(0, 10, n)
+    f.write(('%.6g %.6g\n' * n) % tuple(rows.ravel()))
+
+
+def GenerateMatrix(f, size, random):
+  """ Write a square matrix of about size cells, a smooth field plus noise.
+  """
+  side = max(1, int(round(size ** 0.5)))
+  columns = numpy.sin(numpy.linspace(0, 6, side))
+  row_format = ' '.join(['%.4g'] * side) + '\n'
+  chunk = max(1, GENERATE_CHUNK_ROWS // side)
+  for start in xrange(0, side, chunk):
+    n = min(chunk, side - start)
+    rows = numpy.cos(numpy.linspace(0, 6, side)[start:start + n])
+    cells = (numpy.outer(rows, columns) +
+             random.normal(0, 0.1, (n, side)))
+    f.write((row_format * n) % tuple(cells.ravel()))
+
+
+def RunCase(path, case_arguments, out_format, args):
+  """ Plot an input once with quick_plot --profile.
+
+  Args:
+    path: the input file
+    case_arguments: the quick_plot arguments of the case
+    out_format: one of pdf, png or eps
+    args: an argparse arguments object
+
+  Returns:
+    report: the --profile json report, or None if the run failed
+    error: the tail of stderr if the run failed, otherwise None
+  """
+  out_dir = tempfile.mkdtemp(prefix='quick_plot_bench')
+  command = ([sys.executable, QuickPlotPath(), path] + case_arguments +
+             ['--out_format', out_format, '--out',
+              os.path.join(out_dir, 'bench'), '--no_legend', '--profile',
+              '--profile_format', 'json'])
+  try:
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    timer = None
+    timed_out = []
+    if args.timeout is not None:
+      def Kill():
+        timed_out.append(True)
+        process.kill()
+      timer = threading.Timer(args.timeout, Kill)
+      timer.start()
+    try:
+      stdout, stderr = process.communicate()
+    finally:
+      if timer is not None:
+        timer.cancel()
+  finally:
+    shutil.rmtree(out_dir, ignore_errors=True)
+  lines = stderr.strip().splitlines()
+  if process.returncode != 0 or not lines:
+    if timed_out:
+      return None, 'killed after %g seconds' % args.timeout
+    if process.returncode < 0:
+      return None, 'killed by signal %d' % -process.returncode
+    return None, lines[-1] if lines else 'exit status %d' % process.returncode
+  return json.loads(lines[-1]), None
+
+
+def Summarize(report):
+  """ Reduce a --profile report to what the baseline keeps: the time and
+  peak memory of the run and of each of its stages.
+  """
+  stages = {}
+  stage_rss = {}
+  for stage in report['stages']:
+    stages[stage['stage']] = stage['wall']
+    stage_rss[stage['stage']] = stage['peak_rss_mb']
+  return {'wall': report['wall'], 'cpu': report['cpu'],
+          'peak_rss_mb': report['peak_rss_mb'], 'stages': stages,
+          'stage_peak_rss_mb': stage_rss}
+
+
+def Compare(result, base, args):
+  """ Describe how a result has regressed from its baseline.
+
+  Args:
+    result: a Summarize() dict
+    base: the baseline's Summarize() dict
+    args: an argparse arguments object
+
+  Returns:
+    problems: a list of strings, empty if there is no regression
+  """
+  problems = []
+  extra = result['wall'] - base['wall']
+  if (result['wall'] > base['wall'] * (1 + args.tolerance) and
+      extra > args.noise):
+    # name the stage that grew the most
+    worst = max(result['stages'],
+                key=lambda s: (result['stages'][s] -
+                               base['stages'].get(s, 0.0)))
+    problems.append('wall %.3fs -> %.3fs, mostly %s'
+                    % (base['wall'], result['wall'], worst))
+  if 'stage_peak_rss_mb' not in base:
+    # a baseline recorded before stage memory was kept
+    if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + args.tolerance):
+      problems.append('peak rss %.1fMB -> %.1fMB'
+                      % (base['peak_rss_mb'], result['peak_rss_mb']))
+    return problems
+  result_rss = result['stage_peak_rss_mb']
+  base_rss = base['stage_peak_rss_mb']
+  grown = [s for s in result_rss
+           if s in base_rss and result_rss[s] > base_rss[s] *
+           (1 + args.tolerance)]
+  if grown:
+    # the peak only rises from stage to stage, so every stage after the
+    # one that grew is likely to have grown too. Name the first.
+    first = min(grown, key=lambda s: base_rss[s])
+    problems.append('peak rss %.1fMB -> %.1fMB, in %s'
+                    % (base_rss[first], result_rss[first], first))
+  return problems
+
+
+def Bench(args):
+  """ Run every case and report the results, comparing with a baseline.
+
+  Args:
+    args: an argparse arguments object
+
+  Returns:
+    status: 0, or 1 if any run failed or regressed
+  """
+  baseline = {}
+  if args.baseline is not None:
+    f = open(args.baseline)
+    baseline = json.load(f)['results']
+    f.close()
+  results = {}
+  status = 0
+  sys.stdout.write('%-32s %8s %8s %8s %8s %9s  %s\n'
+                   % ('case', 'total s', 'read s', 'plot s', 'write s',
+                      'peak MB', 'vs baseline'))
+  for name, kind, case_arguments, cap in CASES:
+    if name not in args.cases:
+      continue
+    for size in args.sizes:
+      if cap is not None and size > cap and not args.no_caps:
+        continue
+      path = InputPath(kind, size, args)
+      for out_format in args.formats:
+        key = '%s/%s/%d' % (name, out_format, size)
+        best, error = None, None
+        for i in xrange(args.repeat):
+          report, error = RunCase(path, case_arguments, out_format, args)
+          if report is None:
+            break
+          if best is None or report['wall'] < best['wall']:
+            best = report
+        if error is not None:
+          sys.stdout.write('%-32s failed: %s\n' % (key, error))
+          status = 1
+          continue
+        result = Summarize(best)
+        results[key] = result
+        note = ''
+        if key in baseline:
+          problems = Compare(result, baseline[key], args)
+          if problems:
+            note = 'REGRESSION ' + '; '.join(problems)
+            status = 1
+          else:
+            note = '%+.0f%%' % (100.0 * (result['wall'] /
+                                         baseline[key]['wall'] - 1))
+        stages = result['stages']
+        sys.stdout.write('%-32s %8.3f %8.3f %8.3f %8.3f %9.1f  %s\n'
+                         % (key, result['wall'], stages.get('read', 0.0),
+                            stages.get('plot', 0.0),
+                            stages.get('write', 0.0),
+                            result['peak_rss_mb'], note))
+        sys.stdout.flush()
+  if args.save_baseline is not None:
+    f = open(args.save_baseline, 'w')
+    json.dump({'machine': platform.node(),
+               'python': platform.python_version(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'results': results}, f, indent=1, sort_keys=True)
+    f.write('\n')
+    f.close()
+  return status
+
+
+def main():
+  usage = '%(prog)s [options]'
+  description = ('Benchmark quick_plot over generated inputs, in every '
+                 'mode and output format.')
+  parser = ArgumentParser(usage=usage, description=description)
+  InitArguments(parser)
+  args = parser.parse_args()
+  CheckArguments(args, parser)
+  sys.exit(Bench(args))
+
+
+if __name__ == '__main__':
+  main()
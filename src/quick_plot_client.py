@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+quick_plot_client
+
+Hands a quick_plot command line to a warm `quick_plot --serve' process,
+which renders it without paying for python and matplotlib start up. If no
+server is listening, or the server finds that the command line reads
+stdin, it is run by quick_plot directly. The paths of the files written
+are printed.
+
+"""
+##############################
+# Copyright (C) 2013-2014 by
+# Dent Earl (dearl@soe.ucsc.edu, dent.earl@gmail.com)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+##############################
+# only light modules here, the whole point is to start quickly
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+
+def DefaultSocketPath():
+  """ Return the unix socket quick_plot --serve listens on by default.
+  """
+  if os.environ.get('QUICK_PLOT_SOCKET'):
+    return os.environ['QUICK_PLOT_SOCKET']
+  directory = os.environ.get('XDG_RUNTIME_DIR')
+  if not directory:
+    directory = os.path.join(tempfile.gettempdir(),
+                             'quick_plot-%d' % os.getuid())
+  return os.path.join(directory, 'quick_plot.sock')
+
+
+def IsOwnSocket(socket_path):
+  """ Return True if socket_path is a socket bound by this user, so a
+  server run by this user. Command lines, working directories and the
+  paths coming back are only exchanged with such a server.
+  """
+  try:
+    st = os.lstat(socket_path)
+  except OSError:
+    return False
+  return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def Submit(argv, socket_path):
+  """ Send a command line to the server and wait for it to be drawn.
+
+  Args:
+    argv: a list of quick_plot command line arguments
+    socket_path: path of the server's unix socket
+
+  Returns:
+    response: a dict with the job's status, stdout, stderr and outputs
+  Raises:
+    socket.error: If no server is listening on socket_path.
+  """
+  conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  conn.connect(socket_path)
+  try:
+    conn.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}))
+    conn.shutdown(socket.SHUT_WR)
+    chunks = []
+    while True:
+      chunk = conn.recv(1 << 16)
+      if not chunk:
+        break
+      chunks.append(chunk)
+  finally:
+    conn.close()
+  return json.loads(''.join(chunks))
+
+
+def QuickPlotPath():
+  """ Return the path of the quick_plot script next to this one.
+  """
+  here = os.path.dirname(os.path.abspath(__file__))
+  for name in ('quick_plot', 'quick_plot.py'):
+    path = os.path.join(here, name)
+    if os.path.exists(path):
+      return path
+  sys.stderr.write('Unable to find quick_plot next to %s\n' % __file__)
+  sys.exit(1)
+
+
+def RunLocally(argv):
+  """ Draw the plot in this process, by becoming quick_plot.
+  """
+  path = QuickPlotPath()
+  # quick_plot then lists the files it wrote, as a server job's are
+  os.environ['QUICK_PLOT_PRINT_OUTPUTS'] = '1'
+  os.execv(sys.executable, [sys.executable, path] + argv)
+
+
+def main():
+  argv = sys.argv[1:]
+  socket_path = DefaultSocketPath()
+  if not IsOwnSocket(socket_path):
+    if os.path.lexists(socket_path):
+      sys.stderr.write('Warning, %s is not a socket of yours, not using '
+                       'it.\n' % socket_path)
+    RunLocally(argv)
+  try:
+    response = Submit(argv, socket_path)
+  except socket.error:
+    # no server, draw the plot in this process instead
+    RunLocally(argv)
+  if response.get('stdin'):
+    # the server can not read this process's stdin
+    RunLocally(argv)
+  sys.stdout.write(response['stdout'])
+  sys.stderr.write(response['stderr'])
+  if response['status'] == 0:
+    for path in response['outputs']:
+      sys.stdout.write('%s\n' % path)
+  sys.exit(response['status'])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,744 @@
+#!/usr/bin/env python
+"""
+Tests pinning quick_plot's parsing and numeric engines to reference
+results, such as numpy.loadtxt for parsing and the in-memory read for
+each streaming one.
+
+Run with make test, or python -m unittest discover -s tests
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import matplotlib
+import numpy
+import scipy.stats
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+import quick_plot
+
+
+class QuickPlotTestCase(unittest.TestCase):
+  """ Class QuickPlotTestCase gives each test a scratch directory.
+  """
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  def WriteFile(self, name, text):
+    path = os.path.join(self.directory, name)
+    f = open(path, 'w')
+    f.write(text)
+    f.close()
+    return path
+  def WriteColumns(self, name, values, header=None):
+    """ write a 2D array as white space delimited text.
+    """
+    lines = []
+    if header is not None:
+      lines.append(header)
+    for row in values:
+      lines.append(' '.join(repr(float(v)) for v in row))
+    return self.WriteFile(name, '\n'.join(lines) + '\n')
+  def Arguments(self, files, *options):
+    return quick_plot.ParseArguments(list(files) + list(options))
+
+
+def RandomColumns(num_rows, num_columns, seed=0):
+  random = numpy.random.RandomState(seed)
+  return random.normal(size=(num_rows, num_columns))
+
+
+class ColumnReaderTest(QuickPlotTestCase):
+  def Read(self, path, *options):
+    args = self.Arguments([path], *options)
+    reader = quick_plot.ColumnReader(path, args)
+    f = quick_plot.OpenInput(path)
+    columns, labels = reader.read(f)
+    f.close()
+    return reader, columns, labels
+  def testMatchesLoadtxt(self):
+    values = RandomColumns(1000, 3)
+    path = self.WriteColumns('a.txt', values, header='# a b c')
+    reader, columns, labels = self.Read(path, '--columns', '3,1')
+    expected = numpy.loadtxt(path)
+    self.assertTrue(numpy.array_equal(columns[0], expected[:, 0]))
+    self.assertTrue(numpy.array_equal(columns[2], expected[:, 2]))
+    self.assertEqual(reader.num_rows, 1000)
+    self.assertEqual(reader.min[2], expected[:, 2].min())
+    self.assertEqual(reader.max[0], expected[:, 0].max())
+    self.assertEqual(reader.column_names, ['a', 'b', 'c'])
+    self.assertEqual(labels, None)
+  def testChunksMatchOnePass(self):
+    values = RandomColumns(1000, 2)
+    path = self.WriteColumns('a.txt', values)
+    whole = self.Read(path)[1]
+    chunk_bytes = quick_plot.PARSE_CHUNK_BYTES
+    quick_plot.PARSE_CHUNK_BYTES = 100
+    try:
+      chunked = self.Read(path)[1]
+    finally:
+      quick_plot.PARSE_CHUNK_BYTES = chunk_bytes
+    for c in (0, 1):
+      self.assertTrue(numpy.array_equal(whole[c], chunked[c]))
+  def testLabels(self):
+    path = self.WriteFile('a.txt', 'a 1\n# skipped\nb nan\nc 3\n')
+    reader, columns, labels = self.Read(path, '--mode', 'bar', '--columns',
+                                        '2', '--xtick_label_column', '1')
+    self.assertEqual(labels, ['a', 'b', 'c'])
+    self.assertEqual(columns[1][0], 1.0)
+    self.assertTrue(numpy.isnan(columns[1][1]))
+    self.assertEqual(columns[1][2], 3.0)
+  def testBadValue(self):
+    path = self.WriteFile('a.txt', '1 2\n3 x\n')
+    self.assertRaises(ValueError, self.Read, path)
+  def testColumnCountChange(self):
+    path = self.WriteFile('a.txt', '1 2\n3 4\n5 6 7\n')
+    self.assertRaises(quick_plot.BadInput, self.Read, path)
+  def testFloat32(self):
+    values = RandomColumns(100, 2)
+    path = self.WriteColumns('a.txt', values)
+    reader, columns, labels = self.Read(path, '--dtype', 'float32')
+    self.assertEqual(columns[1].dtype, numpy.float32)
+    self.assertTrue(numpy.array_equal(columns[1],
+                                      values[:, 1].astype(numpy.float32)))
+    # limits are kept in double precision
+    self.assertEqual(reader.max[1], values[:, 1].max())
+  def testCompressed(self):
+    values = RandomColumns(100, 2)
+    path = self.WriteColumns('a.txt', values)
+    plain = self.Read(path)[1]
+    import gzip
+    f = gzip.open(path + '.gz', 'wb')
+    f.write(open(path).read())
+    f.close()
+    inflated = self.Read(path + '.gz')[1]
+    self.assertTrue(numpy.array_equal(plain[1], inflated[1]))
+
+
+class ReservoirReaderTest(QuickPlotTestCase):
+  def Read(self, path, size):
+    args = self.Arguments([path], '--random_seed', '3')
+    reader = quick_plot.ReservoirReader(path, args, size)
+    f = quick_plot.OpenInput(path)
+    columns, labels = reader.read(f)
+    f.close()
+    return reader, columns
+  def testKeepsEveryRowThatFits(self):
+    values = RandomColumns(50, 2)
+    path = self.WriteColumns('a.txt', values)
+    columns = self.Read(path, 100)[1]
+    self.assertTrue(numpy.array_equal(columns[0], values[:, 0]))
+    self.assertTrue(numpy.array_equal(columns[1], values[:, 1]))
+  def testSampleIsOfWholeRows(self):
+    values = RandomColumns(5000, 2)
+    path = self.WriteColumns('a.txt', values)
+    reader, columns = self.Read(path, 100)
+    self.assertEqual(len(columns[0]), 100)
+    rows = dict((pair, i) for i, pair in
+                enumerate(zip(values[:, 0], values[:, 1])))
+    row_numbers = [rows[pair] for pair in zip(columns[0], columns[1])]
+    # the sample is of whole rows, in file order
+    self.assertEqual(row_numbers, sorted(row_numbers))
+    # limits still cover every row read
+    self.assertEqual(reader.min[1], values[:, 1].min())
+    self.assertEqual(reader.max[1], values[:, 1].max())
+    self.assertEqual(reader.num_rows, 5000)
+
+
+class ReadFilesTest(QuickPlotTestCase):
+  def testDownsampleIgnoresJobs(self):
+    values = RandomColumns(500, 2)
+    paths = [self.WriteColumns('%d.txt' % i, values) for i in xrange(3)]
+    read = []
+    for jobs in ('1', '3'):
+      args = self.Arguments(paths, '--downsample', '50', '--random_seed',
+                            '5', '--jobs', jobs)
+      read.append(quick_plot.ReadFiles(args))
+    self.assertEqual(len(read[0]), 3)
+    for serial, parallel in zip(*read):
+      self.assertTrue(numpy.array_equal(serial.x, parallel.x))
+      self.assertTrue(numpy.array_equal(serial.y, parallel.y))
+    # nor is every file sampled alike
+    self.assertFalse(numpy.array_equal(read[0][0].x, read[0][1].x))
+
+
+class SeriesTest(QuickPlotTestCase):
+  def testSeriesPerColumn(self):
+    values = RandomColumns(100, 4)
+    path = self.WriteColumns('a.txt', values, header='# x a b a')
+    args = self.Arguments([path], '--mode', 'scatter', '--columns',
+                          '1,2,3,4')
+    data_list = quick_plot.ReadFile(path, args)
+    self.assertEqual([d.label for d in data_list],
+                     ['a (column 2)', 'b', 'a (column 4)'])
+    for i, d in enumerate(data_list):
+      self.assertTrue(numpy.array_equal(d.x, values[:, 0]))
+      self.assertTrue(numpy.array_equal(d.y, values[:, i + 1]))
+    # the rows of the file are counted once
+    self.assertEqual([d.num_rows for d in data_list], [100, 0, 0])
+  def testSeveralFiles(self):
+    values = RandomColumns(10, 3)
+    paths = [self.WriteColumns('%d.txt' % i, values) for i in xrange(2)]
+    args = self.Arguments(paths, '--columns', '1,3,2')
+    data_list = quick_plot.ReadFiles(args)
+    self.assertEqual([d.label for d in data_list],
+                     ['0.txt: column 3', '0.txt: column 2',
+                      '1.txt: column 3', '1.txt: column 2'])
+    self.assertTrue(numpy.array_equal(data_list[3].y, values[:, 1]))
+  def testOneColumnModes(self):
+    path = self.WriteColumns('a.txt', RandomColumns(10, 3))
+    stderr = sys.stderr
+    sys.stderr = io.BytesIO()
+    try:
+      for mode in ('hist', 'density', 'bar', 'contour'):
+        self.assertRaises(SystemExit, self.Arguments, [path], '--mode', mode,
+                          '--columns', '1,2,3')
+    finally:
+      sys.stderr = stderr
+
+
+class WatchedFileTest(QuickPlotTestCase):
+  def Rewrite(self, path, text, mtime):
+    self.WriteFile(os.path.basename(path), text)
+    os.utime(path, (mtime, mtime))
+  def testRewrites(self):
+    values = RandomColumns(50, 2)
+    path = self.WriteColumns('a.txt', values)
+    text = open(path).read()
+    watched = quick_plot.WatchedFile(path, self.Arguments([path]))
+    self.assertTrue(watched.update())
+    self.assertFalse(watched.update())
+    self.assertTrue(numpy.array_equal(watched.columns()[0][1], values[:, 1]))
+    # appended
+    self.Rewrite(path, text + '1.0 2.0\n', 1000)
+    self.assertTrue(watched.update())
+    self.assertEqual(len(watched.columns()[0][1]), 51)
+    # rewritten in place to the same size, past the head that is compared
+    last = text.rindex(' ') + 1
+    changed = text[:last] + '7' * (len(text) - last - 1) + '\n'
+    self.Rewrite(path, changed + '1.0 2.0\n', 2000)
+    self.assertTrue(watched.update())
+    columns = watched.columns()[0]
+    self.assertEqual(len(columns[1]), 51)
+    self.assertEqual(columns[1][49], float('7' * (len(text) - last - 1)))
+    # truncated, leaving no complete line
+    self.Rewrite(path, '3', 3000)
+    self.assertTrue(watched.update())
+    self.assertEqual(len(watched.columns()[0][1]), 0)
+    self.assertFalse(watched.update())
+
+
+class ParseCacheTest(QuickPlotTestCase):
+  def testReplayMatchesParse(self):
+    values = RandomColumns(500, 2)
+    path = self.WriteColumns('a.txt', values, header='# x y')
+    cache_dir = os.path.join(self.directory, 'cache')
+    args = self.Arguments([path], '--cache', '--cache_dir', cache_dir)
+    parsed = quick_plot.ReadColumns(
+      path, quick_plot.ColumnReader(path, args), args)[0]
+    reader = quick_plot.ColumnReader(path, args)
+    self.assertTrue(quick_plot.ParseCache(args).load(path, reader))
+    replayed = reader.finish()[0]
+    for c in (0, 1):
+      self.assertTrue(numpy.array_equal(parsed[c], replayed[c]))
+    self.assertEqual(reader.num_rows, 500)
+    self.assertEqual(reader.column_names, ['x', 'y'])
+
+
+class BinaryInputTest(QuickPlotTestCase):
+  """ Binary inputs must give what the text of the same numbers does.
+  """
+  def setUp(self):
+    QuickPlotTestCase.setUp(self)
+    self.values = RandomColumns(200, 11)
+    self.text = self.WriteColumns('a.txt', self.values)
+  def AssertReadsAsText(self, path, *options):
+    for columns in ('1,2', '11,3'):
+      expected = quick_plot.ReadFile(self.text, self.Arguments(
+        [self.text], '--columns', columns))[0]
+      got = quick_plot.ReadFile(path, self.Arguments(
+        [path], '--columns', columns, *options))[0]
+      self.assertTrue(numpy.array_equal(got.x, expected.x))
+      self.assertTrue(numpy.array_equal(got.y, expected.y))
+      self.assertEqual(got.limits, expected.limits)
+      self.assertEqual(got.num_rows, 200)
+  def testNpy(self):
+    for order in ('C', 'F'):
+      path = os.path.join(self.directory, '%s.npy' % order)
+      numpy.save(path, numpy.array(self.values, order=order))
+      self.AssertReadsAsText(path)
+  def testNpz(self):
+    path = os.path.join(self.directory, 'whole.npz')
+    numpy.savez(path, self.values)
+    self.AssertReadsAsText(path)
+    # one member per column, arr_10 ordered after arr_9
+    path = os.path.join(self.directory, 'columns.npz')
+    numpy.savez(path, *self.values.T)
+    self.AssertReadsAsText(path)
+  def testRaw(self):
+    for order in ('C', 'F'):
+      path = os.path.join(self.directory, '%s.bin' % order)
+      if order == 'C':
+        self.values.tofile(path)
+      else:
+        self.values.T.tofile(path)
+      self.AssertReadsAsText(path, '--raw_dtype', 'float64', '--raw_columns',
+                             '11', '--raw_order', order)
+  def testRawPartialRow(self):
+    path = os.path.join(self.directory, 'a.bin')
+    self.values.tofile(path)
+    args = self.Arguments([path], '--raw_dtype', 'float64', '--raw_columns',
+                          '3')
+    self.assertRaises(quick_plot.BadInput, quick_plot.ReadFile, path, args)
+
+
+class MatrixReaderTest(QuickPlotTestCase):
+  def testMatchesLoadtxt(self):
+    values = RandomColumns(300, 7)
+    path = self.WriteColumns('a.txt', values, header='# a matrix')
+    expected = numpy.loadtxt(path)
+    chunk_bytes = quick_plot.PARSE_CHUNK_BYTES
+    quick_plot.PARSE_CHUNK_BYTES = 1000
+    try:
+      for options in ([], ['--matrix_memmap']):
+        args = self.Arguments([path], '--mode', 'matrix', *options)
+        d = quick_plot.ReadFile(path, args)[0]
+        self.assertEqual(isinstance(d.matrix, numpy.memmap), bool(options))
+        self.assertTrue(numpy.array_equal(d.matrix, expected))
+        self.assertEqual(d.num_rows, 300)
+    finally:
+      quick_plot.PARSE_CHUNK_BYTES = chunk_bytes
+
+
+class AggregateMatrixTest(unittest.TestCase):
+  def BlockReduce(self, matrix, row_step, col_step, reduce):
+    """ reduce each block of a matrix, one block at a time.
+    """
+    num_rows, num_cols = matrix.shape
+    return numpy.array([[reduce(matrix[i:i + row_step, j:j + col_step])
+                         for j in xrange(0, num_cols, col_step)]
+                        for i in xrange(0, num_rows, row_step)])
+  def testBlocks(self):
+    matrix = RandomColumns(103, 57)
+    # blocks of 11 rows by 9 columns, the last of each ragged
+    mean = quick_plot.AggregateMatrix(matrix, 10, 7, 'mean')
+    self.assertEqual(mean.shape, (10, 7))
+    self.assertTrue(numpy.allclose(
+      mean, self.BlockReduce(matrix, 11, 9, numpy.mean)))
+    maximum = quick_plot.AggregateMatrix(matrix, 10, 7, 'max')
+    self.assertTrue(numpy.array_equal(
+      maximum, self.BlockReduce(matrix, 11, 9, numpy.max)))
+  def testOneAxis(self):
+    matrix = RandomColumns(100, 20)
+    mean = quick_plot.AggregateMatrix(matrix, 50, 40, 'mean')
+    self.assertTrue(numpy.allclose(
+      mean, self.BlockReduce(matrix, 2, 1, numpy.mean)))
+    self.assertTrue(quick_plot.AggregateMatrix(matrix, 100, 20, 'mean')
+                    is matrix)
+
+
+class BinCountsTest(unittest.TestCase):
+  def testMatchesHistogram(self):
+    values = numpy.concatenate((RandomColumns(10000, 1)[:, 0],
+                                numpy.linspace(-2, 2, 41)))
+    for num_bins in (1, 7, 10, 40):
+      edges = numpy.linspace(-2, 2, num_bins + 1)
+      expected = numpy.histogram(values, bins=edges)[0]
+      self.assertTrue(numpy.array_equal(
+        quick_plot.BinCounts(values, edges), expected))
+  def testSkipsNaN(self):
+    values = numpy.array([0.0, numpy.nan, 1.0])
+    edges = numpy.linspace(0, 1, 3)
+    self.assertEqual(list(quick_plot.BinCounts(values, edges)), [1, 1])
+
+
+class Histogram2DTest(unittest.TestCase):
+  def testExact(self):
+    x = numpy.array([0.0, 0.5, 1.0, 1.0, 0.2])
+    y = numpy.array([0.0, 0.0, 1.0, 2.0, 0.9])
+    H, xedges, yedges = quick_plot.Histogram2D(x, y, 2, [[0, 1], [0, 1]])
+    # H[i, j] counts x bin i and y bin j, the last bins hold their upper
+    # edge and points off the limits are not counted
+    self.assertTrue(numpy.array_equal(H, [[1, 1], [1, 1]]))
+    self.assertTrue(numpy.array_equal(xedges, [0.0, 0.5, 1.0]))
+    self.assertTrue(numpy.array_equal(yedges, [0.0, 0.5, 1.0]))
+  def testChunksMatchOnePass(self):
+    values = RandomColumns(1000, 2)
+    limits = [[-2, 2], [-3, 3]]
+    chunk_rows = quick_plot.HISTOGRAM_CHUNK_ROWS
+    quick_plot.HISTOGRAM_CHUNK_ROWS = 77
+    try:
+      H = quick_plot.Histogram2D(values[:, 0], values[:, 1], 9, limits)[0]
+    finally:
+      quick_plot.HISTOGRAM_CHUNK_ROWS = chunk_rows
+    expected = numpy.histogram2d(values[:, 0], values[:, 1], bins=9,
+                                 range=limits)[0]
+    self.assertTrue(numpy.array_equal(H, expected))
+  def testEmpty(self):
+    H = quick_plot.Histogram2D(numpy.array([]), numpy.array([]), 3,
+                               [[0, 1], [0, 1]])[0]
+    self.assertTrue(numpy.array_equal(H, numpy.zeros((3, 3))))
+
+
+class SmoothHistogramTest(unittest.TestCase):
+  def Convolve(self, H, sigma):
+    """ convolve H with the Gaussian kernel one cell at a time, as if H
+    were surrounded by zeros.
+    """
+    reach = int(numpy.ceil(4 * sigma))
+    offsets = numpy.arange(-reach, reach + 1)
+    kernel = numpy.exp(-0.5 * (offsets / float(sigma)) ** 2)
+    kernel = numpy.outer(kernel, kernel) / kernel.sum() ** 2
+    padded = numpy.zeros((H.shape[0] + 2 * reach, H.shape[1] + 2 * reach))
+    padded[reach:-reach, reach:-reach] = H
+    smoothed = numpy.zeros(H.shape)
+    for i in xrange(H.shape[0]):
+      for j in xrange(H.shape[1]):
+        smoothed[i, j] = (padded[i:i + 2 * reach + 1, j:j + 2 * reach + 1]
+                          * kernel).sum()
+    return smoothed
+  def testMatchesDirectConvolution(self):
+    H = numpy.random.RandomState(0).poisson(3.0, size=(9, 14)).astype(float)
+    for sigma in (0.5, 1.0, 2.5):
+      smoothed = quick_plot.SmoothHistogram(H, sigma)
+      self.assertEqual(smoothed.shape, H.shape)
+      self.assertTrue(numpy.allclose(smoothed, self.Convolve(H, sigma)))
+      self.assertTrue((smoothed >= 0).all())
+  def testKeepsCountsAwayFromEdges(self):
+    H = numpy.zeros((21, 21))
+    H[10, 10] = 5.0
+    smoothed = quick_plot.SmoothHistogram(H, 1.5)
+    self.assertTrue(numpy.allclose(smoothed.sum(), 5.0))
+    self.assertTrue(numpy.allclose(smoothed, smoothed.T))
+    self.assertEqual(numpy.argmax(smoothed), 10 * 21 + 10)
+
+
+class PixelGridTest(unittest.TestCase):
+  """ Axis limits not given on the command line are sys.maxint and
+  -sys.maxint.
+  """
+  def testPadding(self):
+    values = [numpy.arange(11.0)]
+    self.assertEqual(
+      quick_plot.PixelGrid(values, False, 0.0, 10.0, sys.maxint,
+                           -sys.maxint, 99.6),
+      (-0.5, 10.5, 100, False))
+    self.assertEqual(
+      quick_plot.PixelGrid(values, False, 0.0, 10.0, 2.0, -sys.maxint,
+                           0.2),
+      (2.0, 10.5, 1, False))
+  def testLog(self):
+    values = [numpy.array([-1.0, 0.0, 1.0]), numpy.array([100.0])]
+    a_min, a_max, num_pixels, is_log = quick_plot.PixelGrid(
+      values, True, -1.0, 100.0, sys.maxint, -sys.maxint, 10)
+    self.assertTrue(numpy.allclose([a_min, a_max], [10 ** -0.1, 10 ** 2.1]))
+    self.assertEqual((num_pixels, is_log), (10, True))
+    self.assertRaises(quick_plot.BadInput, quick_plot.PixelGrid,
+                      [numpy.array([-1.0, 0.0])], True, -1.0, 0.0,
+                      sys.maxint, -sys.maxint, 10)
+
+
+class CountPixelsTest(unittest.TestCase):
+  def Count(self, x, y, x_grid, y_grid):
+    d = quick_plot.Data()
+    d.x, d.y = numpy.array(x), numpy.array(y)
+    return quick_plot.CountPixels(d, x_grid, y_grid)
+  def testExact(self):
+    x = [0.5, 0.5, 3.9, 4.0, -0.1, numpy.nan, 1.0]
+    y = [0.5, 0.5, 1.5, 1.0, 1.0, 1.0, 2.0]
+    counts = self.Count(x, y, (0.0, 4.0, 4, False), (0.0, 2.0, 2, False))
+    # off the axes, on the upper limit and NaN are not counted
+    self.assertTrue(numpy.array_equal(counts, [[2, 0, 0, 0],
+                                               [0, 0, 0, 1]]))
+  def testLog(self):
+    counts = self.Count([0.0, -5.0, 5.0, 50.0, 50.0], [0.5] * 5,
+                        (1.0, 100.0, 2, True), (0.0, 1.0, 1, False))
+    self.assertTrue(numpy.array_equal(counts, [[1, 2]]))
+  def testMatchesHistogram2D(self):
+    values = RandomColumns(1000, 2)
+    chunk_rows = quick_plot.AGGREGATE_CHUNK_ROWS
+    quick_plot.AGGREGATE_CHUNK_ROWS = 77
+    try:
+      counts = self.Count(values[:, 0], values[:, 1], (-2.5, 2.5, 13, False),
+                          (-3.0, 3.0, 7, False))
+    finally:
+      quick_plot.AGGREGATE_CHUNK_ROWS = chunk_rows
+    expected = numpy.histogram2d(values[:, 1], values[:, 0], bins=(7, 13),
+                                 range=[[-3.0, 3.0], [-2.5, 2.5]])[0]
+    self.assertTrue(numpy.array_equal(counts, expected))
+
+
+class BlendCountsTest(QuickPlotTestCase):
+  def testLayers(self):
+    path = self.WriteFile('a.txt', '1 2\n')
+    args = self.Arguments([path], '--mode', 'scatter')
+    first = numpy.array([[4, 0, 4, 1]])
+    second = numpy.array([[0, 0, 4, 0]])
+    rgba = quick_plot.BlendCounts([first, second], args)
+    colors = [matplotlib.colors.to_rgb(quick_plot.ColorPicker(i, args))
+              for i in (0, 1)]
+    # the most crowded pixels are opaque, later files on top
+    self.assertTrue(numpy.allclose(rgba[0, 0], colors[0] + (1.0,)))
+    self.assertTrue(numpy.array_equal(rgba[0, 1], [0.0, 0.0, 0.0, 0.0]))
+    self.assertTrue(numpy.allclose(rgba[0, 2], colors[1] + (1.0,)))
+    # a lone point gets the faintest shade
+    self.assertTrue(numpy.allclose(rgba[0, 3], colors[0] + (
+      quick_plot.AGGREGATE_MIN_SHADE,)))
+  def testColormap(self):
+    path = self.WriteFile('a.txt', '1 2\n')
+    args = self.Arguments([path], '--mode', 'scatter', '--aggregate_cmap',
+                          'hot', '--alpha', '0.5')
+    rgba = quick_plot.BlendCounts([numpy.array([[1, 0, 2]]),
+                                   numpy.array([[3, 0, 0]])], args)
+    cmap = quick_plot.plt.get_cmap('hot')
+    self.assertTrue(numpy.allclose(rgba[0, 0, :3], cmap(1.0)[:3]))
+    self.assertTrue(numpy.allclose(rgba[0, 2, :3], cmap(
+      quick_plot.CountShades(numpy.array(2), 4))[:3]))
+    self.assertTrue(numpy.array_equal(rgba[0, :, 3], [0.5, 0.0, 0.5]))
+
+
+class RegressionStatsTest(unittest.TestCase):
+  def testMatchesLinregress(self):
+    random = numpy.random.RandomState(1)
+    x = random.uniform(1e6, 1e6 + 10, 5000)
+    y = 0.01 * x + random.normal(size=5000)
+    stats = quick_plot.RegressionStats()
+    for start in xrange(0, 5000, 777):
+      stats.add(x[start:start + 777], y[start:start + 777])
+    expected = scipy.stats.linregress(x, y)
+    self.assertTrue(numpy.allclose(stats.fit(), expected[:4], rtol=1e-6))
+  def testSkipsNaN(self):
+    stats = quick_plot.RegressionStats()
+    stats.add(numpy.array([0.0, 1.0, numpy.nan, 2.0]),
+              numpy.array([1.0, 3.0, 4.0, numpy.nan]))
+    self.assertEqual(stats.n, 2)
+    slope, intercept, r, p = stats.fit()
+    self.assertAlmostEqual(slope, 2.0)
+    self.assertAlmostEqual(intercept, 1.0)
+
+
+class BinnedDensityTest(unittest.TestCase):
+  def testMatchesGaussianKde(self):
+    random = numpy.random.RandomState(2)
+    values = numpy.concatenate((random.normal(size=20000),
+                                random.normal(5, 0.5, 10000)))
+    x_data = numpy.linspace(values.min(), values.max(), 200)
+    for covariance in (None, 0.1):
+      kde = scipy.stats.gaussian_kde(values)
+      if covariance is not None:
+        kde.covariance_factor = lambda : covariance
+        kde._compute_covariance()
+      expected = kde(x_data)
+      got = quick_plot.BinnedDensity(values, x_data, covariance)
+      self.assertTrue(numpy.max(numpy.abs(got - expected)) <
+                      0.005 * numpy.max(expected))
+  def testConstantValues(self):
+    values = numpy.ones(100)
+    self.assertEqual(
+      quick_plot.BinnedDensity(values, numpy.linspace(0, 2, 10), None), None)
+
+
+class LargestTrianglesTest(unittest.TestCase):
+  def testMatchesLoop(self):
+    random = numpy.random.RandomState(4)
+    x = numpy.arange(100.0)
+    y = random.normal(size=100)
+    counts = numpy.array([1, 20, 30, 9, 40])
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    got = quick_plot.LargestTriangles(x, y, starts, counts)
+    means = [(x[s:s + n].mean(), y[s:s + n].mean())
+             for s, n in zip(starts, counts)]
+    for b, (s, n) in enumerate(zip(starts, counts)):
+      prev = means[b - 1] if b else (x[0], y[0])
+      following = means[b + 1] if b + 1 < len(counts) else (x[-1], y[-1])
+      areas = [abs((prev[0] - following[0]) * (y[i] - prev[1]) -
+                   (prev[0] - x[i]) * (following[1] - prev[1]))
+               for i in xrange(s, s + n)]
+      self.assertEqual(got[b], s + numpy.argmax(areas))
+
+
+class MemoryBudgetTest(QuickPlotTestCase):
+  def testEstimate(self):
+    values = RandomColumns(20000, 3)
+    path = self.WriteColumns('a.txt', values, header='# a b c')
+    args = self.Arguments([path])
+    chunk_bytes = quick_plot.PARSE_CHUNK_BYTES
+    quick_plot.PARSE_CHUNK_BYTES = 50000
+    try:
+      rows, columns = quick_plot.EstimateInput(path, args)
+    finally:
+      quick_plot.PARSE_CHUNK_BYTES = chunk_bytes
+    self.assertEqual(columns, 3)
+    self.assertTrue(abs(rows - 20000) < 1000)
+  def testWithinBudget(self):
+    path = self.WriteColumns('a.txt', RandomColumns(1000, 2))
+    args = self.Arguments([path], '--max_memory', '10')
+    quick_plot.ApplyMemoryBudget(args)
+    self.assertFalse(args.stream)
+    self.assertEqual(args.downsample, None)
+  def testOverBudget(self):
+    path = self.WriteColumns('a.txt', RandomColumns(20000, 2))
+    args = self.Arguments([path], '--mode', 'scatter', '--max_memory',
+                          '0.1')
+    quick_plot.ApplyMemoryBudget(args)
+    self.assertTrue(args.stream)
+    self.assertEqual(args.downsample, int(0.1 * 1048576 / 32))
+    self.assertEqual(args.decimate, None)
+    args = self.Arguments([path], '--mode', 'line', '--max_memory', '0.1')
+    quick_plot.ApplyMemoryBudget(args)
+    self.assertTrue(args.stream)
+    self.assertEqual(args.decimate, 'minmax')
+    args = self.Arguments([path], '--mode', 'hist', '--max_memory', '0.1')
+    quick_plot.ApplyMemoryBudget(args)
+    self.assertTrue(args.stream)
+    self.assertEqual(args.downsample, None)
+
+
+class StreamTest(QuickPlotTestCase):
+  """ Streaming reads must give what reading the whole input does.
+  """
+  def testReservoirHoldingEveryRow(self):
+    values = RandomColumns(300, 3)
+    path = self.WriteColumns('a.txt', values)
+    whole = quick_plot.ReadFile(path, self.Arguments([path], '--columns',
+                                                     '1,3'))[0]
+    args = self.Arguments([path], '--columns', '1,3', '--stream',
+                          '--downsample', '1000')
+    streamed = quick_plot.ReadFile(path, args)[0]
+    self.assertTrue(numpy.array_equal(whole.x, streamed.x))
+    self.assertTrue(numpy.array_equal(whole.y, streamed.y))
+    self.assertEqual(whole.limits, streamed.limits)
+  def testHistogram(self):
+    values = RandomColumns(10000, 2)
+    values[:, 0] = numpy.arange(10000)
+    path = self.WriteColumns('a.txt', values)
+    for columns in ('2', '1,2', '2,1'):
+      whole = quick_plot.ReadFile(path, self.Arguments(
+        [path], '--mode', 'hist', '--columns', columns))[0]
+      args = self.Arguments([path], '--mode', 'hist', '--columns', columns,
+                            '--stream')
+      args.hist_edges = quick_plot.HistogramEdges(args)
+      counts, edges = quick_plot.ReadFile(path, args)[0].histogram
+      expected, expected_edges = numpy.histogram(whole.y,
+                                                 bins=args.hist_bins)
+      self.assertTrue(numpy.array_equal(counts, expected))
+      self.assertTrue(numpy.allclose(edges, expected_edges))
+
+
+class ServeTest(QuickPlotTestCase):
+  def testReadsStdin(self):
+    path = self.WriteFile('a.txt', '1 2\n')
+    self.assertTrue(quick_plot.ReadsStdin([path, '-']))
+    self.assertFalse(quick_plot.ReadsStdin([path, '--title', '-']))
+    self.assertFalse(quick_plot.ReadsStdin([path, '--xlabel=-']))
+    # left for Run() to report
+    self.assertFalse(quick_plot.ReadsStdin(['-', '--bogus']))
+  def testSocketDirectory(self):
+    socket_path = os.path.join(self.directory, 'run', 'quick_plot.sock')
+    quick_plot.SocketDirectory(socket_path)
+    st = os.stat(os.path.dirname(socket_path))
+    self.assertEqual(st.st_mode & 0o777, 0o700)
+    self.assertEqual(st.st_uid, os.getuid())
+
+
+class BatchTest(QuickPlotTestCase):
+  def testManifest(self):
+    shared = self.WriteColumns('shared.txt', RandomColumns(100, 2))
+    bad = self.WriteFile('bad.txt', '1 2\n3 4 5\n')
+    missing = os.path.join(self.directory, 'missing.txt')
+    lines = []
+    for a_file, mode in ((shared, 'scatter'), (shared, 'line'),
+                         (missing, 'line'), (bad, 'line')):
+      lines.append('%s --mode %s --out_format png --no_legend --out %s'
+                   % (a_file, mode, os.path.join(self.directory, mode)))
+    manifest = self.WriteFile('manifest.txt', '\n'.join(lines) + '\n')
+    # every read of a file, from the parse or from a plot, in any process
+    log = os.path.join(self.directory, 'reads.log')
+    read = quick_plot.ColumnReader.read
+    def LoggedRead(reader, f):
+      log_file = open(log, 'a')
+      log_file.write(reader.label + '\n')
+      log_file.close()
+      return read(reader, f)
+    quick_plot.ColumnReader.read = LoggedRead
+    stderr = sys.stderr
+    sys.stderr = io.BytesIO()
+    try:
+      status = quick_plot.Batch(manifest, 2, None)
+      summary = sys.stderr.getvalue()
+    finally:
+      quick_plot.ColumnReader.read = read
+      sys.stderr = stderr
+    self.assertEqual(status, 1)
+    reads = open(log).read().split()
+    # the shared input is parsed once for both of its plots, the bad one
+    # again by its plot, to report the error
+    self.assertEqual(reads.count('shared.txt'), 1)
+    self.assertEqual(reads.count('bad.txt'), 2)
+    self.assertTrue(os.path.getsize(os.path.join(self.directory,
+                                                 'scatter.png')) > 0)
+    self.assertTrue('batch: 4 plots, 2 drawn, 2 failed\n' in summary)
+    failed = summary[summary.index('batch: '):].splitlines()[1:]
+    self.assertEqual(len(failed), 2)
+    self.assertTrue(failed[0].startswith('  line 3: '))
+    self.assertTrue(failed[0].endswith('error: File %s does not exist.'
+                                       % missing))
+    self.assertTrue(failed[1].startswith('  line 4: BadInput: '))
+
+
+class ErrorLineTest(unittest.TestCase):
+  def testTraceback(self):
+    stderr = ('Traceback (most recent call last):\n'
+              '  File "quick_plot.py", line 1, in <module>\n'
+              '    Main()\n'
+              'BadInput: Input file a had 2 columns, switches to 3 columns '
+              'on line 2:\n'
+              '3 4 5\n')
+    self.assertEqual(quick_plot.ErrorLine(stderr),
+                     'BadInput: Input file a had 2 columns, switches to 3 '
+                     'columns on line 2:')
+  def testArgumentError(self):
+    stderr = ('usage: quick_plot.py file1 file2 file3... [options]\n'
+              'quick_plot.py: error: unrecognized arguments: --x\n')
+    self.assertEqual(quick_plot.ErrorLine(stderr),
+                     'quick_plot.py: error: unrecognized arguments: --x')
+  def testEmpty(self):
+    self.assertEqual(quick_plot.ErrorLine(''), '')
+
+
+class PlotArraysTest(QuickPlotTestCase):
+  def testFormatsWithoutFork(self):
+    x = numpy.arange(100.0)
+    out = os.path.join(self.directory, 'arrays')
+    cpu_count = quick_plot.multiprocessing.cpu_count
+    fork = quick_plot.os.fork
+    quick_plot.multiprocessing.cpu_count = lambda: 4
+    quick_plot.os.fork = lambda: self.fail('PlotArrays forked')
+    try:
+      quick_plot.PlotArrays([numpy.vstack([x, x * x]).T], out=out,
+                            out_format='all', no_legend=True)
+    finally:
+      quick_plot.multiprocessing.cpu_count = cpu_count
+      quick_plot.os.fork = fork
+    for out_format in ('pdf', 'png', 'eps'):
+      self.assertTrue(os.path.getsize(out + '.' + out_format) > 0)
+
+
+class WriteImageTest(unittest.TestCase):
+  def testPngFromAggDrawing(self):
+    fig = quick_plot.plt.figure(figsize=(4, 3), dpi=72)
+    fig.add_subplot(111).plot(numpy.arange(10.0) ** 2)
+    expected = io.BytesIO()
+    fig.savefig(expected, format='png', dpi=72)
+    fig.canvas.draw()
+    got = io.BytesIO()
+    quick_plot.WriteAggPng(fig, got)
+    quick_plot.plt.close(fig)
+    self.assertEqual(got.getvalue(), expected.getvalue())
+
+
+if __name__ == '__main__':
+  unittest.main()